@@ -8,18 +8,863 @@ license: MIT
 import os
 import sqlite3
 import json
-from typing import Callable, Any
+from typing import Callable, Any, Optional
 import asyncio
 import datetime
 from pydantic import BaseModel, Field
-import tarfile
-import socket
 import threading
-from http.server import SimpleHTTPRequestHandler
-from socketserver import TCPServer
+from urllib.parse import quote
+import zlib
+import re
+import struct
+import time
+import queue
+import atexit
+import sys
+import random
+import inspect
+import functools
+import contextlib
+import contextvars
+import heapq
+import itertools
+from collections import Counter
+
+try:
+    import fcntl
+except ImportError:  # Windows: file locks become no-ops
+    fcntl = None
 
 from blueprints.function_calling_blueprint import Pipeline as FunctionCallingBlueprint
 
+# Open WebUI compiles a tool file from source on every load, so classes only
+# some calls or valves need are kept as source and compiled on first use:
+# through _deferred() in this file, through the module __getattr__ from outside.
+_DEFERRED = {}  # class name -> (line of _defer in this file, source)
+_deferred_lock = threading.Lock()
+
+
+def _defer(source: str):
+    """Register the classes defined in source for compilation on first use."""
+    line = sys._getframe(1).f_lineno
+    for name in re.findall(r"^class (\w+)", source, re.MULTILINE):
+        _DEFERRED[name] = (line, source)
+
+
+def _deferred(name: str, load: bool = True):
+    """Return a deferred class, compiling its source into the module on first use.
+
+    With load False, None is returned if it was not compiled yet.
+    """
+    if name not in globals():
+        if not load:
+            return None
+        with _deferred_lock:
+            if name not in globals():
+                line, source = _DEFERRED[name]
+                # Padded so tracebacks and profiles show the lines of this file
+                code = compile(
+                    "\n" * line + source, globals().get("__file__", __name__), "exec"
+                )
+                exec(code, globals())
+    return globals()[name]
+
+
+def __getattr__(name: str):
+    if name in _DEFERRED:
+        return _deferred(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+_defer(
+    r'''
+class ToolProfiler:
+    """Capture of one tool call: sampled stacks, allocations and SQL statements.
+
+    A helper thread samples the calling thread's stack every interval seconds.
+    Stacks go to a collapsed-stack .folded file (one "outer;...;inner count"
+    line per distinct stack, ready for flamegraph tools), everything else to a
+    .json summary next to it. Only one call is captured at a time.
+    """
+
+    _busy = threading.Lock()
+
+    def __init__(self, directory: str, max_files: int, interval: float = 0.005):
+        self.directory = directory
+        self.max_files = max_files
+        self.interval = interval
+        self.samples = Counter()
+        self.statements = []  # (seconds since start, SQL text)
+        self._thread_id = threading.get_ident()
+        self._stopped = threading.Event()
+        self._sampler = threading.Thread(
+            target=self._sample, name="tool-profiler", daemon=True
+        )
+        import tracemalloc  # Only profiled calls pay for loading it
+
+        self._own_tracemalloc = not tracemalloc.is_tracing()
+        if self._own_tracemalloc:
+            tracemalloc.start()
+        else:
+            tracemalloc.reset_peak()
+        self._started_at = datetime.datetime.now()
+        self._started = time.perf_counter()
+        self._sampler.start()
+
+    @classmethod
+    def start(cls, sample_rate: float, directory: str, max_files: int):
+        """Return a running capture for sample_rate of calls, otherwise None."""
+        if sample_rate <= 0 or random.random() >= sample_rate:
+            return None
+        if not cls._busy.acquire(blocking=False):
+            return None  # Another call is being captured
+        try:
+            return cls(directory, max_files)
+        except Exception:
+            cls._busy.release()
+            raise
+
+    def trace_sql(self, statement: str):
+        """sqlite3 trace callback; may be called from any connection's thread."""
+        self.statements.append((time.perf_counter() - self._started, statement))
+
+    def stop(self, tool_name: str):
+        """Finish the capture and write it to the profile directory."""
+        import tracemalloc
+
+        wall = time.perf_counter() - self._started
+        self._stopped.set()
+        self._sampler.join()
+        try:
+            _, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().statistics("lineno")[:10]
+            if self._own_tracemalloc:
+                tracemalloc.stop()
+            self._write(tool_name, wall, peak, top)
+        except OSError as e:
+            print(f"Error writing profile for {tool_name}: {e}")
+        finally:
+            self._busy.release()
+
+    def _sample(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                )
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def _write(self, tool_name: str, wall: float, peak: int, top):
+        os.makedirs(self.directory, exist_ok=True)
+        stem = f"{self._started_at.strftime('%Y%m%d%H%M%S%f')}_{tool_name}"
+        with open(os.path.join(self.directory, stem + ".folded"), "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        # A statement's span runs until the next one starts, or the call ends.
+        ends = [start for start, _ in self.statements[1:]] + [wall]
+        summary = {
+            "tool": tool_name,
+            "started": self._started_at.strftime("%Y-%m-%d_%H:%M:%S"),
+            "wall_ms": round(wall * 1000, 3),
+            "sample_interval_ms": self.interval * 1000,
+            "samples": sum(self.samples.values()),
+            "memory": {
+                "peak_kib": round(peak / 1024, 1),
+                "top_allocations": [
+                    {
+                        "where": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                        "size_kib": round(stat.size / 1024, 1),
+                        "count": stat.count,
+                    }
+                    for stat in top
+                ],
+            },
+            "sql": [
+                {
+                    "start_ms": round(start * 1000, 3),
+                    "span_ms": round((end - start) * 1000, 3),
+                    "statement": statement,
+                }
+                for (start, statement), end in zip(self.statements, ends)
+            ],
+            "collapsed_stacks": stem + ".folded",
+        }
+        with open(os.path.join(self.directory, stem + ".json"), "w") as f:
+            json.dump(summary, f, indent=2)
+        self._rotate()
+
+    def _rotate(self):
+        """Keep only the newest max_files captures."""
+        captures = sorted(
+            name[:-5] for name in os.listdir(self.directory) if name.endswith(".json")
+        )
+        for stem in captures[: max(len(captures) - self.max_files, 0)]:
+            for suffix in (".json", ".folded"):
+                try:
+                    os.remove(os.path.join(self.directory, stem + suffix))
+                except FileNotFoundError:
+                    pass
+'''
+)
+
+
+def profile_tool_calls(cls):
+    """Class decorator routing every public coroutine method through cls._invoke."""
+
+    def route(method):
+        @functools.wraps(method)  # Keeps the signature and docstring tool specs use
+        async def wrapper(self, *args, **kwargs):
+            return await self._invoke(method, *args, **kwargs)
+
+        return wrapper
+
+    for name, method in list(vars(cls).items()):
+        if not name.startswith("_") and inspect.iscoroutinefunction(method):
+            setattr(cls, name, route(method))
+    return cls
+
+
+class AdmissionOverloaded(Exception):
+    """A tool call was rejected because the memory store is saturated."""
+
+
+class AdmissionController:
+    """Global and per-file concurrency limits for tool calls, with a bounded priority queue.
+
+    Calls over either limit wait in a queue ordered by priority class
+    (interactive reads, then writes, then bulk writes and exports) and then by
+    arrival. A call is rejected with AdmissionOverloaded when the queue is full
+    or when it waited longer than max_wait, so overload shows up as fast errors
+    rather than ever growing latency. Waiters may run on different event
+    loops, so they are woken through call_soon_threadsafe.
+
+    for_limits() hands out one controller per set of limits, so callers
+    configured alike share their slots and none overrides another's limits.
+    """
+
+    PRIORITIES = ("interactive", "write", "bulk")
+
+    _controllers = (
+        {}
+    )  # (max_concurrent, max_per_file, max_queued, max_wait) -> controller
+    _registry_lock = threading.Lock()
+    # (controller, slot) of the call running in this context; nested tool
+    # calls reuse the slot while it is held.
+    _current = contextvars.ContextVar("admission_slot", default=None)
+
+    def __init__(self):
+        self.max_concurrent = 8
+        self.max_per_file = 4
+        self.max_queued = 32
+        self.max_wait = 10.0
+        self._lock = threading.Lock()
+        self._active = 0
+        self._active_per_file = Counter()
+        self._queue = []  # Heap of [rank, seq, key, loop, future]
+        self._seq = itertools.count()
+        self._max_depth = 0
+        self._stats = {
+            priority: {
+                "admitted": 0,
+                "rejected": 0,
+                "timed_out": 0,
+                "wait_total": 0.0,
+                "wait_max": 0.0,
+            }
+            for priority in self.PRIORITIES
+        }
+
+    @classmethod
+    def for_limits(
+        cls, max_concurrent: int, max_per_file: int, max_queued: int, max_wait: float
+    ):
+        limits = (max_concurrent, max_per_file, max_queued, max_wait)
+        with cls._registry_lock:
+            controller = cls._controllers.get(limits)
+            if controller is None:
+                controller = cls._controllers[limits] = cls()
+                controller.configure(*limits)
+            return controller
+
+    def configure(
+        self, max_concurrent: int, max_per_file: int, max_queued: int, max_wait: float
+    ):
+        with self._lock:
+            self.max_concurrent = max(max_concurrent, 1)
+            self.max_per_file = max(max_per_file, 1)
+            self.max_queued = max(max_queued, 0)
+            self.max_wait = max_wait
+            self._dispatch()  # Raised limits may admit waiters
+
+    @contextlib.asynccontextmanager
+    async def admit(self, key: str, priority: str):
+        """Hold a slot for key while the block runs, waiting or failing as the limits say."""
+        current = self._current.get()
+        if current is not None and current[1]:
+            yield  # Nested call, e.g. from execute_functions_sequentially
+            return
+        await self._acquire(key, priority)
+        slot = [key]
+        token = self._current.set((self, slot))
+        try:
+            yield
+        finally:
+            self._current.reset(token)
+            self._release(slot)
+
+    @classmethod
+    def release_current(cls):
+        """Give back the running call's slot early, before it idles without touching the store.
+
+        Calls made afterwards in the same context are admitted on their own.
+        """
+        current = cls._current.get()
+        if current is not None:
+            controller, slot = current
+            controller._release(slot)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "active": self._active,
+                "active_per_file": dict(self._active_per_file),
+                "queue_depth": len(self._queue),
+                "max_queue_depth": self._max_depth,
+                "limits": {
+                    "max_concurrent": self.max_concurrent,
+                    "max_per_file": self.max_per_file,
+                    "max_queued": self.max_queued,
+                    "max_wait_seconds": self.max_wait,
+                },
+                "calls": {
+                    priority: {
+                        "admitted": stats["admitted"],
+                        "rejected": stats["rejected"],
+                        "timed_out": stats["timed_out"],
+                        "avg_wait_ms": round(
+                            stats["wait_total"] / max(stats["admitted"], 1) * 1000, 3
+                        ),
+                        "max_wait_ms": round(stats["wait_max"] * 1000, 3),
+                    }
+                    for priority, stats in self._stats.items()
+                },
+            }
+
+    async def _acquire(self, key: str, priority: str):
+        stats = self._stats[priority]
+        started = time.monotonic()
+        with self._lock:
+            if self._has_room(key):
+                # Waiters left after _dispatch are blocked, so this cannot jump one
+                # that could run.
+                self._take(key)
+                stats["admitted"] += 1
+                return
+            if len(self._queue) >= self.max_queued:
+                stats["rejected"] += 1
+                raise AdmissionOverloaded(
+                    f"{self._active} calls running and {len(self._queue)} queued"
+                )
+            loop = asyncio.get_running_loop()
+            entry = [
+                self.PRIORITIES.index(priority),
+                next(self._seq),
+                key,
+                loop,
+                loop.create_future(),
+            ]
+            heapq.heappush(self._queue, entry)
+            self._max_depth = max(self._max_depth, len(self._queue))
+            max_wait = self.max_wait
+        # Not wait_for: on Python 3.11 it swallows a cancel that races the wake-up.
+        try:
+            done, _ = await asyncio.wait([entry[4]], timeout=max_wait)
+        except asyncio.CancelledError:
+            if not self._unqueue(entry):
+                self._release([key])  # Admitted just as the caller went away
+            raise
+        if not done:
+            if self._unqueue(entry):
+                with self._lock:
+                    stats["timed_out"] += 1
+                raise AdmissionOverloaded(
+                    f"no slot became free within {max_wait} seconds"
+                )
+            # Admitted just as the wait timed out: run the call.
+        waited = time.monotonic() - started
+        with self._lock:
+            stats["admitted"] += 1
+            stats["wait_total"] += waited
+            stats["wait_max"] = max(stats["wait_max"], waited)
+
+    def _unqueue(self, entry: list) -> bool:
+        """Drop a waiter from the queue; False if it was admitted already."""
+        with self._lock:
+            if entry not in self._queue:
+                return False
+            self._queue.remove(entry)
+            heapq.heapify(self._queue)
+            return True
+
+    def _has_room(self, key: str) -> bool:
+        return (
+            self._active < self.max_concurrent
+            and self._active_per_file[key] < self.max_per_file
+        )
+
+    def _take(self, key: str):
+        self._active += 1
+        self._active_per_file[key] += 1
+
+    def _release(self, slot: list):
+        with self._lock:
+            if not slot:
+                return  # Already released early
+            key = slot.pop()
+            self._active -= 1
+            self._active_per_file[key] -= 1
+            if not self._active_per_file[key]:
+                del self._active_per_file[key]
+            self._dispatch()
+
+    def _dispatch(self):
+        """Admit queued calls in priority order while there is room; caller holds _lock."""
+        blocked = []
+        while self._queue and self._active < self.max_concurrent:
+            entry = heapq.heappop(self._queue)
+            if self._active_per_file[entry[2]] >= self.max_per_file:
+                blocked.append(entry)  # Its file is busy; later entries may still fit
+                continue
+            try:
+                entry[3].call_soon_threadsafe(self._wake, entry[4])
+            except RuntimeError:
+                continue  # The waiter's event loop is closed
+            self._take(entry[2])
+        for entry in blocked:
+            heapq.heappush(self._queue, entry)
+
+    @staticmethod
+    def _wake(future):
+        if not future.done():
+            future.set_result(None)
+
+
+_defer(
+    r'''
+class ToolCallRecorder:
+    """Opt-in log of tool calls for replaying real traffic with ToolCallReplayer.
+
+    Each top-level call becomes one JSON line in a gzip trace file:
+    {"ts": start epoch, "tool": name, "file": memory file, "params": {...},
+    "ms": duration, "error": exception or null}. Nested calls are not written
+    because replaying their caller repeats them. Lines are buffered and
+    written as one gzip member per batch, so a trace can be read while it
+    grows.
+
+    Parameters are anonymized before they are buffered. Every word and digit
+    run becomes a pseudonym of the same length and capitalisation, so a word
+    maps to the same pseudonym throughout the traces, which keeps duplicate
+    and lookup patterns intact. Values of KEEP_PARAMS are not sensitive and
+    are kept as they are, and so are values of TIMESTAMP_PARAMS shaped like
+    a timestamp, so point-in-time reads replay as valid ones.
+
+    Memory file names, in FILE_PARAMS and the "file" field, each become one
+    whole pseudonym that keeps the file suffix ("notes" and "notes.db" give
+    file_<hash> and file_<hash>.db). Both kinds of pseudonym are keyed by a
+    secret kept in the trace directory and shared by every worker's trace,
+    so one file has one name across all of them, and the replayer can give
+    the copied files the same names and their memos the same words. Traces
+    shared without that key file stay anonymous.
+    """
+
+    KEEP_PARAMS = frozenset({"tag", "by", "name", "download_all"})
+    TIMESTAMP_PARAMS = frozenset({"timestamp"})
+    TIMESTAMP = re.compile(r"\d{4}-\d\d-\d\d(?:[ _T]\d\d:\d\d(?::\d\d)?)?")
+    FILE_PARAMS = frozenset({"file_to_delete", "new_file_name", "memory_file_name"})
+    FILE_KEY = ".file_names.key"
+    # Memory file stem and suffix, including the sidecars of a file
+    FILE_NAME = re.compile(
+        r"(.+?)((?:\.db|\.log)(?:-wal|-shm|-journal)?|\.spool(?:\.replay)?)?$",
+        re.DOTALL,
+    )
+    FLUSH_LINES = 50
+    FLUSH_SECONDS = 5.0
+
+    _recorders = {}
+    _registry_lock = threading.Lock()
+    # Set while a recorded (or replayed) call runs; calls made inside are not recorded.
+    _recording = contextvars.ContextVar("recording_tool_call", default=False)
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.path = os.path.join(
+            directory,
+            f"{datetime.datetime.now().strftime('%Y%m%d%H%M%S%f')}_{os.getpid()}.trace.gz",
+        )
+        try:
+            self._file_key = self.file_key(directory)
+        except OSError as e:  # Names then only agree within this trace
+            print(f"Error reading trace file name key in {directory}: {e}")
+            self._file_key = os.urandom(16)
+        self._word_key = self.word_key(self._file_key)
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._flushed = time.monotonic()
+
+    @classmethod
+    def for_directory(cls, directory: str):
+        with cls._registry_lock:
+            recorder = cls._recorders.get(directory)
+            if recorder is None:
+                recorder = cls._recorders[directory] = cls(directory)
+                if len(cls._recorders) == 1:
+                    atexit.register(cls.flush_all)
+            return recorder
+
+    @classmethod
+    def file_key(cls, directory: str, create: bool = True):
+        """Secret keying the file name pseudonyms of directory's traces (None if missing)."""
+        path = os.path.join(directory, cls.FILE_KEY)
+        if not os.path.exists(path):
+            if not create:
+                return None
+            os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}"
+            with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT, 0o600), "wb") as f:
+                f.write(os.urandom(16))
+            try:
+                os.link(tmp_path, path)  # Complete, and only the first worker's
+            except FileExistsError:
+                pass
+            finally:
+                os.remove(tmp_path)
+        with open(path, "rb") as f:
+            return f.read()
+
+    @staticmethod
+    def word_key(file_key: bytes) -> bytes:
+        """Secret keying the word pseudonyms, derived from the file name key."""
+        import hashlib
+
+        return hashlib.blake2b(b"words", key=file_key, digest_size=16).digest()
+
+    @classmethod
+    def file_pseudonym(cls, name: str, key: bytes) -> str:
+        import hashlib  # Only recorded calls load it
+
+        stem, suffix = cls.FILE_NAME.match(name).groups()
+        digest = hashlib.blake2b(stem.encode("utf-8"), key=key, digest_size=6)
+        return f"file_{digest.hexdigest()}{suffix or ''}"
+
+    @classmethod
+    def flush_all(cls):
+        with cls._registry_lock:
+            recorders = list(cls._recorders.values())
+        for recorder in recorders:
+            recorder.flush()
+
+    async def record(self, run, method, db_name: str, instance, args, kwargs):
+        """Await run(method, *args, **kwargs) and log the call if it is a top-level one."""
+        if self._recording.get():
+            return await run(method, *args, **kwargs)
+        try:
+            arguments = (
+                inspect.signature(method)
+                .bind_partial(instance, *args, **kwargs)
+                .arguments
+            )
+            arguments.pop(next(iter(arguments)))  # self
+        except TypeError:  # The call fails the same way; keep what was passed
+            arguments = dict(kwargs, args=list(args))
+        token = self._recording.set(True)
+        started = time.time()
+        timer = time.perf_counter()
+        error = None
+        try:
+            return await run(method, *args, **kwargs)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self._recording.reset(token)
+            self._append(
+                {
+                    "ts": round(started, 3),
+                    "tool": method.__name__,
+                    "file": self.file_pseudonym(
+                        os.path.basename(db_name), self._file_key
+                    ),
+                    "params": {
+                        name: self._anonymize(value, name)
+                        for name, value in arguments.items()
+                        if not name.startswith("__")
+                    },
+                    "ms": round((time.perf_counter() - timer) * 1000, 3),
+                    "error": error,
+                }
+            )
+
+    def flush(self):
+        with self._lock:
+            lines, self._buffer = self._buffer, []
+            self._flushed = time.monotonic()
+            if not lines:
+                return
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                import gzip
+
+                with gzip.open(self.path, "ab") as f:
+                    f.write("".join(lines).encode("utf-8"))
+            except OSError as e:
+                print(f"Error writing tool call trace {self.path}: {e}")
+
+    def _append(self, call: dict):
+        with self._lock:
+            self._buffer.append(
+                json.dumps(call, ensure_ascii=False, separators=(",", ":")) + "\n"
+            )
+            due = (
+                len(self._buffer) >= self.FLUSH_LINES
+                or time.monotonic() - self._flushed >= self.FLUSH_SECONDS
+            )
+        if due:
+            self.flush()
+
+    def _anonymize(self, value, name=None):
+        if name in self.KEEP_PARAMS or isinstance(value, (bool, int, float)):
+            return value
+        if (
+            name in self.TIMESTAMP_PARAMS
+            and isinstance(value, str)
+            and self.TIMESTAMP.fullmatch(value.strip())
+        ):
+            return value
+        if name in self.FILE_PARAMS and isinstance(value, str):
+            return self.file_pseudonym(value, self._file_key)
+        if value is None:
+            return None
+        if isinstance(value, dict):
+            return {key: self._anonymize(item, key) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self._anonymize(item) for item in value]
+        return self.pseudonymize(str(value), self._word_key)
+
+    @classmethod
+    def pseudonymize(cls, text: str, key: bytes) -> str:
+        """Replace every word and digit run of text with its pseudonym under key."""
+        return re.sub(
+            r"[^\W\d_]+|\d+", lambda match: cls._pseudonym(match.group(), key), text
+        )
+
+    @staticmethod
+    def _pseudonym(word: str, key: bytes) -> str:
+        import hashlib
+
+        digest = hashlib.blake2b(
+            word.lower().encode("utf-8"), key=key, digest_size=32
+        ).digest()
+        if word.isdigit():
+            return "".join(str(b % 10) for b in digest)[: len(word)].ljust(
+                len(word), "0"
+            )
+        letters = "".join(chr(97 + b % 26) for b in digest)
+        pseudonym = (letters * (len(word) // len(letters) + 1))[: len(word)]
+        if word.isupper() and len(word) > 1:
+            return pseudonym.upper()
+        if word[0].isupper():
+            return pseudonym.capitalize()
+        return pseudonym
+
+
+class ToolCallReplayer:
+    """Replay recorded tool call traces against a copy of a memory directory.
+
+    Calls start at their recorded offsets divided by speed (speed=0 replays
+    as fast as possible), with at most concurrency calls in flight. Each
+    memory file in the trace gets its own Tools instance from tools_factory,
+    whose memory is pointed at the copy, so the live files are never
+    touched. When the trace directory holds the recorder's key, the copied
+    files are renamed to their trace pseudonyms and every stored memo,
+    including history and archive, is pseudonymized with the same words, so
+    lookups find what they found when recorded. A call counts as an error
+    if it raises or its result reports a failure (ERROR_RESULT). SKIP_TOOLS
+    are left out: download_memory only idles for its link to expire.
+
+    Usage, from a script that loaded this module:
+
+        replayer = ToolCallReplayer(".traces", "memory_dbs", speed=10, concurrency=8)
+        report = asyncio.run(replayer.run(Tools))
+    """
+
+    SKIP_TOOLS = frozenset({"download_memory"})
+    # Failure results of the tools, bare or as a JSON {"message": ...}
+    ERROR_RESULT = re.compile(
+        r'(?:\{"message": ")?(?:Database error|Invalid |Error|Memory is busy'
+        r"|Function \S+ not found|No database connection|Not available with)"
+    )
+
+    def __init__(
+        self, trace_path: str, directory: str, speed: float = 1.0, concurrency: int = 4
+    ):
+        self.trace_path = trace_path
+        self.directory = directory
+        self.speed = speed
+        self.concurrency = max(concurrency, 1)
+
+    def load(self) -> list:
+        """Calls from a trace file, or from every trace file in a directory, by start time."""
+        if os.path.isdir(self.trace_path):
+            paths = [
+                os.path.join(self.trace_path, name)
+                for name in sorted(os.listdir(self.trace_path))
+                if name.endswith(".trace.gz")
+            ]
+        else:
+            paths = [self.trace_path]
+        import gzip  # Not loaded unless traces are replayed
+
+        calls = []
+        for path in paths:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                calls.extend(json.loads(line) for line in f if line.strip())
+        calls.sort(key=lambda call: call["ts"])
+        return calls
+
+    async def run(self, tools_factory) -> dict:
+        """Replay the trace and return throughput and latency percentiles."""
+        recorded = self.load()
+        calls = [call for call in recorded if call["tool"] not in self.SKIP_TOOLS]
+        # Replayed calls are not recorded again
+        token = ToolCallRecorder._recording.set(True)
+        try:
+            report = await self._replay(calls, tools_factory)
+        finally:
+            ToolCallRecorder._recording.reset(token)
+        report["skipped"] = len(recorded) - len(calls)
+        return report
+
+    async def _replay(self, calls: list, tools_factory) -> dict:
+        import shutil
+        import tempfile
+
+        with tempfile.TemporaryDirectory(prefix="memory_replay_") as workdir:
+            copy = os.path.join(workdir, "memory_dbs")
+            shutil.copytree(
+                self.directory,
+                copy,
+                ignore=shutil.ignore_patterns(".backups", ".profiles", ".traces"),
+            )
+            self._pseudonymize_copy(copy)
+            tools_by_file = {}
+            for call in calls:
+                if call["file"] not in tools_by_file:
+                    tools = tools_factory()
+                    # Set before first use, so the live file is never opened
+                    tools.memory = MemoryFunctions(
+                        db_name=call["file"],
+                        directory=copy,
+                        backend=tools.valves.STORAGE_BACKEND,
+                    )
+                    tools_by_file[call["file"]] = tools
+            latencies = {}
+            errors = Counter()
+            slots = asyncio.Semaphore(self.concurrency)
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            first = calls[0]["ts"] if calls else 0
+
+            async def replay(call):
+                if self.speed > 0:
+                    delay = (call["ts"] - first) / self.speed - (loop.time() - started)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                async with slots:
+                    tools = tools_by_file[call["file"]]
+                    if os.path.basename(tools.memory.db_name) != call["file"]:
+                        tools.memory.switch_memory_file(call["file"])
+                    timer = time.perf_counter()
+                    try:
+                        result = await getattr(tools, call["tool"])(**call["params"])
+                        if isinstance(result, str) and self.ERROR_RESULT.match(result):
+                            errors[call["tool"]] += 1
+                    except Exception:
+                        errors[call["tool"]] += 1
+                    latencies.setdefault(call["tool"], []).append(
+                        time.perf_counter() - timer
+                    )
+
+            await asyncio.gather(*(replay(call) for call in calls))
+            wall = loop.time() - started
+            for tools in tools_by_file.values():
+                tools.memory.close_db_connection()
+        everything = [latency for values in latencies.values() for latency in values]
+        return {
+            "calls": len(everything),
+            "errors": sum(errors.values()),
+            "wall_seconds": round(wall, 3),
+            "throughput_per_second": round(len(everything) / wall, 2) if wall else 0.0,
+            "latency_ms": self._percentiles(everything),
+            "by_tool": {
+                tool: dict(
+                    self._percentiles(values), calls=len(values), errors=errors[tool]
+                )
+                for tool, values in sorted(latencies.items())
+            },
+        }
+
+    def _pseudonymize_copy(self, copy: str):
+        trace_dir = (
+            self.trace_path
+            if os.path.isdir(self.trace_path)
+            else os.path.dirname(self.trace_path)
+        )
+        key = ToolCallRecorder.file_key(trace_dir, create=False)
+        if key is None:
+            return  # Traces recorded with their file names and words
+        word_key = ToolCallRecorder.word_key(key)
+        backends = {
+            _deferred(cls).suffix: backend for backend, cls in STORAGE_BACKENDS.items()
+        }
+        files = []
+        for name in os.listdir(copy):
+            path = os.path.join(copy, name)
+            suffix = ToolCallRecorder.FILE_NAME.match(name).group(2)
+            if os.path.isfile(path) and suffix:
+                pseudonym = ToolCallRecorder.file_pseudonym(name, key)
+                os.rename(path, os.path.join(copy, pseudonym))
+                if suffix in backends:
+                    files.append((pseudonym, backends[suffix]))
+        # Only once every sidecar has its new name, so spools are replayed first
+        for name, backend in files:
+            memory = MemoryFunctions(db_name=name, directory=copy, backend=backend)
+            try:
+                memory.rewrite_memos(
+                    lambda memo: ToolCallRecorder.pseudonymize(memo, word_key)
+                )
+            finally:
+                memory.close_db_connection()
+
+    @staticmethod
+    def _percentiles(latencies: list) -> dict:
+        if not latencies:
+            return {}
+        ordered = sorted(latencies)
+
+        def at(fraction):
+            return round(
+                ordered[min(int(fraction * len(ordered)), len(ordered) - 1)] * 1000, 3
+            )
+
+        return {"p50": at(0.5), "p90": at(0.9), "p99": at(0.99), "max": at(1.0)}
+'''
+)
+
 
 class Pipeline(FunctionCallingBlueprint):
     class Valves(FunctionCallingBlueprint.Valves):
@@ -31,14 +876,373 @@ class Pipeline(FunctionCallingBlueprint):
             description="Interval in minutes to refresh and analyze memory data.",
         )
         DEBUG: bool = Field(default=True, description="Enable or disable debug mode.")
+        ARCHIVE_AFTER_DAYS: int = Field(
+            default=0,
+            description="Move memories not read or modified for this many days to the compressed archive on refresh (0 disables archiving).",
+        )
+        HISTORY_RETENTION_DAYS: int = Field(
+            default=90,
+            description="Keep previous versions of updated or deleted memories for this many days; older versions are pruned on refresh (0 keeps them forever).",
+        )
+        SESSION_PERSIST_INTERVAL: int = Field(
+            default=30,
+            description="Seconds between background writes of in-memory session files to disk.",
+        )
+        PROFILE_SAMPLE_RATE: float = Field(
+            default=0.0,
+            description="Fraction of tool calls to profile, from 0 (off) to 1 (every call).",
+        )
+        PROFILE_DIR: str = Field(
+            default="",
+            description="Directory for profile captures (empty uses .profiles in the memory directory).",
+        )
+        PROFILE_MAX_FILES: int = Field(
+            default=50,
+            description="Number of most recent profile captures to keep.",
+        )
+        MAX_MEMORIES: int = Field(
+            default=0,
+            description="Maximum number of hot memories per file before eviction (0 for no limit).",
+        )
+        MAX_MEMORY_BYTES: int = Field(
+            default=0,
+            description="Maximum text size in bytes of the hot memories per file before eviction (0 for no limit).",
+        )
+        EVICTION_POLICY: str = Field(
+            default="weighted",
+            description="Which memories to evict first: lru, lfu or weighted (reads and tag priority, decayed by age).",
+        )
+        EVICTION_ACTION: str = Field(
+            default="archive",
+            description="What to do with evicted memories: archive or delete.",
+        )
+        STORAGE_BACKEND: str = Field(
+            default="sqlite",
+            description="Storage for memories: sqlite, or appendlog for write-heavy use (core memory tools only; archive, history and quotas need sqlite).",
+        )
+        BACKUP_INTERVAL_MINUTES: int = Field(
+            default=0,
+            description="Minutes between automatic online backups of changed memory files (0 disables scheduled backups).",
+        )
+        BACKUP_DIR: str = Field(
+            default="",
+            description="Directory for memory file backups (empty uses .backups in the memory directory).",
+        )
+        BACKUP_KEEP: int = Field(
+            default=7,
+            description="Number of most recent backups to keep per memory file.",
+        )
+        BACKUP_WORKERS: int = Field(
+            default=2,
+            description="Number of memory files backed up in parallel.",
+        )
+        MAX_CONCURRENT_CALLS: int = Field(
+            default=8,
+            description="Tool calls that may run at once across all memory files; further calls queue.",
+        )
+        MAX_CALLS_PER_FILE: int = Field(
+            default=4,
+            description="Tool calls that may run at once on one memory file; further calls queue.",
+        )
+        MAX_QUEUED_CALLS: int = Field(
+            default=32,
+            description="Tool calls that may wait for a slot; beyond that calls fail at once with a busy error.",
+        )
+        MAX_QUEUE_WAIT_SECONDS: float = Field(
+            default=10.0,
+            description="Longest a queued tool call waits for a slot before failing with a busy error.",
+        )
+        RECORD_TOOL_CALLS: bool = Field(
+            default=False,
+            description="Record every tool call with anonymized parameters to a trace file for replay benchmarks.",
+        )
+        TRACE_DIR: str = Field(
+            default="",
+            description="Directory for tool call traces (empty uses .traces in the memory directory).",
+        )
+        AUTO_INJECT_MEMORIES: bool = Field(
+            default=True,
+            description="Add memories relevant to the user's message to the system prompt in the inlet.",
+        )
+        MAX_INJECTED_MEMORIES: int = Field(
+            default=5, description="Maximum number of memories injected per request."
+        )
+        AUTO_EXTRACT_MEMORIES: bool = Field(
+            default=False,
+            description="Store facts found in the user's messages in the outlet, without a tool call (stored as written by LLM).",
+        )
 
+    def __init__(self):
+        super().__init__()
+        self.name = "ChatMemoryDB Tools"
+        self.valves = self.Valves(
+            **{**self.valves.model_dump(), "pipelines": ["*"]},
+        )
+        self.tools = self.Tools(self)
+        self.memory_extractor = RuleBasedMemoryExtractor()  # Replaceable
+        self._memory_queue = None
+        self._memory_writer = None
+
+    async def inlet(self, body: dict, user: Optional[dict] = None) -> dict:
+        """Inject relevant memories into the system prompt before the model runs."""
+        if not (self.valves.USE_MEMORY and self.valves.AUTO_INJECT_MEMORIES):
+            return await super().inlet(body, user)
+
+        query = self._last_user_message(body)
+        # Look the memories up in a worker thread while the function-calling
+        # blueprint prepares the request.
+        lookup = asyncio.create_task(
+            asyncio.to_thread(
+                self.tools.memory.relevant_memories,
+                query,
+                self.valves.MAX_INJECTED_MEMORIES,
+            )
+        )
+        try:
+            body = await super().inlet(body, user)
+        finally:
+            memories = await lookup
+
+        if memories and "error" not in memories:
+            lines = "\n".join(
+                f"- [{memory['tag']}] {memory['memo']} (index {index})"
+                for index, memory in memories.items()
+            )
+            self._add_to_system_prompt(
+                body, f"Relevant memories about the user:\n{lines}"
+            )
+            if self.valves.DEBUG:
+                print(f"Injected {len(memories)} memories into the system prompt.")
+        return body
+
+    async def outlet(self, body: dict, user: Optional[dict] = None) -> dict:
+        """Queue facts stated by the user for storage without blocking the response."""
+        if not (self.valves.USE_MEMORY and self.valves.AUTO_EXTRACT_MEMORIES):
+            return body
+
+        facts = self.memory_extractor.extract(self._last_user_message(body))
+        if facts:
+            if self._memory_queue is None:
+                self._memory_queue = asyncio.Queue()
+                self._memory_writer = asyncio.create_task(self._write_memories())
+            for tag, memo in facts:
+                self._memory_queue.put_nowait((tag, memo))
+        return body
+
+    async def on_shutdown(self):
+        """Store the facts that are still queued before the server stops."""
+        if self._memory_queue is not None:
+            await self._memory_queue.join()
+            self._memory_writer.cancel()
+        await super().on_shutdown()
+
+    async def _write_memories(self):
+        """Background consumer storing extracted facts off the event loop, skipping known ones."""
+        while True:
+            facts = [await self._memory_queue.get()]
+            while not self._memory_queue.empty():
+                facts.append(self._memory_queue.get_nowait())
+            try:
+                if self.tools.memory.in_memory:
+                    # A session is in RAM and locked to its connection: cheap,
+                    # and only reachable from this thread.
+                    self._store_facts(self.tools.memory, facts)
+                else:
+                    await asyncio.to_thread(self._store_facts, None, facts)
+            except Exception as e:
+                print(f"Error storing extracted memory: {e}")
+            finally:
+                for _ in facts:
+                    self._memory_queue.task_done()
+
+    def _store_facts(self, memory, facts: list):
+        """Store new (tag, memo) facts and enforce the quota.
+
+        With memory None the current file is opened for the calling worker
+        thread, as SQLite connections belong to the thread that opened them.
+        """
+        current = self.tools.memory
+        own = memory is None
+        if own:
+            memory = type(current)(
+                db_name=os.path.basename(current.db_name),
+                directory=current.directory,
+                backend=current.backend,
+            )
+        try:
+            added = False
+            for tag, memo in facts:
+                if not memory.has_memory(memo):
+                    message = memory.add_to_memory(tag, memo, "LLM")
+                    added = True
+                    if self.valves.DEBUG:
+                        print(f"Auto-extracted memory [{tag}] {memo}: {message}")
+            if added:
+                self.tools._enforce_quota(memory)
+        finally:
+            if own:
+                memory.close_db_connection()
+
+    @staticmethod
+    def _last_user_message(body: dict) -> str:
+        for message in reversed(body.get("messages", [])):
+            if message.get("role") == "user":
+                content = message.get("content", "")
+                if isinstance(content, list):  # Multimodal messages
+                    content = " ".join(
+                        part.get("text", "")
+                        for part in content
+                        if part.get("type") == "text"
+                    )
+                return content
+        return ""
+
+    @staticmethod
+    def _add_to_system_prompt(body: dict, text: str):
+        messages = body.setdefault("messages", [])
+        if messages and messages[0].get("role") == "system":
+            messages[0]["content"] = f"{messages[0]['content']}\n\n{text}"
+        else:
+            messages.insert(0, {"role": "system", "content": text})
+
+    @profile_tool_calls
     class Tools:
+        # Admission class of each tool: interactive reads go first, bulk writes and
+        # exports last. Unlisted tools are writes; None skips admission control.
+        CALL_PRIORITIES = {
+            "recall_memories": "interactive",
+            "list_memory_tags": "interactive",
+            "memories_about": "interactive",
+            "recall_archived_memories": "interactive",
+            "memory_history": "interactive",
+            "memories_as_of": "interactive",
+            "list_memory_files": "interactive",
+            "memory_file_stats": "interactive",
+            "current_memory_file": "interactive",
+            "refresh_memory": "bulk",
+            "add_multiple_memories": "bulk",
+            "update_memories_bulk": "bulk",
+            "delete_multiple_memories": "bulk",
+            "clear_memories": "bulk",
+            "execute_functions_sequentially": "bulk",
+            "backup_memory_files": "bulk",
+            "download_memory": "bulk",
+            "memory_call_metrics": None,
+        }
+
         def __init__(self, pipeline):  # Added pipeline argument
             self.pipeline = pipeline  # Store pipeline reference
             self.valves = self.pipeline.valves  # Access valves through pipeline
-            self.memory = MemoryFunctions(debug=self.valves.DEBUG)
+            self._memory = None  # See the memory property
+            self._memory_lock = threading.Lock()
             self.confirmation_pending = False
 
+        @property
+        def memory(self):
+            """MemoryFunctions of these tools, opened on first use instead of at load time."""
+            if self._memory is None:
+                with self._memory_lock:
+                    if self._memory is None:
+                        self._memory = MemoryFunctions(
+                            debug=self.valves.DEBUG, backend=self.valves.STORAGE_BACKEND
+                        )
+            return self._memory
+
+        @memory.setter
+        def memory(self, memory):
+            self._memory = memory
+
+        async def _invoke(self, method, *args, **kwargs):
+            """Run a tool method, recording it to a trace when RECORD_TOOL_CALLS is on."""
+            # Picks up changed BACKUP_* valves; while backups were never on there
+            # is no scheduler to stop, and none is made.
+            if self.valves.BACKUP_INTERVAL_MINUTES or _deferred(
+                "BackupScheduler", load=False
+            ):
+                self._backup_scheduler()
+            if not self.valves.RECORD_TOOL_CALLS:
+                return await self._run_admitted(method, *args, **kwargs)
+            recorder = _deferred("ToolCallRecorder").for_directory(
+                self.valves.TRACE_DIR or os.path.join(self.memory.directory, ".traces")
+            )
+            return await recorder.record(
+                self._run_admitted, method, self.memory.db_name, self, args, kwargs
+            )
+
+        async def _run_admitted(self, method, *args, **kwargs):
+            """Run a tool method once admission control lets it in."""
+            priority = self.CALL_PRIORITIES.get(method.__name__, "write")
+            if priority is None:
+                return await self._run_profiled(method, *args, **kwargs)
+            try:
+                async with self._admission().admit(self.memory.db_name, priority):
+                    return await self._run_profiled(method, *args, **kwargs)
+            except AdmissionOverloaded as e:
+                message = f"Memory is busy, {method.__name__} was not run ({e}). Try again shortly."
+                if self.valves.DEBUG:
+                    print(message)
+                await EventEmitter(kwargs.get("__event_emitter__")).emit(
+                    description=message, status="overloaded", done=True
+                )
+                return message
+
+        async def _run_profiled(self, method, *args, **kwargs):
+            """Run a tool method, capturing a profile for PROFILE_SAMPLE_RATE of the calls."""
+            profiler = None
+            if self.valves.PROFILE_SAMPLE_RATE > 0:
+                profiler = _deferred("ToolProfiler").start(
+                    self.valves.PROFILE_SAMPLE_RATE,
+                    self.valves.PROFILE_DIR
+                    or os.path.join(self.memory.directory, ".profiles"),
+                    self.valves.PROFILE_MAX_FILES,
+                )
+            if profiler is None:
+                return await method(self, *args, **kwargs)
+            self.memory.set_sql_trace(profiler.trace_sql)
+            try:
+                return await method(self, *args, **kwargs)
+            finally:
+                self.memory.set_sql_trace(None)
+                profiler.stop(method.__name__)
+
+        def _admission(self):
+            """Admission controller for the call limit valves, shared with Tools set alike."""
+            return AdmissionController.for_limits(
+                self.valves.MAX_CONCURRENT_CALLS,
+                self.valves.MAX_CALLS_PER_FILE,
+                self.valves.MAX_QUEUED_CALLS,
+                self.valves.MAX_QUEUE_WAIT_SECONDS,
+            )
+
+        def _enforce_quota(self, memory=None) -> str:
+            """Evict low-value memories when the file exceeds the quota valves.
+
+            memory defaults to self.memory; the memory writer passes its own.
+            """
+            if not self.valves.MAX_MEMORIES and not self.valves.MAX_MEMORY_BYTES:
+                return ""
+            message = (memory or self.memory).enforce_quota(
+                self.valves.MAX_MEMORIES,
+                self.valves.MAX_MEMORY_BYTES,
+                self.valves.EVICTION_POLICY,
+                self.valves.EVICTION_ACTION,
+            )
+            if self.valves.DEBUG:
+                print(message)
+            return message
+
+        def _backup_scheduler(self):
+            """Backup scheduler of the memory directory, configured from the BACKUP_* valves."""
+            scheduler = _deferred("BackupScheduler").for_directory(self.memory.directory)
+            scheduler.configure(
+                self.valves.BACKUP_INTERVAL_MINUTES,
+                self.valves.BACKUP_DIR
+                or os.path.join(self.memory.directory, ".backups"),
+                self.valves.BACKUP_KEEP,
+                self.valves.BACKUP_WORKERS,
+            )
+            return scheduler
+
         async def handle_input(
             self,
             input_text: str,
@@ -82,8 +1286,7 @@ class Pipeline(FunctionCallingBlueprint):
                 if self.valves.USE_MEMORY:
                     print("DEBUG: handle_input - USE_MEMORY is True")  # DEBUG
                     # Assume 'by' is determined outside and 'tag' is selected by LLM
-                    if tag not in self.memory.tag_options:
-                        tag = "others"
+                    tag = self.memory.valid_tag(tag)
 
                     if user_wants_to_add:
                         print(
@@ -102,6 +1305,7 @@ class Pipeline(FunctionCallingBlueprint):
                             "DEBUG: handle_input - Finished emitting 'User requested to add' status (done=False)"
                         )  # DEBUG
                         self.memory.add_to_memory(tag, input_text, "user")
+                        self._enforce_quota()
                         print(
                             "DEBUG: handle_input - memory.add_to_memory (user) call completed"
                         )  # DEBUG
@@ -137,6 +1341,7 @@ class Pipeline(FunctionCallingBlueprint):
                             "DEBUG: handle_input - Finished emitting 'LLM added to memory' status (done=False)"
                         )  # DEBUG
                         self.memory.add_to_memory(tag, input_text, "LLM")
+                        self._enforce_quota()
                         print(
                             "DEBUG: handle_input - memory.add_to_memory (LLM) call completed"
                         )  # DEBUG
@@ -196,11 +1401,12 @@ class Pipeline(FunctionCallingBlueprint):
                 )  # FINISH DEBUG
 
         async def recall_memories(
-            self, __event_emitter__: Callable[[dict], Any] = None
+            self, tag: str = "", __event_emitter__: Callable[[dict], Any] = None
         ) -> str:
             """
             Retrieve all stored memories in current file and provide them to the user.
 
+            :param tag: Only return memories with this tag; leave empty for all tags.
             :return: A structured representation of all memory contents.
             """
             emitter = EventEmitter(__event_emitter__)
@@ -208,7 +1414,7 @@ class Pipeline(FunctionCallingBlueprint):
                 "Retrieving all stored memories.", status="recall_in_progress"
             )
 
-            all_memories = self.memory.get_all_memories()
+            all_memories = self.memory.get_all_memories(tag or None)
             if (
                 not all_memories
             ):  # Check if all_memories is an empty dict or contains error key
@@ -241,6 +1447,110 @@ class Pipeline(FunctionCallingBlueprint):
 
             return f"Memories are : {formatted_memories}"
 
+        async def list_memory_tags(
+            self, __event_emitter__: Callable[[dict], Any] = None
+        ) -> str:
+            """
+            List the tags that memories in the current memory file can use.
+
+            :returns: The available tags.
+            """
+            emitter = EventEmitter(__event_emitter__)
+            tags = self.memory.memory_tags()
+            message = f"Available memory tags: {', '.join(tags)}"
+            await emitter.emit(description=message, status="tags_listed", done=True)
+            return message
+
+        async def add_memory_tag(
+            self, tag: str, __event_emitter__: Callable[[dict], Any] = None
+        ) -> str:
+            """
+            Add a new tag that memories in the current memory file can use.
+
+            :param tag: The name of the new tag.
+            :returns: A message indicating the success or failure of the operation.
+            """
+            emitter = EventEmitter(__event_emitter__)
+            message = self.memory.add_memory_tag(tag)
+            if self.valves.DEBUG:
+                print(message)
+            await emitter.emit(description=message, status="tag_added", done=True)
+            return message
+
+        async def memories_about(
+            self, entity: str, __event_emitter__: Callable[[dict], Any] = None
+        ) -> str:
+            """
+            Recall every memory that mentions a person, relationship or other name, including archived ones.
+
+            :param entity: The name or relationship to look up, e.g. "Anna" or "sister".
+            :returns: The memories about the entity.
+            """
+            emitter = EventEmitter(__event_emitter__)
+            await emitter.emit(
+                f"Looking up memories about {entity}.", status="entity_recall_in_progress"
+            )
+
+            memories = self.memory.memories_about(entity)
+            if not memories or "error" in memories:
+                message = memories.get("error", f"No memory about {entity} found.")
+                await emitter.emit(
+                    description=message, status="entity_recall_complete", done=True
+                )
+                return json.dumps({"message": message}, ensure_ascii=False)
+
+            formatted_memories = json.dumps(memories, ensure_ascii=False, indent=4)
+
+            if self.valves.DEBUG:
+                print(f"Memories about {entity} retrieved: {formatted_memories}")
+
+            await emitter.emit(
+                description=f"{len(memories)} memories about {entity} retrieved.",
+                status="entity_recall_complete",
+                done=True,
+            )
+
+            return f"Memories about {entity} are : {formatted_memories}"
+
+        async def recall_archived_memories(
+            self,
+            tag: str = "",
+            keyword: str = "",
+            __event_emitter__: Callable[[dict], Any] = None,
+        ) -> str:
+            """
+            Search old memories that were moved to the archive because they were not used for a long time.
+
+            :param tag: Only return archived memories with this tag; leave empty for all tags.
+            :param keyword: Only return archived memories containing this text; leave empty to skip text filtering.
+            :returns: The matching archived memories.
+            """
+            emitter = EventEmitter(__event_emitter__)
+            await emitter.emit(
+                "Searching archived memories.", status="archive_recall_in_progress"
+            )
+
+            archived = self.memory.search_archived_memories(tag or None, keyword or None)
+            if not archived or "error" in archived:
+                message = archived.get("error", "No archived memory found.")
+                await emitter.emit(
+                    description=message, status="archive_recall_complete", done=True
+                )
+                return json.dumps({"message": message}, ensure_ascii=False)
+
+            formatted_memories = json.dumps(archived, ensure_ascii=False, indent=4)
+
+            if self.valves.DEBUG:
+                print(f"Archived memories retrieved: {formatted_memories}")
+
+            await emitter.emit(
+                description=f"{len(archived)} archived memories retrieved.",
+                status="archive_recall_complete",
+                done=True,
+            )
+
+            return f"Archived memories are : {formatted_memories}"
+
         async def clear_memories(
             self, user_confirmation: bool, __event_emitter__: Callable[[dict], Any] = None
         ) -> str:
@@ -303,6 +1613,17 @@ class Pipeline(FunctionCallingBlueprint):
 
             if self.valves.USE_MEMORY:
                 refresh_message = self.memory.reindex_memory()  # Reindex returns a message
+                if self.valves.ARCHIVE_AFTER_DAYS > 0:
+                    refresh_message += " " + self.memory.archive_memories(
+                        self.valves.ARCHIVE_AFTER_DAYS
+                    )
+                if self.valves.HISTORY_RETENTION_DAYS > 0:
+                    refresh_message += " " + self.memory.compact_history(
+                        self.valves.HISTORY_RETENTION_DAYS
+                    )
+                quota_message = self._enforce_quota()
+                if quota_message:
+                    refresh_message += " " + quota_message
 
                 if self.valves.DEBUG:
                     print(refresh_message)
@@ -355,75 +1676,173 @@ class Pipeline(FunctionCallingBlueprint):
 
             return update_message
 
-        async def add_multiple_memories(
+        async def update_memories_bulk(
             self,
-            memory_entries: list,
-            llm_wants_to_add: bool,
+            patches: list,
             __event_emitter__: Callable[[dict], Any] = None,
         ) -> str:
             """
-            Allows the LLM to add multiple memory entries at once.
-
-            :param memory_entries: A list of dictionary entries, each containing tag, memo, by.Usage Examples:
-                                       **General Examples:**
-                                       `memory_entries = [{"tag": "personal", "memo": "This is a personal note", "by": "LLM"},{"tag": "work", "memo": "Project deadline is tomorrow", "by": "LLM"}]`
+            Update many memory entries at once, changing only the fields given for each; use it to re-tag or correct several memories in one call.
 
-                                       **Tag-Specific Examples:**
-                                       * **Reminders:**
-                                         `memory_entries = [{"tag": "reminder", "memo": "Schedule client follow-up call for Friday", "by": "LLM"}, {"tag": "reminder", "memo": "Remember to review client progress reports", "by": "LLM"}]`
-
-                                       * **Wellness (or Fitness):**
-                                         `memory_entries = [{"tag": "wellness", "memo": "Client completed workout successfully, feeling energized", "by": "LLM"}, {"tag": "wellness", "memo": "Client mentioned improved sleep quality this week", "by": "LLM"}]`
-
-                                       * **Mixed Tags:**
-                                         `memory_entries = [{"tag": "work", "memo": "New lead from networking event", "by": "LLM"}, {"tag": "reminder", "memo": "Send invoice to client by end of day", "by": "LLM"}, {"tag": "wellness", "memo": "Client achieved personal best on bench press", "by": "LLM"}]`
-            :param llm_wants_to_add: Boolean indicating LLM's desire to add the memories.
-            :returns: A message indicating the success or failure of the operations.
+            :param patches: A list of dictionaries each containing 'index' (STARTING FROM 1) and any of 'tag', 'memo' and 'by' to change.
+                            Example: [{'index': 3, 'tag': 'work'}, {'index': 7, 'memo': 'Corrected text', 'by': 'LLM'}]
+            :returns: A JSON object with the result for each index.
             """
             emitter = EventEmitter(__event_emitter__)
-            responses = []
-
-            if not llm_wants_to_add:
-                return "LLM has not requested to add multiple memories."
-
-            for idx, entry in enumerate(memory_entries):
-                tag = entry.get("tag", "others")
-                memo = entry.get("memo", "")
-                by = entry.get("by", "LLM")
-
-                if tag not in self.memory.tag_options:
-                    tag = "others"
-
-                if self.valves.DEBUG:
-                    print(f"Adding memory {idx+1}: tag={tag}, memo={memo}, by={by}")
 
-                # Add the memory
-                add_message = self.memory.add_to_memory(
-                    tag, memo, by
-                )  # Get add message
-                response = f"Memory {idx+1} added with tag {tag} by {by}. Status: {add_message}"  # Include status
-                responses.append(response)
+            if self.valves.DEBUG:
+                print(f"Updating {len(patches)} memory entries: {patches}")
 
-                await emitter.emit(
-                    description=response, status="memory_update", done=False
-                )
+            results = self.memory.update_memories_bulk(patches)
+            updated = sum(
+                1 for message in results.values() if message.endswith("successfully.")
+            )
 
             await emitter.emit(
-                description="All requested memories have been processed.",
-                status="memory_update_complete",
+                description=f"{updated} of {len(patches)} memory updates applied.",
+                status="memory_update",
                 done=True,
             )
 
-            return "\n".join(responses)
+            return json.dumps(results, ensure_ascii=False, indent=4)
 
-        async def delete_memory_entry(
-            self,
-            index: int,
-            llm_wants_to_delete: bool,
-            __event_emitter__: Callable[[dict], Any] = None,
+        async def memory_history(
+            self, index: int, __event_emitter__: Callable[[dict], Any] = None
         ) -> str:
             """
-            Delete a memory entry based on its index.
+            Show all previous versions of a memory entry, including deleted ones, to recover from a bad update.
+
+            :param index: The index of the memory entry,STARTING FROM 1.
+            :returns: The versions of the memory entry, oldest first.
+            """
+            emitter = EventEmitter(__event_emitter__)
+
+            history = self.memory.memory_history(index)
+            if isinstance(history, dict):  # Error dict
+                message = history["error"]
+            elif not history:
+                message = f"Memory index {index} has no history."
+            else:
+                message = json.dumps(history, ensure_ascii=False, indent=4)
+
+            if self.valves.DEBUG:
+                print(f"History of memory index {index}: {message}")
+
+            await emitter.emit(
+                description=f"Retrieved history of memory index {index}.",
+                status="memory_history",
+                done=True,
+            )
+
+            return message
+
+        async def memories_as_of(
+            self, timestamp: str, __event_emitter__: Callable[[dict], Any] = None
+        ) -> str:
+            """
+            Retrieve the memories exactly as they were at a past point in time.
+
+            :param timestamp: The point in time, formatted as YYYY-MM-DD HH:MM:SS.
+            :returns: The memories that existed at that time.
+            """
+            emitter = EventEmitter(__event_emitter__)
+
+            snapshot = self.memory.memories_as_of(timestamp)
+            if "error" in snapshot:
+                message = snapshot["error"]
+            elif not snapshot:
+                message = f"No memory stored as of {timestamp}."
+            else:
+                message = f"Memories as of {timestamp} are : " + json.dumps(
+                    snapshot, ensure_ascii=False, indent=4
+                )
+
+            if self.valves.DEBUG:
+                print(message)
+
+            await emitter.emit(
+                description=f"Retrieved memories as of {timestamp}.",
+                status="memory_time_travel",
+                done=True,
+            )
+
+            return message
+
+        async def add_multiple_memories(
+            self,
+            memory_entries: list,
+            llm_wants_to_add: bool,
+            __event_emitter__: Callable[[dict], Any] = None,
+        ) -> str:
+            """
+            Allows the LLM to add multiple memory entries at once.
+
+            :param memory_entries: A list of dictionary entries, each containing tag, memo, by.Usage Examples:
+                                       **General Examples:**
+                                       `memory_entries = [{"tag": "personal", "memo": "This is a personal note", "by": "LLM"},{"tag": "work", "memo": "Project deadline is tomorrow", "by": "LLM"}]`
+
+                                       **Tag-Specific Examples:**
+                                       * **Reminders:**
+                                         `memory_entries = [{"tag": "reminder", "memo": "Schedule client follow-up call for Friday", "by": "LLM"}, {"tag": "reminder", "memo": "Remember to review client progress reports", "by": "LLM"}]`
+
+                                       * **Wellness (or Fitness):**
+                                         `memory_entries = [{"tag": "wellness", "memo": "Client completed workout successfully, feeling energized", "by": "LLM"}, {"tag": "wellness", "memo": "Client mentioned improved sleep quality this week", "by": "LLM"}]`
+
+                                       * **Mixed Tags:**
+                                         `memory_entries = [{"tag": "work", "memo": "New lead from networking event", "by": "LLM"}, {"tag": "reminder", "memo": "Send invoice to client by end of day", "by": "LLM"}, {"tag": "wellness", "memo": "Client achieved personal best on bench press", "by": "LLM"}]`
+            :param llm_wants_to_add: Boolean indicating LLM's desire to add the memories.
+            :returns: A message indicating the success or failure of the operations.
+            """
+            emitter = EventEmitter(__event_emitter__)
+            responses = []
+
+            if not llm_wants_to_add:
+                return "LLM has not requested to add multiple memories."
+
+            entries = []
+            for idx, entry in enumerate(memory_entries):
+                tag = entry.get("tag", "others")
+                memo = entry.get("memo", "")
+                by = entry.get("by", "LLM")
+
+                tag = self.memory.valid_tag(tag)
+
+                if self.valves.DEBUG:
+                    print(f"Adding memory {idx+1}: tag={tag}, memo={memo}, by={by}")
+                entries.append((tag, memo, by))
+
+            # Add the memories in one backend write
+            add_messages = self.memory.add_many_to_memory(entries)
+            for idx, ((tag, memo, by), add_message) in enumerate(
+                zip(entries, add_messages)
+            ):
+                response = f"Memory {idx+1} added with tag {tag} by {by}. Status: {add_message}"  # Include status
+                responses.append(response)
+
+                await emitter.emit(
+                    description=response, status="memory_update", done=False
+                )
+
+            quota_message = self._enforce_quota()
+            if quota_message:
+                responses.append(quota_message)
+
+            await emitter.emit(
+                description="All requested memories have been processed.",
+                status="memory_update_complete",
+                done=True,
+            )
+
+            return "\n".join(responses)
+
+        async def delete_memory_entry(
+            self,
+            index: int,
+            llm_wants_to_delete: bool,
+            __event_emitter__: Callable[[dict], Any] = None,
+        ) -> str:
+            """
+            Delete a memory entry based on its index.
 
             :param index: The index of the memory entry to delete,STARTING FROM 1.
             :param llm_wants_to_delete: Boolean indicating if the LLM has requested the deletion.
@@ -488,12 +1907,16 @@ class Pipeline(FunctionCallingBlueprint):
             return "\n".join(responses)
 
         async def create_or_switch_memory_file(
-            self, new_file_name: str, __event_emitter__: Callable[[dict], Any] = None
+            self,
+            new_file_name: str,
+            in_memory: bool = False,
+            __event_emitter__: Callable[[dict], Any] = None,
         ) -> str:
             """
             Create a new memory file or switch to an existing one.
 
             :param new_file_name: The name of the new or existing memory file.
+            :param in_memory: Keep the file in RAM for this session and write it back to disk periodically.
             :returns: A message indicating the success or failure of the operation.
             """
             emitter = EventEmitter(__event_emitter__)
@@ -502,7 +1925,9 @@ class Pipeline(FunctionCallingBlueprint):
                 print(f"Switching to or creating memory database file: {new_file_name}")
 
             switch_message = self.memory.switch_memory_file(
-                new_file_name + ".db"
+                new_file_name + ".db",
+                in_memory=in_memory,
+                persist_interval=self.valves.SESSION_PERSIST_INTERVAL,
             )  # Switch DB file
             message = f"Memory database file switched to {new_file_name}."
 
@@ -543,6 +1968,49 @@ class Pipeline(FunctionCallingBlueprint):
 
             return description
 
+        async def memory_file_stats(
+            self, __event_emitter__: Callable[[dict], Any] = None
+        ) -> str:
+            """
+            Show statistics for every memory file: number of memories, memories per tag, size in bytes and last write time.
+
+            :returns: A JSON summary of the memory files.
+            """
+            emitter = EventEmitter(__event_emitter__)
+            stats = self.memory.memory_file_stats()
+
+            if isinstance(stats, dict) and "error" in stats:
+                description = stats["error"]
+                status = "file_stats_error"
+            else:
+                description = json.dumps(stats, ensure_ascii=False, indent=4)
+                status = "file_stats_complete"
+
+            if self.valves.DEBUG:
+                print(f"Memory file statistics for {self.memory.directory}: {description}")
+
+            await emitter.emit(description=description, status=status, done=True)
+
+            return description
+
+        async def memory_call_metrics(
+            self, __event_emitter__: Callable[[dict], Any] = None
+        ) -> str:
+            """
+            Show how loaded the memory tools are: running calls, queue depth, wait times and rejected calls per priority class.
+
+            :returns: A JSON summary of the admission control metrics.
+            """
+            emitter = EventEmitter(__event_emitter__)
+            description = json.dumps(self._admission().metrics(), indent=4)
+
+            if self.valves.DEBUG:
+                print(f"Memory call metrics: {description}")
+
+            await emitter.emit(description=description, status="call_metrics", done=True)
+
+            return description
+
         async def current_memory_file(
             self, __event_emitter__: Callable[[dict], Any] = None
         ) -> str:
@@ -693,6 +2161,24 @@ class Pipeline(FunctionCallingBlueprint):
 
             return f"executed successfully :{results}"
 
+        async def backup_memory_files(
+            self, __event_emitter__: Callable[[dict], Any] = None
+        ) -> str:
+            """
+            Back up all memory files that changed since their last backup.
+
+            :returns: A message describing the backup.
+            """
+            emitter = EventEmitter(__event_emitter__)
+            await emitter.emit("Backing up memory files.", status="backup_in_progress")
+
+            message = await asyncio.to_thread(self._backup_scheduler().run_once)
+            if self.valves.DEBUG:
+                print(message)
+
+            await emitter.emit(description=message, status="backup_complete", done=True)
+            return message
+
         async def download_memory(
             self,
             memory_file_name: str,
@@ -745,6 +2231,9 @@ class Pipeline(FunctionCallingBlueprint):
                         return message
                     target_file = target_file_path_or_error
 
+                from http.server import SimpleHTTPRequestHandler
+                from socketserver import TCPServer
+
                 httpd = None  # Initialize httpd here
                 handler = SimpleHTTPRequestHandler
                 handler.directory = self.memory.directory
@@ -763,7 +2252,9 @@ class Pipeline(FunctionCallingBlueprint):
                 if self.valves.DEBUG:
                     print(message)
 
-                # Give the user time to download
+                # Give the user time to download; the link is served from its own
+                # thread, so other calls can have this call's slot meanwhile.
+                AdmissionController.release_current()
                 await asyncio.sleep(14)
                 return "TELL THE USER THAT LINK IS EXPIRED AND YOU SHOULD HAVE DOWNLOADED FILES!"
 
@@ -775,7 +2266,6 @@ class Pipeline(FunctionCallingBlueprint):
                 if self.valves.DEBUG:
                     print(message)
                 return message  # Return error message in case of exceptions
-
             finally:
                 if httpd:
                     httpd.shutdown()  # Ensure server is shut down
@@ -785,26 +2275,64 @@ class Pipeline(FunctionCallingBlueprint):
 
         def __del__(self):
             """Ensure database connection is closed when the Tools object is deleted."""
-            if hasattr(self, "memory") and hasattr(
-                self.memory, "close_db_connection"
-            ):  # Check if memory and close_db_connection exist
-                self.memory.close_db_connection()
+            memory = self.__dict__.get("_memory")  # Never opened if no tool ran
+            if memory is not None:
+                memory.close_db_connection()
 
 
 class MemoryFunctions:
+    SCHEMA_VERSION = 8  # Highest _migrate_to_<version> step
+    ACCESS_FLUSH_ROWS = 100  # Pending access updates that trigger a flush
+    ACCESS_FLUSH_SECONDS = 30  # Longest time access updates stay pending
+    SPOOL_LOCK_WAIT = 0.25  # Seconds a write waits on a locked file before spooling
+    FILE_LOCK_WAIT = 0.5  # Seconds opening a file waits for another process's lock
+    MIGRATE_LOCK_WAIT = 30.0  # Seconds opening a file waits for another migrator
+    ARCHIVE_DICT_MAX_AGE_DAYS = 30  # Archive dictionaries are retrained this often
+    # When a memory was last read or modified, for archiving and eviction
+    LAST_USED = "MAX(COALESCE(last_accessed, ''), COALESCE(last_modified, ''))"
+
+    # Path -> (device, inode) of files already brought up to SCHEMA_VERSION in
+    # this process, so reopening or switching back to them skips the checks.
+    # Cleared whenever a process deletes files.
+    _schema_checked = {}
+    # Weight of each tag in the "weighted" eviction score; unlisted tags get 1
+    TAG_PRIORITY = {
+        "personal": 3,
+        "relationship": 3,
+        "wellness": 2,
+        "person": 2,
+        "reminder": 2,
+        "work": 2,
+        "education": 2,
+        "life": 2,
+    }
+    # Words ignored when matching a message against stored memories
+    STOP_WORDS = frozenset(
+        """
+        the and for are but not you all any can had her was one our out has his how
+        its who did get him she too use that with have this will your from they been
+        were what when which their there would about could should into than then them
+        these some just like also does very please tell
+        """.split()
+    )
+
     def __init__(
         self,
         db_name="chat_memory.db",
         debug=False,
         directory="memory_dbs",  # Renamed directory for clarity
+        backend="sqlite",  # Storage for the core operations, see STORAGE_BACKENDS
     ):
         self.directory = directory
         os.makedirs(
             self.directory, exist_ok=True
         )  # Ensure the directory exists for DB files
-        self.db_name = os.path.join(
-            self.directory, db_name
-        )  # Path to the database file
+        if backend not in STORAGE_BACKENDS:
+            raise ValueError(
+                f"Unknown storage backend '{backend}', use one of {', '.join(STORAGE_BACKENDS)}."
+            )
+        self.backend = backend
+        self.db_name = self._file_path(db_name)  # Path to the database file
         self.debug = debug
         self.tag_options = [
             "personal",
@@ -817,13 +2345,207 @@ class MemoryFunctions:
             "reminder",
             "others",
         ]
+        self._default_tags = frozenset(self.tag_options)
+        self._interned = {"tags": {}, "authors": {}}  # name -> id per lookup table
+        self._interned_version = None  # PRAGMA data_version they were loaded at
+        self._catalog = None  # Both made on first use, see the properties
+        self._compressor = None
+        self.entity_extractor = EntityExtractor()
+        self._archive_dicts = {}  # dict_id -> shared compression dictionary
+        self.generation = GenerationCounter.for_directory(self.directory)
+        self._seen_generation = self.generation.value()
+        self._file_lock = None  # Shared lock held on the active file
+        self._locked_out = False  # Lock refused, e.g. another process's session
+        self.in_memory = False  # Session mode: RAM database persisted in background
+        self._session_pending = False  # Session file not copied into RAM yet
+        self._persist_interval = 30  # Seconds between session writes to disk
+        self.sql_trace = None  # Statement callback installed on every connection
+        self._pending_access = {}  # db path -> {memory id: [reads, last read]}
+        self._access_lock = threading.Lock()
+        self._access_flushed = time.monotonic()
+        self._conn_thread = None  # Thread that opened self.conn
         self.conn = self._connect_db()  # Initialize database connection
         self._create_table()  # Ensure table exists
+        self._store = self._open_store()
+        self._try_replay_spool()
+
+    @property
+    def catalog(self):
+        """Cached catalog of the memory files in the directory."""
+        if self._catalog is None:
+            self._catalog = _deferred("MemoryCatalog").for_directory(
+                self.directory, self.backend
+            )
+        return self._catalog
+
+    @property
+    def compressor(self):
+        """Codec of archived memos and history deltas."""
+        if self._compressor is None:
+            self._compressor = _deferred("MemoCompressor")()
+        return self._compressor
+
+    @property
+    def store(self):
+        """Backend for the core memory operations; None while no database is open."""
+        if self.backend == "sqlite" and self.conn is None:
+            return None
+        return self._store
+
+    def _open_store(self):
+        if self.backend == "sqlite":
+            return SQLiteBackend(self)
+        return _deferred(STORAGE_BACKENDS[self.backend])(
+            self.db_name, self._lock_for(os.path.basename(self.db_name) + ".write")
+        )
+
+    def _file_path(self, file_name: str) -> str:
+        """Path of a memory file; other backends store it under their own suffix.
+
+        With the appendlog backend "notes.db" and "notes.log" both name
+        notes.log, so default file names and listed names both work.
+        """
+        suffix = _deferred(STORAGE_BACKENDS[self.backend]).suffix
+        if suffix != ".db":
+            file_name = os.path.splitext(file_name)[0] + suffix
+        return os.path.join(self.directory, file_name)
+
+    def _no_connection(self) -> str:
+        """Error for SQLite-only features without a connection, naming the backend if that is why."""
+        if self.backend != "sqlite":
+            return f"Not available with the {self.backend} storage backend, only with sqlite."
+        return "No database connection."
+
+    @property
+    def conn(self):
+        """Active connection; caches are dropped when another process changed files."""
+        generation = self.generation.value()
+        if generation != self._seen_generation:
+            self._seen_generation = generation
+            self._on_external_change()
+        if self._session_pending:
+            self._load_session()
+        elif self._conn is None and self._locked_out:
+            self._reconnect()
+        return self._conn
+
+    @conn.setter
+    def conn(self, value):
+        self._conn = value
+
+    def _on_external_change(self):
+        """Invalidate per-process caches after a destructive operation elsewhere."""
+        if self.debug:
+            print("Memory files changed in another process, refreshing caches.")
+        self._archive_dicts = {}
+        self.catalog.invalidate()
+        self._schema_checked.clear()  # Deleted files may come back under the same inode
+        if (
+            self._conn is not None
+            and not self.in_memory
+            and not os.path.exists(self.db_name)
+        ):
+            # Only possible where file locks are unavailable.
+            self._conn.close()
+            self._conn = self._connect_db()
+            self._create_table()
+
+    @property
+    def spool(self):
+        """WriteSpool of the current file, for writes the database cannot take."""
+        path = os.path.splitext(self.db_name)[0] + ".spool"
+        name = os.path.basename(path)
+        return WriteSpool.for_path(
+            path, self._lock_for(name), self._lock_for(name + ".replay")
+        )
 
-    def _connect_db(self):
-        """Establish a database connection."""
+    def _spool_write(self, op: str, error, **fields) -> str:
+        """Keep a write in the spool when the database is locked, missing or migrating."""
         try:
-            conn = sqlite3.connect(self.db_name)
+            self.spool.append(op, **fields)
+        except (OSError, TimeoutError) as e:
+            return f"Database error: {error}; spooling the write failed too: {e}"
+        if self.debug:
+            print(f"Spooled {op} for {self.db_name}: {error}")
+        return f"Memory {op} queued: the database is unavailable ({error}) and it will be written once the database is back."
+
+    def _spool_writes(self, op: str, error, rows: list) -> list:
+        """_spool_write for several writes, spooled together; one message per write."""
+        try:
+            self.spool.append_many(op, rows)
+        except (OSError, TimeoutError) as e:
+            return [
+                f"Database error: {error}; spooling the write failed too: {e}"
+            ] * len(rows)
+        if self.debug:
+            print(f"Spooled {len(rows)} x {op} for {self.db_name}: {error}")
+        return [
+            f"Memory {op} queued: the database is unavailable ({error}) and it will be written once the database is back."
+        ] * len(rows)
+
+    def _replay_spool(self) -> int:
+        """Apply spooled writes in one transaction per batch, ahead of newer writes."""
+        if self.backend != "sqlite" or self.conn is None or not self.spool.pending():
+            return 0
+        replayed = self.spool.replay(self._store.apply_spooled, self._forget_spooled)
+        if replayed and self.debug:
+            print(f"Replayed {replayed} spooled writes into {self.db_name}.")
+        return replayed
+
+    def _try_replay_spool(self):
+        try:
+            self._replay_spool()
+        except (sqlite3.Error, OSError, TimeoutError) as e:
+            print(f"Spooled writes for {self.db_name} not replayed yet: {e}")
+
+    def _forget_spooled(self):
+        """Drop applied spool keys once the replayed spool file is gone."""
+        self.conn.execute("DELETE FROM spool_applied")
+        self.conn.commit()
+
+    @contextlib.contextmanager
+    def _write_lock_wait(self):
+        """Wait at most SPOOL_LOCK_WAIT for a locked file, so writes spool instead of stalling."""
+        self.conn.execute(f"PRAGMA busy_timeout = {int(self.SPOOL_LOCK_WAIT * 1000)}")
+        try:
+            yield
+        finally:
+            self.conn.execute("PRAGMA busy_timeout = 5000")  # sqlite3.connect default
+
+    def _lock_for(self, file_name: str, shared: bool = False):
+        """Advisory lock coordinating destructive operations on a file across processes."""
+        return FileLock(
+            os.path.join(self.directory, ".locks", file_name + ".lock"), shared
+        )
+
+    def _connect_db(self, lock_wait: float = None):
+        """Establish a database connection.
+
+        Other processes cannot delete the file while the shared lock is held.
+        In-memory sessions hold the lock exclusively instead, as persisting
+        the session overwrites the file. If the lock cannot be had, there is
+        no connection and writes are spooled until the lock is free again.
+        """
+        if self._file_lock:
+            self._file_lock.release()
+        lock = self._lock_for(os.path.basename(self.db_name), shared=not self.in_memory)
+        if not lock.acquire(
+            timeout=self.FILE_LOCK_WAIT if lock_wait is None else lock_wait
+        ):
+            self._file_lock = None
+            self._locked_out = self.backend == "sqlite"
+            if self.debug:
+                print(f"{self.db_name} is locked by another process.")
+            return None
+        self._file_lock = lock
+        self._locked_out = False
+        if self.backend != "sqlite":
+            return None  # Only the core operations are available, via self.store
+        try:
+            conn = self._open_connection()
+            self._conn_thread = threading.get_ident()
+            self._interned = {"tags": {}, "authors": {}}  # Of the previous file
+            self._interned_version = None
             if self.debug:
                 print(f"Connected to SQLite database: {self.db_name}")
             return conn
@@ -831,169 +2553,1111 @@ class MemoryFunctions:
             print(f"Database connection error: {e}")
             return None
 
-    def _create_table(self):
-        """Create the memory table if it does not exist."""
+    def _reconnect(self):
+        """Retry a connection refused by another process's lock, without waiting."""
+        self._conn = self._connect_db(lock_wait=0)
+        if self._conn is not None:
+            self._create_table(migrate_wait=0)
+        if self._conn is not None:  # Not dropped for a migration still running
+            self._try_replay_spool()
+
+    def _load_session(self):
+        """Copy the session's file into RAM on first use, then persist it from there."""
+        self._session_pending = False
+        try:
+            if os.path.exists(self.db_name):
+                with sqlite3.connect(self.db_name) as disk:
+                    disk.backup(self._conn)
+        except sqlite3.Error as e:
+            # Persisting a partial copy would lose rows, so stay on the file.
+            print(f"Error loading session {self.db_name}, using the file on disk: {e}")
+            self._conn.close()
+            self.in_memory = False
+            self._conn = self._connect_db()
+            self._create_table()
+            return
+        self._create_table()
+        self._try_replay_spool()
+        _deferred("SessionPersister").shared().register(
+            self.db_name, self._session_uri(), self._persist_interval
+        )
+
+    def _open_connection(self):
+        """Open an extra connection to the current file, e.g. for use from a worker thread."""
+        if self.in_memory and not self._session_pending:
+            conn = sqlite3.connect(self._session_uri(), uri=True)
+            # Shared-cache table locks do not wait, so readers skip them.
+            conn.execute("PRAGMA read_uncommitted = 1")
+        else:
+            conn = sqlite3.connect(self.db_name)
+        conn.set_trace_callback(self.sql_trace)
+        return conn
+
+    def set_sql_trace(self, callback):
+        """Report every SQL statement run from now on to callback (None turns it off)."""
+        self.sql_trace = callback
+        if self._conn is not None:
+            self._conn.set_trace_callback(callback)
+
+    def _session_uri(self):
+        """URI of the shared in-memory database backing the current session file."""
+        name = quote(os.path.abspath(self.db_name), safe="")
+        return f"file:memory-session-{name}?mode=memory&cache=shared"
+
+    def _reclaim_cleared_rows(self, unfinished_only: bool = False):
+        """Physically delete rows hidden by clear_memory.
+
+        With unfinished_only the rows are first looked for, as on open, where
+        a reclaim can only be left over from a process that exited early.
+        """
+        if self.in_memory:
+            # Already RAM-speed
+            if not unfinished_only or BackgroundReclaimer.has_cleared_rows(self.conn):
+                BackgroundReclaimer.purge_cleared_rows(self.conn)
+        else:
+            BackgroundReclaimer.shared().reclaim_rows(self.db_name, unfinished_only)
+
+    def _create_table(self, migrate_wait: float = None):
+        """Bring the memory file up to SCHEMA_VERSION and finish any interrupted clear.
+
+        If another process is still migrating the file after migrate_wait
+        seconds, the connection is dropped rather than used on a partly
+        migrated schema; writes are spooled and the next use tries again.
+        """
         if self.conn is None:
             return
 
+        try:
+            stat = os.stat(self.db_name)
+            # Files SQLite has just created are empty, so they are always checked.
+            identity = (stat.st_dev, stat.st_ino) if stat.st_size else None
+        except OSError:
+            identity = None
+        if identity is not None and self._schema_checked.get(self.db_name) == identity:
+            return
+
         cursor = self.conn.cursor()
         try:
-            cursor.execute(
+            # Up-to-date files only pay for this header read on open.
+            if cursor.execute("PRAGMA user_version").fetchone()[
+                0
+            ] < self.SCHEMA_VERSION and not self._migrate(
+                self.MIGRATE_LOCK_WAIT if migrate_wait is None else migrate_wait
+            ):
+                self._conn.close()
+                self._conn = None
+                self._file_lock.release()
+                self._file_lock = None
+                self._locked_out = True
+                return
+        except sqlite3.Error as e:
+            print(f"Database table creation error: {e}")
+            return
+        # A clear may not have been fully reclaimed, e.g. the process exited
+        # first. The reclaimer looks for such rows off the open path.
+        self._reclaim_cleared_rows(unfinished_only=True)
+        # An in-memory session migrates its copy, not the file on disk.
+        if identity is not None and not self.in_memory:
+            self._schema_checked[self.db_name] = identity
+
+    def _migrate(self, lock_wait: float) -> bool:
+        """Apply pending _migrate_to_<version> steps and record each in PRAGMA user_version.
+
+        The migration lock is separate from the shared lock every open
+        connection holds, so concurrent openers queue behind one migrator and
+        re-read the version once they get it. Steps must be safe to re-run,
+        as a step interrupted before its version is recorded runs again.
+        Returns False, without touching the file, if the lock is not had
+        within lock_wait seconds.
+        """
+        lock = self._lock_for(os.path.basename(self.db_name) + ".migrate")
+        # A session migrates its RAM copy; its exclusive lock keeps migrators out.
+        if not self.in_memory and not lock.acquire(timeout=lock_wait):
+            print(f"Timed out waiting for migration of {self.db_name}")
+            return False
+        try:
+            version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+            while version < self.SCHEMA_VERSION:
+                version += 1
+                getattr(self, f"_migrate_to_{version}")(self.conn)
+                self.conn.execute(f"PRAGMA user_version = {version}")
+                self.conn.commit()
+                if self.debug:
+                    print(f"Migrated {self.db_name} to schema version {version}.")
+        finally:
+            lock.release()  # A no-op if it was never acquired
+        return True
+
+    @staticmethod
+    def _add_column(conn, table: str, column: str, declaration: str):
+        """Add a column unless an interrupted run of the same migration already did."""
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+        if column not in columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+    def _migrate_to_1(self, conn):
+        """Baseline schema; IF NOT EXISTS adopts files created before versioning."""
+        # Lets the reclaimer hand freed pages back; only effective on new files.
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        # One transaction, rather than one commit and fsync per statement
+        self._run_script(
+            conn,
+            """
+            BEGIN;
+            CREATE TABLE IF NOT EXISTS memories (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                tag TEXT,
+                memo TEXT,
+                by_who TEXT,
+                last_modified TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_memories_last_modified
+                ON memories(last_modified);
+            CREATE TABLE IF NOT EXISTS memories_archive (
+                id INTEGER PRIMARY KEY,
+                tag TEXT,
+                memo_blob BLOB,
+                codec TEXT,
+                dict_id INTEGER,
+                by_who TEXT,
+                last_modified TEXT,
+                archived_at TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_memories_archive_tag
+                ON memories_archive(tag);
+            CREATE TABLE IF NOT EXISTS archive_dicts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                codec TEXT,
+                data BLOB,
+                created TEXT
+            );
+            CREATE TABLE IF NOT EXISTS memory_changelog (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                op TEXT NOT NULL,
+                memory_id INTEGER,
+                tag TEXT,
+                memo TEXT,
+                by_who TEXT,
+                last_modified TEXT
+            );
+            CREATE TABLE IF NOT EXISTS replication_state (
+                source TEXT PRIMARY KEY,
+                last_seq INTEGER NOT NULL
+            );
+            CREATE TRIGGER IF NOT EXISTS memories_log_insert
+            AFTER INSERT ON memories BEGIN
+                INSERT INTO memory_changelog
+                    (op, memory_id, tag, memo, by_who, last_modified)
+                VALUES
+                    ('insert', NEW.id, NEW.tag, NEW.memo, NEW.by_who, NEW.last_modified);
+            END;
+            CREATE TRIGGER IF NOT EXISTS memories_log_update
+            AFTER UPDATE ON memories BEGIN
+                INSERT INTO memory_changelog
+                    (op, memory_id, tag, memo, by_who, last_modified)
+                VALUES
+                    ('update', NEW.id, NEW.tag, NEW.memo, NEW.by_who, NEW.last_modified);
+            END;
+            CREATE TRIGGER IF NOT EXISTS memories_log_delete
+            AFTER DELETE ON memories BEGIN
+                INSERT INTO memory_changelog (op, memory_id) VALUES ('delete', OLD.id);
+            END;
+            CREATE TRIGGER IF NOT EXISTS memories_archive_log_insert
+            AFTER INSERT ON memories_archive BEGIN
+                INSERT INTO memory_changelog (op, memory_id) VALUES ('archive', NEW.id);
+            END;
+            CREATE TRIGGER IF NOT EXISTS memories_archive_log_delete
+            AFTER DELETE ON memories_archive BEGIN
+                INSERT INTO memory_changelog (op, memory_id)
+                VALUES ('archive_delete', OLD.id);
+            END;
+            CREATE TABLE IF NOT EXISTS memory_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                memory_id INTEGER NOT NULL,
+                version INTEGER NOT NULL,
+                tag TEXT,
+                memo TEXT,
+                memo_delta BLOB,
+                codec TEXT,
+                dict_id INTEGER,
+                by_who TEXT,
+                last_modified TEXT,
+                valid_to TEXT NOT NULL,
+                deleted INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS idx_memory_history_memory
+                ON memory_history(memory_id, version);
+            CREATE INDEX IF NOT EXISTS idx_memory_history_valid
+                ON memory_history(valid_to, last_modified);
+            CREATE TRIGGER IF NOT EXISTS memories_history_update
+            BEFORE UPDATE ON memories BEGIN
+                INSERT INTO memory_history
+                    (memory_id, version, tag, memo, by_who, last_modified, valid_to)
+                VALUES (
+                    OLD.id,
+                    (SELECT COALESCE(MAX(version), 0) + 1 FROM memory_history
+                     WHERE memory_id = OLD.id),
+                    OLD.tag, OLD.memo, OLD.by_who, OLD.last_modified,
+                    NEW.last_modified
+                );
+            END;
+            CREATE TRIGGER IF NOT EXISTS memories_history_delete
+            BEFORE DELETE ON memories
+            WHEN NOT EXISTS (SELECT 1 FROM memories_archive WHERE id = OLD.id)
+            BEGIN
+                INSERT INTO memory_history
+                    (memory_id, version, tag, memo, by_who, last_modified,
+                     valid_to, deleted)
+                VALUES (
+                    OLD.id,
+                    (SELECT COALESCE(MAX(version), 0) + 1 FROM memory_history
+                     WHERE memory_id = OLD.id),
+                    OLD.tag, OLD.memo, OLD.by_who, OLD.last_modified,
+                    strftime('%Y-%m-%d_%H:%M:%S', 'now', 'localtime'), 1
+                );
+            END;
+            CREATE TABLE IF NOT EXISTS memory_meta (
+                key TEXT PRIMARY KEY,
+                value
+            );
+            CREATE VIEW IF NOT EXISTS live_memories AS
+                SELECT * FROM memories WHERE id > (
+                    SELECT COALESCE(MAX(value), 0) FROM memory_meta
+                    WHERE key = 'cleared_through'
+                );
+            CREATE VIEW IF NOT EXISTS live_memories_archive AS
+                SELECT * FROM memories_archive WHERE id > (
+                    SELECT COALESCE(MAX(value), 0) FROM memory_meta
+                    WHERE key = 'cleared_through'
+                );
+            CREATE TRIGGER IF NOT EXISTS memories_archive_history_delete
+            BEFORE DELETE ON memories_archive
+            WHEN NOT EXISTS (SELECT 1 FROM memories WHERE id = OLD.id)
+            BEGIN
+                INSERT INTO memory_history
+                    (memory_id, version, tag, memo_delta, codec, dict_id, by_who,
+                     last_modified, valid_to, deleted)
+                VALUES (
+                    OLD.id,
+                    (SELECT COALESCE(MAX(version), 0) + 1 FROM memory_history
+                     WHERE memory_id = OLD.id),
+                    OLD.tag, OLD.memo_blob, OLD.codec, OLD.dict_id, OLD.by_who,
+                    OLD.last_modified,
+                    strftime('%Y-%m-%d_%H:%M:%S', 'now', 'localtime'), 1
+                );
+            END;
+            COMMIT;
+            """,
+        )
+
+    def _migrate_to_2(self, conn):
+        """Access statistics for quota eviction.
+
+        Columns with a constant default are added without rewriting rows, so
+        there is nothing to backfill. The update triggers are narrowed to the
+        content columns so flushing access counts does not create history
+        versions or change-log entries.
+        """
+        self._add_column(conn, "memories", "access_count", "INTEGER NOT NULL DEFAULT 0")
+        self._add_column(conn, "memories", "last_accessed", "TEXT")
+        conn.executescript(
+            """
+            BEGIN;
+            DROP TRIGGER IF EXISTS memories_log_update;
+            CREATE TRIGGER memories_log_update
+            AFTER UPDATE OF tag, memo, by_who, last_modified ON memories BEGIN
+                INSERT INTO memory_changelog
+                    (op, memory_id, tag, memo, by_who, last_modified)
+                VALUES
+                    ('update', NEW.id, NEW.tag, NEW.memo, NEW.by_who, NEW.last_modified);
+            END;
+            DROP TRIGGER IF EXISTS memories_history_update;
+            CREATE TRIGGER memories_history_update
+            BEFORE UPDATE OF tag, memo, by_who, last_modified ON memories BEGIN
+                INSERT INTO memory_history
+                    (memory_id, version, tag, memo, by_who, last_modified, valid_to)
+                VALUES (
+                    OLD.id,
+                    (SELECT COALESCE(MAX(version), 0) + 1 FROM memory_history
+                     WHERE memory_id = OLD.id),
+                    OLD.tag, OLD.memo, OLD.by_who, OLD.last_modified,
+                    NEW.last_modified
+                );
+            END;
+            CREATE INDEX IF NOT EXISTS idx_memories_last_accessed
+                ON memories(last_accessed);
+            COMMIT;
+            """
+        )
+
+    def _migrate_to_3(self, conn):
+        """Intern tags and authors into lookup tables referenced by integer ids.
+
+        The lookup tables, the id columns and triggers that read a name from
+        either form are set up in one short transaction. Rows are then
+        converted in committed batches with the progress in memory_meta, so
+        other connections keep working and an interrupted run resumes where
+        it stopped. The conversion is the only write to the text columns, and
+        the triggers skip it, so it creates no history versions or change-log
+        entries. Once every row is converted, the triggers and live_memories
+        are swapped for ones that read the lookup tables only.
+        live_memories joins the names back in, so readers are unchanged.
+        """
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(memories)")]
+        add_columns = "".join(
+            f"ALTER TABLE memories ADD COLUMN {column} {declaration};\n"
+            for column, declaration in (
+                ("tag_id", "INTEGER REFERENCES tags(id)"),
+                ("by_id", "INTEGER REFERENCES authors(id)"),
+            )
+            if column not in columns
+        )
+        default_tags = ", ".join(
+            "('{}')".format(tag.replace("'", "''")) for tag in self.tag_options
+        )
+        self._run_script(
+            conn,
+            f"""
+            BEGIN IMMEDIATE;
+            CREATE TABLE IF NOT EXISTS tags (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL UNIQUE
+            );
+            CREATE TABLE IF NOT EXISTS authors (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL UNIQUE
+            );
+            INSERT OR IGNORE INTO tags (name) VALUES {default_tags};
+            INSERT OR IGNORE INTO tags (name)
+                SELECT DISTINCT tag FROM memories WHERE tag IS NOT NULL;
+            INSERT OR IGNORE INTO authors (name)
+                SELECT DISTINCT by_who FROM memories WHERE by_who IS NOT NULL;
+            {add_columns}
+            CREATE INDEX IF NOT EXISTS idx_memories_tag_id ON memories(tag_id);
+            {self._interned_schema(converting=True)}
+            COMMIT;
+            """,
+        )
+        while True:
+            row = conn.execute(
+                "SELECT value FROM memory_meta WHERE key = 'intern_backfill'"
+            ).fetchone()
+            last = conn.execute(
                 """
-                CREATE TABLE IF NOT EXISTS memories (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    tag TEXT,
-                    memo TEXT,
-                    by_who TEXT,
-                    last_modified TEXT
+                SELECT MAX(id) FROM (
+                    SELECT id FROM memories WHERE id > ? ORDER BY id LIMIT 500
                 )
+                """,
+                (row[0] if row else 0,),
+            ).fetchone()[0]
+            if last is None:
+                break
+            # Ids a writer set since step one win over the stale text.
+            conn.execute(
                 """
+                UPDATE memories SET
+                    tag_id = COALESCE(
+                        tag_id, (SELECT id FROM tags WHERE name = memories.tag)
+                    ),
+                    by_id = COALESCE(
+                        by_id, (SELECT id FROM authors WHERE name = memories.by_who)
+                    ),
+                    tag = NULL,
+                    by_who = NULL
+                WHERE id > ? AND id <= ? AND (tag IS NOT NULL OR by_who IS NOT NULL)
+                """,
+                (row[0] if row else 0, last),
             )
-            self.conn.commit()
-            if self.debug:
-                print("Memory table created or already exists.")
-            except sqlite3.Error as e:
-                print(f"Database table creation error: {e}")
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO memory_meta (key, value)
+                VALUES ('intern_backfill', ?)
+                """,
+                (last,),
+            )
+            conn.commit()
+            time.sleep(0.01)  # Let foreground writers in between batches
+        self._run_script(
+            conn,
+            f"""
+            BEGIN IMMEDIATE;
+            {self._interned_schema(converting=False)}
+            COMMIT;
+            """,
+        )
+
+    @staticmethod
+    def _run_script(conn, script: str):
+        """Run a transaction script, rolling it back if a statement fails."""
+        try:
+            conn.executescript(script)
+        except sqlite3.Error:
+            conn.rollback()  # Leave the file as it was; the step runs again
+            raise
+
+    @staticmethod
+    def _interned_schema(converting: bool) -> str:
+        """Change-log and history triggers, and live_memories, for interned names.
+
+        While converting, a row may still hold its names as text, and an
+        update that changes the text columns is the conversion itself.
+        """
+        if converting:
+            tag = "COALESCE((SELECT name FROM tags WHERE id = {0}.tag_id), {0}.tag)"
+            author = (
+                "COALESCE((SELECT name FROM authors WHERE id = {0}.by_id), {0}.by_who)"
+            )
+            view_tag, view_author = (
+                "COALESCE(t.name, m.tag)",
+                "COALESCE(a.name, m.by_who)",
+            )
+            when = "WHEN OLD.tag IS NEW.tag AND OLD.by_who IS NEW.by_who"
+        else:
+            tag = "(SELECT name FROM tags WHERE id = {0}.tag_id)"
+            author = "(SELECT name FROM authors WHERE id = {0}.by_id)"
+            view_tag, view_author, when = "t.name", "a.name", ""
+        return f"""
+            DROP VIEW IF EXISTS live_memories;
+            CREATE VIEW live_memories AS
+                SELECT m.id, {view_tag} AS tag, m.memo, {view_author} AS by_who,
+                    m.last_modified, m.access_count, m.last_accessed,
+                    m.tag_id, m.by_id
+                FROM memories AS m
+                LEFT JOIN tags AS t ON t.id = m.tag_id
+                LEFT JOIN authors AS a ON a.id = m.by_id
+                WHERE m.id > (
+                    SELECT COALESCE(MAX(value), 0) FROM memory_meta
+                    WHERE key = 'cleared_through'
+                );
+            DROP TRIGGER IF EXISTS memories_log_insert;
+            CREATE TRIGGER memories_log_insert
+            AFTER INSERT ON memories BEGIN
+                INSERT INTO memory_changelog
+                    (op, memory_id, tag, memo, by_who, last_modified)
+                VALUES (
+                    'insert', NEW.id, {tag.format("NEW")}, NEW.memo,
+                    {author.format("NEW")}, NEW.last_modified
+                );
+            END;
+            DROP TRIGGER IF EXISTS memories_log_update;
+            CREATE TRIGGER memories_log_update
+            AFTER UPDATE OF tag_id, memo, by_id, last_modified ON memories {when}
+            BEGIN
+                INSERT INTO memory_changelog
+                    (op, memory_id, tag, memo, by_who, last_modified)
+                VALUES (
+                    'update', NEW.id, {tag.format("NEW")}, NEW.memo,
+                    {author.format("NEW")}, NEW.last_modified
+                );
+            END;
+            DROP TRIGGER IF EXISTS memories_history_update;
+            CREATE TRIGGER memories_history_update
+            BEFORE UPDATE OF tag_id, memo, by_id, last_modified ON memories {when}
+            BEGIN
+                INSERT INTO memory_history
+                    (memory_id, version, tag, memo, by_who, last_modified, valid_to)
+                VALUES (
+                    OLD.id,
+                    (SELECT COALESCE(MAX(version), 0) + 1 FROM memory_history
+                     WHERE memory_id = OLD.id),
+                    {tag.format("OLD")}, OLD.memo, {author.format("OLD")},
+                    OLD.last_modified, NEW.last_modified
+                );
+            END;
+            DROP TRIGGER IF EXISTS memories_history_delete;
+            CREATE TRIGGER memories_history_delete
+            BEFORE DELETE ON memories
+            WHEN NOT EXISTS (SELECT 1 FROM memories_archive WHERE id = OLD.id)
+            BEGIN
+                INSERT INTO memory_history
+                    (memory_id, version, tag, memo, by_who, last_modified,
+                     valid_to, deleted)
+                VALUES (
+                    OLD.id,
+                    (SELECT COALESCE(MAX(version), 0) + 1 FROM memory_history
+                     WHERE memory_id = OLD.id),
+                    {tag.format("OLD")}, OLD.memo, {author.format("OLD")},
+                    OLD.last_modified,
+                    strftime('%Y-%m-%d_%H:%M:%S', 'now', 'localtime'), 1
+                );
+            END;
+            """
+
+    def _migrate_to_4(self, conn):
+        """Inverted entity -> memory id index for memories_about.
+
+        Entries of archived memories are kept. The backfill indexes hot and
+        archived rows in committed batches and records its progress in
+        memory_meta, so an interrupted run resumes where it stopped.
+        """
+        conn.executescript(
+            """
+            BEGIN;
+            CREATE TABLE IF NOT EXISTS memory_entities (
+                entity TEXT NOT NULL,
+                memory_id INTEGER NOT NULL,
+                PRIMARY KEY (entity, memory_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_memory_entities_memory
+                ON memory_entities(memory_id);
+            CREATE TRIGGER IF NOT EXISTS memories_entities_delete
+            AFTER DELETE ON memories
+            WHEN NOT EXISTS (SELECT 1 FROM memories_archive WHERE id = OLD.id)
+            BEGIN
+                DELETE FROM memory_entities WHERE memory_id = OLD.id;
+            END;
+            CREATE TRIGGER IF NOT EXISTS memories_archive_entities_delete
+            AFTER DELETE ON memories_archive
+            WHEN NOT EXISTS (SELECT 1 FROM memories WHERE id = OLD.id)
+            BEGIN
+                DELETE FROM memory_entities WHERE memory_id = OLD.id;
+            END;
+            COMMIT;
+            """
+        )
+        for table, columns in (
+            ("memories", "memo"),
+            ("memories_archive", "memo_blob, codec, dict_id"),
+        ):
+            key = f"entity_backfill_{table}"
+            while True:
+                row = conn.execute(
+                    "SELECT value FROM memory_meta WHERE key = ?", (key,)
+                ).fetchone()
+                rows = conn.execute(
+                    f"SELECT id, {columns} FROM {table} WHERE id > ? ORDER BY id LIMIT 500",
+                    (row[0] if row else 0,),
+                ).fetchall()
+                if not rows:
+                    break
+                cursor = conn.cursor()
+                for index, *memo in rows:
+                    if table == "memories_archive":
+                        memo = [self._decompress_memo(*memo)]
+                    self._index_entities(cursor, index, memo[0])
+                cursor.execute(
+                    "INSERT OR REPLACE INTO memory_meta (key, value) VALUES (?, ?)",
+                    (key, rows[-1][0]),
+                )
+                conn.commit()
+                time.sleep(0.01)  # Let foreground writers in between batches
+
+    def _migrate_to_5(self, conn):
+        """Keys of replayed spool entries, so a replay can safely run twice."""
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS spool_applied (key TEXT PRIMARY KEY) WITHOUT ROWID"
+        )
+
+    def _migrate_to_6(self, conn):
+        """Keyword index of archived memos, and archive dictionaries without memo text.
 
-    def switch_memory_file(self, new_db_name: str):  # Renamed to switch_memory_file
-        """Switch to a new memory database file in designated directory."""
-        if self.conn:
-            self.conn.close()  # Close current connection
+        Earlier dictionaries were raw memo text. Archived rows and history
+        versions compressed with them are re-encoded in committed batches
+        with a common-words dictionary, then they are dropped. Both the
+        re-encoding and the keyword backfill resume after an interruption.
+        """
+        conn.executescript(
+            """
+            BEGIN;
+            CREATE TABLE IF NOT EXISTS archive_terms (
+                term TEXT NOT NULL,
+                memory_id INTEGER NOT NULL,
+                PRIMARY KEY (term, memory_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_archive_terms_memory
+                ON archive_terms(memory_id);
+            CREATE TRIGGER IF NOT EXISTS memories_archive_terms_delete
+            AFTER DELETE ON memories_archive BEGIN
+                DELETE FROM archive_terms WHERE memory_id = OLD.id;
+            END;
+            COMMIT;
+            """
+        )
+        self._add_column(conn, "archive_dicts", "source", "TEXT")
+        old_dicts = "SELECT id FROM archive_dicts WHERE source IS NULL"
+        if conn.execute(old_dicts + " LIMIT 1").fetchone():
+            dict_id = self._archive_dictionary(conn.cursor())
+            conn.commit()
+            dictionary = self._archive_dicts.get(dict_id)
+            for table, column in (
+                ("memories_archive", "memo_blob"),
+                ("memory_history", "memo_delta"),
+            ):
+                while True:
+                    rows = conn.execute(
+                        f"""
+                        SELECT id, {column}, codec, dict_id FROM {table}
+                        WHERE dict_id IN ({old_dicts}) AND codec != 'delta' LIMIT 500
+                        """
+                    ).fetchall()
+                    if not rows:
+                        break
+                    conn.executemany(
+                        f"""
+                        UPDATE {table} SET {column} = ?, codec = ?, dict_id = ?
+                        WHERE id = ?
+                        """,
+                        [
+                            (
+                                self.compressor.compress(
+                                    self._decompress_memo(blob, codec, old_id),
+                                    dictionary,
+                                ),
+                                self.compressor.codec,
+                                dict_id,
+                                index,
+                            )
+                            for index, blob, codec, old_id in rows
+                        ],
+                    )
+                    conn.commit()
+                    time.sleep(0.01)  # Let foreground writers in between batches
+            conn.execute(f"DELETE FROM archive_dicts WHERE id IN ({old_dicts})")
+            conn.commit()
+            self._archive_dicts = {}  # Cached copies of the dropped ones
+        while True:
+            row = conn.execute(
+                "SELECT value FROM memory_meta WHERE key = 'archive_terms_backfill'"
+            ).fetchone()
+            rows = conn.execute(
+                """
+                SELECT id, memo_blob, codec, dict_id FROM memories_archive
+                WHERE id > ? ORDER BY id LIMIT 500
+                """,
+                (row[0] if row else 0,),
+            ).fetchall()
+            if not rows:
+                break
+            cursor = conn.cursor()
+            for index, *memo in rows:
+                self._index_terms(
+                    cursor, "archive_terms", index, self._decompress_memo(*memo)
+                )
+            cursor.execute(
+                """
+                INSERT OR REPLACE INTO memory_meta (key, value)
+                VALUES ('archive_terms_backfill', ?)
+                """,
+                (rows[-1][0],),
+            )
+            conn.commit()
+            time.sleep(0.01)  # Let foreground writers in between batches
+
+    def _migrate_to_7(self, conn):
+        """Time of every clear, so history shows cleared rows deleted when the clear ran.
+
+        The reclaimer deletes cleared rows later, so the tombstone triggers
+        take valid_to from memory_clears for ids at or below a horizon.
+        Clears from before this version are dated to the migration.
+        """
+        now = datetime.datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
+        cleared_at = f"""COALESCE(
+                        (SELECT MIN(cleared_at) FROM memory_clears
+                         WHERE cleared_through >= OLD.id),
+                        strftime('%Y-%m-%d_%H:%M:%S', 'now', 'localtime')
+                    )"""
+        conn.executescript(
+            f"""
+            BEGIN;
+            CREATE TABLE IF NOT EXISTS memory_clears (
+                cleared_through INTEGER PRIMARY KEY,
+                cleared_at TEXT NOT NULL
+            );
+            INSERT OR IGNORE INTO memory_clears (cleared_through, cleared_at)
+            SELECT value, '{now}' FROM memory_meta
+            WHERE key = 'cleared_through' AND value > 0;
+            DROP TRIGGER IF EXISTS memories_history_delete;
+            CREATE TRIGGER memories_history_delete
+            BEFORE DELETE ON memories
+            WHEN NOT EXISTS (SELECT 1 FROM memories_archive WHERE id = OLD.id)
+            BEGIN
+                INSERT INTO memory_history
+                    (memory_id, version, tag, memo, by_who, last_modified,
+                     valid_to, deleted)
+                VALUES (
+                    OLD.id,
+                    (SELECT COALESCE(MAX(version), 0) + 1 FROM memory_history
+                     WHERE memory_id = OLD.id),
+                    (SELECT name FROM tags WHERE id = OLD.tag_id), OLD.memo,
+                    (SELECT name FROM authors WHERE id = OLD.by_id), OLD.last_modified,
+                    {cleared_at}, 1
+                );
+            END;
+            DROP TRIGGER IF EXISTS memories_archive_history_delete;
+            CREATE TRIGGER memories_archive_history_delete
+            BEFORE DELETE ON memories_archive
+            WHEN NOT EXISTS (SELECT 1 FROM memories WHERE id = OLD.id)
+            BEGIN
+                INSERT INTO memory_history
+                    (memory_id, version, tag, memo_delta, codec, dict_id, by_who,
+                     last_modified, valid_to, deleted)
+                VALUES (
+                    OLD.id,
+                    (SELECT COALESCE(MAX(version), 0) + 1 FROM memory_history
+                     WHERE memory_id = OLD.id),
+                    OLD.tag, OLD.memo_blob, OLD.codec, OLD.dict_id, OLD.by_who,
+                    OLD.last_modified, {cleared_at}, 1
+                );
+            END;
+            COMMIT;
+            """
+        )
+
+    def _migrate_to_8(self, conn):
+        """Word index of hot memos, so relevant_memories reads only the matches.
 
-        self.db_name = os.path.join(self.directory, new_db_name)
-        self.conn = self._connect_db()  # Connect to new database
-        self._create_table()  # Ensure table exists in new database
+        Filled in committed batches that resume after an interruption, like
+        the entity backfill.
+        """
+        conn.executescript(
+            """
+            BEGIN;
+            CREATE TABLE IF NOT EXISTS memory_terms (
+                term TEXT NOT NULL,
+                memory_id INTEGER NOT NULL,
+                PRIMARY KEY (term, memory_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_memory_terms_memory
+                ON memory_terms(memory_id);
+            CREATE TRIGGER IF NOT EXISTS memories_terms_delete
+            AFTER DELETE ON memories BEGIN
+                DELETE FROM memory_terms WHERE memory_id = OLD.id;
+            END;
+            COMMIT;
+            """
+        )
+        while True:
+            row = conn.execute(
+                "SELECT value FROM memory_meta WHERE key = 'terms_backfill'"
+            ).fetchone()
+            rows = conn.execute(
+                "SELECT id, memo FROM memories WHERE id > ? ORDER BY id LIMIT 500",
+                (row[0] if row else 0,),
+            ).fetchall()
+            if not rows:
+                break
+            cursor = conn.cursor()
+            for index, memo in rows:
+                self._index_terms(cursor, "memory_terms", index, memo)
+            cursor.execute(
+                """
+                INSERT OR REPLACE INTO memory_meta (key, value)
+                VALUES ('terms_backfill', ?)
+                """,
+                (rows[-1][0],),
+            )
+            conn.commit()
+            time.sleep(0.01)  # Let foreground writers in between batches
+
+    def switch_memory_file(
+        self, new_db_name: str, in_memory: bool = False, persist_interval: int = 30
+    ):  # Renamed to switch_memory_file
+        """Switch to a new memory database file in designated directory.
+
+        With in_memory=True the file is loaded into a shared in-memory
+        database and written back to disk every persist_interval seconds, when
+        switching away and at exit.
+        """
+        if self._conn is not None:
+            self._flush_access()
+            self._end_session()
+            self._conn.close()  # Close current connection
+
+        self.db_name = self._file_path(new_db_name)
+        self.in_memory = in_memory and self.backend == "sqlite"
+        self._archive_dicts = {}
+        self._conn = self._connect_db()  # Connect to new database
+        if self.in_memory and self._file_lock is None:
+            # Other processes have the file open; persisting a RAM copy would
+            # overwrite their writes.
+            self.in_memory = False
+            self._conn = self._connect_db()
+            in_memory = None
+        self._store.close()
+        self._store = self._open_store()
+        if self.in_memory and self._conn is not None:
+            self._persist_interval = persist_interval
+            self._session_pending = True  # The file is loaded on first use
+        else:
+            self._create_table()  # Ensure table exists in new database
+            self._try_replay_spool()
 
         if self.debug:
             print(f"Switched to database file: {self.db_name}")
+        if in_memory is None:
+            return f"Switched to database file: {new_db_name} (not as an in-memory session: the file is in use by another process)"
+        if in_memory:
+            return f"Switched to in-memory session for database file: {new_db_name}"
         return f"Switched to database file: {new_db_name}"  # Return message for function call
 
+    def persist_session(self):
+        """Write the in-memory session back to its file now."""
+        if not self.in_memory:
+            return "Current memory file is not an in-memory session."
+        return _deferred("SessionPersister").shared().persist(self.db_name)
+
+    def _end_session(self):
+        """Persist and release the current in-memory session, if any."""
+        if self.in_memory:
+            if not self._session_pending:
+                _deferred("SessionPersister").shared().unregister(self.db_name)
+            self._session_pending = False  # Never used: the file is unchanged
+            self.in_memory = False
+
     def reindex_memory(self):
         """Reindexing is not directly applicable to SQLite as it's index-based, returning a message."""
         return "Reindexing is not needed for SQLite databases."
 
     def delete_memory_by_index(self, index: int):
-        """Delete memory entry by its index (row ID in SQLite)."""
-        if self.conn is None:
-            return "No database connection."
+        """Delete memory entry by its index (row ID in SQLite), spooling it while the database cannot take it."""
+        if self.store is None:
+            return self._spool_write("delete", "No database connection.", index=index)
 
         print(
             f"DEBUG: delete_memory_by_index called with index: {index}"
         )  # <---- ADD THIS DEBUG PRINT
 
-        cursor = self.conn.cursor()
         try:
-            cursor.execute("DELETE FROM memories WHERE id = ?", (index,))
-            if cursor.rowcount > 0:
-                self.conn.commit()
+            with (
+                self._write_lock_wait()
+                if self.backend == "sqlite"
+                else contextlib.nullcontext()
+            ):
+                self._replay_spool()
+                deleted = self.store.delete(index)
+            if deleted:
                 return f"Memory index {index} deleted successfully."
             else:
                 return f"Memory index {index} does not exist."
-        except sqlite3.Error as e:
+        except sqlite3.OperationalError as e:
+            return self._spool_write("delete", e, index=index)
+        except (sqlite3.Error, OSError) as e:
             return f"Database error deleting memory index {index}: {e}"
 
     def update_memory_by_index(self, index: int, tag: str, memo: str, by: str):
-        """Update memory entry by its index."""
-        if self.conn is None:
-            return "No database connection."
-
-        if tag not in self.tag_options:
-            tag = "others"
-
+        """Update memory entry by its index, spooling it while the database cannot take it."""
         last_modified = datetime.datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
+        spooled = dict(
+            index=index, tag=tag, memo=memo, by=by, last_modified=last_modified
+        )
+        if self.store is None:
+            return self._spool_write("update", "No database connection.", **spooled)
 
         print(
             f"DEBUG: update_memory_by_index called with index: {index}"
         )  # <---- ADD THIS DEBUG PRINT
 
-        cursor = self.conn.cursor()
         try:
-            cursor.execute(
-                """
-                UPDATE memories
-                SET tag = ?, memo = ?, by_who = ?, last_modified = ?
-                WHERE id = ?
-                """,
-                (tag, memo, by, last_modified, index),
-            )
-            if cursor.rowcount > 0:
-                self.conn.commit()
+            with (
+                self._write_lock_wait()
+                if self.backend == "sqlite"
+                else contextlib.nullcontext()
+            ):
+                self._replay_spool()
+                updated = self.store.update(
+                    index, self.valid_tag(tag), memo, by, last_modified
+                )
+            if updated:
                 return f"Memory index {index} updated successfully."
             else:
                 return f"Memory index {index} does not exist."
-        except sqlite3.Error as e:
+        except sqlite3.OperationalError as e:
+            return self._spool_write("update", e, **spooled)
+        except (sqlite3.Error, OSError) as e:
             return f"Database error updating memory index {index}: {e}"
 
-    # load_memory and save_memory methods are removed as SQLite handles persistence
-
-    def add_to_memory(self, tag: str, memo: str, by: str):
-        """Add a new entry to memory."""
-        if self.conn is None:
-            return "No database connection."
+    def update_memories_bulk(self, patches: list) -> dict:
+        """Apply sparse patches in one backend write; returns a message per index.
+
+        A patch is {"index": n} plus any of "tag", "memo" and "by"; only the
+        fields given (and not empty) change. Several patches of one index are
+        merged in order. Like single updates, they are spooled while the
+        database cannot take them.
+        """
+        results = {}
+        merged = {}
+        for position, patch in enumerate(patches, 1):
+            try:
+                index = int(patch["index"])
+            except (TypeError, KeyError, ValueError):
+                results[f"patch {position}"] = "Patch has no valid index."
+                continue
+            fields = {
+                column: patch[key]
+                for key, column in (("tag", "tag"), ("memo", "memo"), ("by", "by_who"))
+                if patch.get(key) not in (None, "")
+            }
+            if not fields:
+                results[index] = f"Memory index {index} has nothing to update."
+                continue
+            merged.setdefault(index, {}).update(fields)
+        if not merged:
+            return results
 
-        if tag not in self.tag_options:
-            tag = "others"
+        last_modified = datetime.datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
+        if self.store is None:
+            return self._spool_patches(
+                results, merged, last_modified, "No database connection."
+            )
+        try:
+            with (
+                self._write_lock_wait()
+                if self.backend == "sqlite"
+                else contextlib.nullcontext()
+            ):
+                self._replay_spool()
+                updated = self.store.update_many(
+                    [
+                        (index, self._valid_fields(fields))
+                        for index, fields in merged.items()
+                    ],
+                    last_modified,
+                )
+        except sqlite3.OperationalError as e:
+            return self._spool_patches(results, merged, last_modified, e)
+        except (sqlite3.Error, OSError) as e:
+            for index in merged:
+                results[index] = f"Database error updating memory index {index}: {e}"
+            return results
+        for index, exists in updated.items():
+            if exists:
+                results[index] = f"Memory index {index} updated successfully."
+            else:
+                results[index] = f"Memory index {index} does not exist."
+        return results
+
+    def _valid_fields(self, fields: dict) -> dict:
+        if "tag" in fields:
+            return dict(fields, tag=self.valid_tag(fields["tag"]))
+        return fields
+
+    def _spool_patches(self, results: dict, merged: dict, last_modified: str, error):
+        """Spool update_memories_bulk patches; the tags are validated on replay."""
+        messages = self._spool_writes(
+            "update",
+            error,
+            [
+                dict(index=index, fields=fields, last_modified=last_modified)
+                for index, fields in merged.items()
+            ],
+        )
+        results.update(zip(merged, messages))
+        return results
+
+    # load_memory and save_memory methods are removed as SQLite handles persistence
 
+    def add_to_memory(self, tag: str, memo: str, by: str):
+        """Add a new entry to memory, spooling it while the database cannot take it."""
         last_modified = datetime.datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
-        cursor = self.conn.cursor()
+        spooled = dict(tag=tag, memo=memo, by=by, last_modified=last_modified)
+        if self.store is None:
+            return self._spool_write("add", "No database connection.", **spooled)
+
         try:
-            cursor.execute(
-                """
-                INSERT INTO memories (tag, memo, by_who, last_modified)
-                VALUES (?, ?, ?, ?)
-                """,
-                (tag, memo, by, last_modified),
-            )
-            self.conn.commit()
+            with (
+                self._write_lock_wait()
+                if self.backend == "sqlite"
+                else contextlib.nullcontext()
+            ):
+                self._replay_spool()
+                self.store.add(self.valid_tag(tag), memo, by, last_modified)
             return "Memory added successfully."
-        except sqlite3.Error as e:
+        except sqlite3.OperationalError as e:
+            return self._spool_write("add", e, **spooled)
+        except (sqlite3.Error, OSError) as e:
             return f"Database error adding memory: {e}"
 
+    def add_many_to_memory(self, entries: list):
+        """Add (tag, memo, by) entries in one backend write; returns one message per entry.
+
+        Like single adds, they are spooled while the database cannot take them.
+        """
+        if not entries:
+            return []
+        last_modified = datetime.datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
+        spooled = [
+            dict(tag=tag, memo=memo, by=by, last_modified=last_modified)
+            for tag, memo, by in entries
+        ]
+        if self.store is None:
+            return self._spool_writes("add", "No database connection.", spooled)
+
+        try:
+            with (
+                self._write_lock_wait()
+                if self.backend == "sqlite"
+                else contextlib.nullcontext()
+            ):
+                self._replay_spool()
+                self.store.add_many(
+                    [
+                        (self.valid_tag(tag), memo, by, last_modified)
+                        for tag, memo, by in entries
+                    ]
+                )
+            return ["Memory added successfully."] * len(entries)
+        except sqlite3.OperationalError as e:
+            return self._spool_writes("add", e, spooled)
+        except (sqlite3.Error, OSError) as e:
+            return [f"Database error adding memory: {e}"] * len(entries)
+
     def retrieve_from_memory(
         self, index: int
     ):  # Changed key to index, assuming index retrieval
         """Retrieve memory by its index (row ID)."""
-        if self.conn is None:
+        if self.store is None:
             return "No database connection."
 
-        cursor = self.conn.cursor()
         try:
-            cursor.execute(
-                "SELECT tag, memo, by_who, last_modified FROM memories WHERE id = ?",
-                (index,),
-            )
-            row = cursor.fetchone()
-            if row:
-                return {
-                    "index": index,  # Added index to the return for clarity
-                    "tag": row[0],
-                    "memo": row[1],
-                    "by": row[2],
-                    "last_modified": row[3],
-                }
-            else:
-                return None  # Or return a specific message "Memory index not found"
-        except sqlite3.Error as e:
+            memory = self.store.get(index)
+            if memory and not memory.get("archived"):
+                self._record_access([index])
+            return memory  # None if the index does not exist
+        except (sqlite3.Error, OSError) as e:
             print(f"Database error retrieving memory by index {index}: {e}")
             return None
 
+    def relevant_memories(self, query: str, limit: int = 5) -> dict:
+        """Return the memories sharing the most words with query, most recent first on ties.
+
+        Backends search on their own connection or under their own lock, so
+        this can run in a worker thread while the caller keeps using self.conn.
+        """
+        terms = {
+            word
+            for word in re.findall(r"\w+", query.lower())
+            if len(word) > 2 and word not in self.STOP_WORDS
+        }
+        if not terms:
+            return {}
+
+        db_path = self.db_name  # Reads are credited to the file they came from
+        try:
+            # self._store: the conn property must not reconnect from a worker thread
+            rows = self._store.search(terms, limit)
+        except (sqlite3.Error, OSError) as e:
+            print(f"Database error searching relevant memories: {e}")
+            return {"error": f"Database error: {e}"}
+
+        self._record_access([row[0] for row in rows], db_path)
+        return {
+            index: {"tag": tag, "memo": memo, "by": by_who, "last_modified": modified}
+            for index, tag, memo, by_who, modified in rows
+        }
+
     def process_input_for_memory(
         self, input_text: str
     ):  # Unchanged, might need adaptation if needed
         return {"timestamp": str(datetime.datetime.now()), "input": input_text}
 
-    def get_all_memories(self) -> dict:
-        """Retrieve all memories from the database."""
-        if self.conn is None:
+    def get_all_memories(self, tag: str = None) -> dict:
+        """Retrieve all memories from the database, or only those with tag."""
+        if self.store is None:
             return {"error": "No database connection."}
 
-        cursor = self.conn.cursor()
         all_memories = {}
         try:
-            cursor.execute(
-                "SELECT id, tag, memo, by_who, last_modified FROM memories"
-            )
-            rows = cursor.fetchall()
+            rows = self.store.scan(tag)
             for row in rows:
                 index, tag, memo, by_who, last_modified = row
                 all_memories[index] = {  # Using index as key in dictionary
@@ -1003,40 +3667,827 @@ class MemoryFunctions:
                     "last_modified": last_modified,
                 }
             return all_memories
-        except sqlite3.Error as e:
+        except (sqlite3.Error, OSError) as e:
             print(f"Database error retrieving all memories: {e}")
             return {"error": f"Database error: {e}"}
 
     def clear_memory(self):
         """Clear all memory entries from the database."""
-        if self.conn is None:
+        if self.store is None:
             return "No database connection."
 
+        cleared_at = datetime.datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
+        try:
+            self.store.clear(cleared_at)
+            self.generation.bump()
+            return "ALL MEMORIES CLEARED!"
+        except (sqlite3.Error, OSError) as e:
+            return f"Database error clearing all memories: {e}"
+
+    def archive_memories(self, older_than_days: int, batch_size: int = 200):
+        """Move memories not read or modified for older_than_days into the compressed archive."""
+        if self.conn is None:
+            return self._no_connection()
+
+        self._flush_access()  # Reads still pending count too
+        cutoff = (
+            datetime.datetime.now() - datetime.timedelta(days=older_than_days)
+        ).strftime("%Y-%m-%d_%H:%M:%S")
+        archived_at = datetime.datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
         cursor = self.conn.cursor()
+        total = 0
+        try:
+            dict_id = self._archive_dictionary(cursor, cutoff)
+            while True:
+                cursor.execute(
+                    f"""
+                    SELECT id, tag, memo, by_who, last_modified FROM live_memories
+                    WHERE {self.LAST_USED} < ? ORDER BY {self.LAST_USED}, id LIMIT ?
+                    """,
+                    (cutoff, batch_size),
+                )
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                self._archive_rows(cursor, rows, dict_id, archived_at)
+                self.conn.commit()  # One short write transaction per batch
+                total += len(rows)
+            if self.debug:
+                print(f"Archived {total} memories last used before {cutoff}.")
+            return f"Archived {total} memories not used for {older_than_days} days."
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            return f"Database error archiving memories: {e}"
+
+    def search_archived_memories(self, tag: str = None, keyword: str = None, limit=50):
+        """Search the archive by tag and keyword, decompressing only the candidates.
+
+        Both filters use indexes. Every word of keyword has to start a word
+        of the memo, and the memo has to contain keyword as a whole.
+        """
+        if self.conn is None:
+            return {"error": self._no_connection()}
+
+        query = """
+            SELECT id, tag, memo_blob, codec, dict_id, by_who, last_modified
+            FROM live_memories_archive
+        """
+        conditions = []
+        params = ()
+        if tag:
+            conditions.append("tag = ?")
+            params = (tag,)
+        terms = sorted(set(re.findall(r"\w+", keyword.lower()))) if keyword else []
+        if terms:
+            conditions.append(
+                "id IN ("
+                + " INTERSECT ".join(
+                    "SELECT memory_id FROM archive_terms WHERE term >= ? AND term < ?"
+                    for _ in terms
+                )
+                + ")"
+            )
+            # Upper bound of the words starting with term
+            params += tuple(
+                value for term in terms for value in (term, term + "\U0010ffff")
+            )
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        results = {}
         try:
-            cursor.execute("DELETE FROM memories")
+            for row in self.conn.execute(query + " ORDER BY id", params):
+                index, tag, blob, codec, dict_id, by_who, last_modified = row
+                memo = self._decompress_memo(blob, codec, dict_id)
+                if keyword and keyword.lower() not in memo.lower():
+                    continue
+                results[index] = {
+                    "tag": tag,
+                    "memo": memo,
+                    "by": by_who,
+                    "last_modified": last_modified,
+                }
+                if len(results) >= limit:
+                    break
+            return results
+        except sqlite3.Error as e:
+            print(f"Database error searching archived memories: {e}")
+            return {"error": f"Database error: {e}"}
+
+    def _archive_rows(self, cursor, rows, dict_id, archived_at: str):
+        """Compress (id, tag, memo, by_who, last_modified) rows into the archive."""
+        dictionary = self._archive_dicts.get(dict_id)
+        cursor.executemany(
+            """
+            INSERT OR REPLACE INTO memories_archive
+                (id, tag, memo_blob, codec, dict_id, by_who, last_modified, archived_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            [
+                (
+                    index,
+                    tag,
+                    self.compressor.compress(memo or "", dictionary),
+                    self.compressor.codec,
+                    dict_id,
+                    by_who,
+                    last_modified,
+                    archived_at,
+                )
+                for index, tag, memo, by_who, last_modified in rows
+            ],
+        )
+        for index, _, memo, _, _ in rows:
+            self._index_terms(cursor, "archive_terms", index, memo)
+        cursor.executemany(
+            "DELETE FROM memories WHERE id = ?", [(row[0],) for row in rows]
+        )
+
+    @staticmethod
+    def _index_terms(cursor, table: str, index: int, memo: str):
+        """Replace the word index entries of one memory in memory_terms or archive_terms."""
+        cursor.execute(f"DELETE FROM {table} WHERE memory_id = ?", (index,))
+        cursor.executemany(
+            f"INSERT OR IGNORE INTO {table} (term, memory_id) VALUES (?, ?)",
+            [(term, index) for term in set(re.findall(r"\w+", (memo or "").lower()))],
+        )
+
+    def _restore_archived(self, cursor, index: int):
+        """Move an archived memory back into the hot table, keeping its index."""
+        cursor.execute(
+            """
+            SELECT tag, memo_blob, codec, dict_id, by_who, last_modified
+            FROM live_memories_archive WHERE id = ?
+            """,
+            (index,),
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return False
+        memo = self._decompress_memo(*row[1:4])
+        cursor.execute(
+            """
+            INSERT INTO memories (id, tag_id, memo, by_id, last_modified)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (
+                index,
+                self._intern(cursor, "tags", row[0]),
+                memo,
+                self._intern(cursor, "authors", row[4]),
+                row[5],
+            ),
+        )
+        # Its entities are kept; its words move from archive_terms
+        self._index_terms(cursor, "memory_terms", index, memo)
+        cursor.execute("DELETE FROM memories_archive WHERE id = ?", (index,))
+        return True
+
+    def _archive_dictionary(self, cursor, cutoff: str = "9999"):
+        """Return the id of the shared dictionary for the current codec, training one if needed.
+
+        A dictionary older than ARCHIVE_DICT_MAX_AGE_DAYS is replaced by one
+        trained on current memos; rows compressed earlier keep theirs.
+        """
+        cursor.execute(
+            """
+            SELECT id, data, created FROM archive_dicts
+            WHERE codec = ? AND source = 'common_words' ORDER BY id DESC LIMIT 1
+            """,
+            (self.compressor.codec,),
+        )
+        row = cursor.fetchone()
+        now = datetime.datetime.now()
+        stale = (
+            now - datetime.timedelta(days=self.ARCHIVE_DICT_MAX_AGE_DAYS)
+        ).strftime("%Y-%m-%d_%H:%M:%S")
+        if row is None or row[2] < stale:
+            cursor.execute(
+                """
+                SELECT memo FROM live_memories WHERE last_modified < ?
+                ORDER BY last_modified DESC LIMIT 1000
+                """,
+                (cutoff,),
+            )
+            data = self.compressor.train([memo or "" for (memo,) in cursor.fetchall()])
+            if data is not None:
+                created = now.strftime("%Y-%m-%d_%H:%M:%S")
+                cursor.execute(
+                    """
+                    INSERT INTO archive_dicts (codec, data, created, source)
+                    VALUES (?, ?, ?, 'common_words')
+                    """,
+                    (self.compressor.codec, data, created),
+                )
+                row = (cursor.lastrowid, data, created)
+        if row is None:
+            return None
+        self._archive_dicts[row[0]] = row[1]
+        return row[0]
+
+    def _decompress_memo(self, blob, codec: str, dict_id):
+        """Decompress an archived memo, loading its shared dictionary on first use."""
+        if dict_id is not None and dict_id not in self._archive_dicts:
+            row = self.conn.execute(
+                "SELECT data FROM archive_dicts WHERE id = ?", (dict_id,)
+            ).fetchone()
+            self._archive_dicts[dict_id] = row[0] if row else None
+        return self.compressor.decompress(blob, codec, self._archive_dicts.get(dict_id))
+
+    def has_memory(self, memo: str) -> bool:
+        """Check whether an identical memo is already stored."""
+        if self.store is None:
+            return False
+        return self.store.contains(memo)
+
+    def memory_history(self, index: int):
+        """Return every stored version of a memory, oldest first, ending with the live one."""
+        if self.backend != "sqlite":
+            try:
+                return self.store.history(index)
+            except NotImplementedError:
+                return {"error": self._no_connection()}
+            except OSError as e:
+                return {"error": f"Database error: {e}"}
+        if self.conn is None:
+            return {"error": "No database connection."}
+
+        try:
+            # One read transaction: the reclaimer turns cleared rows into
+            # tombstones in between otherwise, and neither query sees them.
+            snapshot = not self.conn.in_transaction
+            if snapshot:
+                self.conn.execute("BEGIN")
+            try:
+                versions = self._resolve_versions(index, self._history_rows(index))
+                current = self._store.get(index)
+                cleared = self._cleared_rows("id = ?", (index,))
+            finally:
+                if snapshot:
+                    self.conn.commit()
+            if current:
+                if not current.get("archived"):
+                    self._record_access([index])
+                current["version"] = "current"
+                versions.insert(0, current)
+            for _, tag, memo, by_who, last_modified, cleared_at in cleared:
+                # Cleared but not reclaimed yet, so without its tombstone
+                versions.insert(
+                    0,
+                    {
+                        "index": index,
+                        "version": versions[0]["version"] + 1 if versions else 1,
+                        "tag": tag,
+                        "memo": memo,
+                        "by": by_who,
+                        "last_modified": last_modified,
+                        "valid_to": cleared_at,
+                        "deleted": True,
+                    },
+                )
+            return list(reversed(versions))
+        except sqlite3.Error as e:
+            print(f"Database error retrieving history of memory index {index}: {e}")
+            return {"error": f"Database error: {e}"}
+
+    def memories_as_of(self, timestamp: str) -> dict:
+        """Return the memories as they were at a point in time, including deleted ones."""
+        if self.conn is None:
+            return {"error": self._no_connection()}
+
+        try:
+            moment = datetime.datetime.fromisoformat(
+                timestamp.strip().replace("_", " ")
+            ).strftime("%Y-%m-%d_%H:%M:%S")
+        except ValueError:
+            return {
+                "error": f"Invalid timestamp '{timestamp}', use YYYY-MM-DD HH:MM:SS."
+            }
+
+        snapshot = {}
+        try:
+            for index, tag, memo, by_who, last_modified in self.conn.execute(
+                """
+                SELECT id, tag, memo, by_who, last_modified FROM live_memories
+                WHERE last_modified <= ?
+                """,
+                (moment,),
+            ):
+                snapshot[index] = {
+                    "tag": tag,
+                    "memo": memo,
+                    "by": by_who,
+                    "last_modified": last_modified,
+                }
+            for row in self.conn.execute(
+                """
+                SELECT id, tag, memo_blob, codec, dict_id, by_who, last_modified
+                FROM live_memories_archive WHERE last_modified <= ?
+                """,
+                (moment,),
+            ):
+                snapshot[row[0]] = {
+                    "tag": row[1],
+                    "memo": self._decompress_memo(row[2], row[3], row[4]),
+                    "by": row[5],
+                    "last_modified": row[6],
+                }
+            for index, tag, memo, by_who, last_modified, _ in self._cleared_rows(
+                "last_modified <= ? AND cleared_at > ?", (moment, moment)
+            ):
+                snapshot[index] = {
+                    "tag": tag,
+                    "memo": memo,
+                    "by": by_who,
+                    "last_modified": last_modified,
+                }
+            for index, version in self.conn.execute(
+                """
+                SELECT memory_id, version FROM memory_history
+                WHERE valid_to > ? AND last_modified <= ?
+                """,
+                (moment, moment),
+            ).fetchall():
+                entry = self._resolve_versions(
+                    index, self._history_rows(index, version)
+                )[-1]
+                snapshot[index] = {
+                    key: entry[key] for key in ("tag", "memo", "by", "last_modified")
+                }
+            return dict(sorted(snapshot.items()))
+        except sqlite3.Error as e:
+            print(f"Database error reading memories as of {moment}: {e}")
+            return {"error": f"Database error: {e}"}
+
+    def compact_history(
+        self,
+        retention_days: int,
+        keep_versions: int = 20,
+        delta_min_length: int = 200,
+        batch_size: int = 200,
+    ):
+        """Prune expired versions and delta-encode long memos against the next version."""
+        if self.conn is None:
+            return self._no_connection()
+
+        cutoff = (
+            datetime.datetime.now() - datetime.timedelta(days=retention_days)
+        ).strftime("%Y-%m-%d_%H:%M:%S")
+        pruned = encoded = 0
+        cursor = self.conn.cursor()
+        try:
+            # Only the oldest end of each chain is removed, so the newer
+            # versions that deltas are computed against always survive.
+            while True:
+                cursor.execute(
+                    """
+                    DELETE FROM memory_history WHERE id IN (
+                        SELECT h.id FROM memory_history h
+                        WHERE h.valid_to < ? OR h.version <= (
+                            SELECT MAX(version) FROM memory_history
+                            WHERE memory_id = h.memory_id
+                        ) - ?
+                        LIMIT ?
+                    )
+                    """,
+                    (cutoff, keep_versions, batch_size),
+                )
+                self.conn.commit()
+                pruned += cursor.rowcount
+                if cursor.rowcount < batch_size:
+                    break
+            last_id = 0
+            while True:
+                rows = cursor.execute(
+                    """
+                    SELECT id, memory_id, version, memo FROM memory_history
+                    WHERE id > ? AND codec IS NULL AND deleted = 0
+                        AND length(memo) >= ?
+                    ORDER BY id LIMIT ?
+                    """,
+                    (last_id, delta_min_length, batch_size),
+                ).fetchall()
+                if not rows:
+                    break
+                updates = []
+                for history_id, index, version, memo in rows:
+                    newer = self._resolve_versions(
+                        index, self._history_rows(index, version + 1)
+                    )
+                    base = newer[-1]["memo"] if newer else self._current_memo(index)
+                    if base is None:
+                        continue
+                    delta = self.compressor.delta(base, memo)
+                    if len(delta) < len(memo.encode("utf-8")):
+                        updates.append((delta, history_id))
+                cursor.executemany(
+                    """
+                    UPDATE memory_history SET memo = NULL, memo_delta = ?,
+                        codec = 'delta'
+                    WHERE id = ?
+                    """,
+                    updates,
+                )
+                self.conn.commit()
+                encoded += len(updates)
+                last_id = rows[-1][0]
+            return (
+                f"History compacted: {pruned} old versions removed, "
+                f"{encoded} versions stored as deltas."
+            )
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            return f"Database error compacting history: {e}"
+
+    def rewrite_memos(self, transform):
+        """Replace every stored memo with transform(memo), without recording a change.
+
+        Covers hot and archived memos, history versions (stored in full
+        afterwards) and the change log, and rebuilds the entity and keyword
+        indexes, in one transaction. Used on replay copies, so the triggers
+        are suspended meanwhile. Failures raise, as in StorageBackend.
+        """
+        if self.backend != "sqlite":
+            return self.store.rewrite_memos(transform)
+        if self.conn is None:
+            raise sqlite3.OperationalError(self._no_connection())
+
+        def rewrite(memo):
+            return None if memo is None else transform(memo)
+
+        triggers = self.conn.execute(
+            """
+            SELECT name, sql FROM sqlite_master
+            WHERE type = 'trigger' AND tbl_name = 'memories'
+            """
+        ).fetchall()
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            for name, _ in triggers:
+                cursor.execute(f"DROP TRIGGER {name}")
+            # History first: its deltas are patched from the current memos
+            for (index,) in cursor.execute(
+                "SELECT DISTINCT memory_id FROM memory_history"
+            ).fetchall():
+                cursor.executemany(
+                    """
+                    UPDATE memory_history SET memo = ?, memo_delta = NULL,
+                        codec = NULL, dict_id = NULL
+                    WHERE memory_id = ? AND version = ?
+                    """,
+                    [
+                        (rewrite(version["memo"]), index, version["version"])
+                        for version in self._resolve_versions(
+                            index, self._history_rows(index)
+                        )
+                    ],
+                )
+            hot = [
+                (index, rewrite(memo))
+                for index, memo in cursor.execute(
+                    "SELECT id, memo FROM memories"
+                ).fetchall()
+            ]
+            cursor.executemany(
+                "UPDATE memories SET memo = ? WHERE id = ?",
+                [(memo, index) for index, memo in hot],
+            )
+            archived = []
+            for index, blob, codec, dict_id in cursor.execute(
+                "SELECT id, memo_blob, codec, dict_id FROM memories_archive"
+            ).fetchall():
+                memo = rewrite(self._decompress_memo(blob, codec, dict_id))
+                if codec != self.compressor.codec:
+                    dict_id = None  # Its dictionary belongs to another codec
+                cursor.execute(
+                    """
+                    UPDATE memories_archive SET memo_blob = ?, codec = ?, dict_id = ?
+                    WHERE id = ?
+                    """,
+                    (
+                        self.compressor.compress(
+                            memo or "", self._archive_dicts.get(dict_id)
+                        ),
+                        self.compressor.codec,
+                        dict_id,
+                        index,
+                    ),
+                )
+                archived.append((index, memo))
+            cursor.executemany(
+                "UPDATE memory_changelog SET memo = ? WHERE seq = ?",
+                [
+                    (transform(memo), seq)
+                    for seq, memo in cursor.execute(
+                        "SELECT seq, memo FROM memory_changelog WHERE memo IS NOT NULL"
+                    ).fetchall()
+                ],
+            )
+            cursor.execute("DELETE FROM memory_entities")
+            cursor.execute("DELETE FROM archive_terms")
+            for index, memo in hot:
+                self._index_memo(cursor, index, memo)
+            for index, memo in archived:
+                self._index_entities(cursor, index, memo)
+            for index, memo in archived:
+                self._index_terms(cursor, "archive_terms", index, memo)
+            for _, sql in triggers:
+                cursor.execute(sql)
             self.conn.commit()
-            return "ALL MEMORIES CLEARED!"
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
+
+    def _cleared_rows(self, condition: str, params=()):
+        """Hot and archived rows hidden by a clear that the reclaimer has not deleted yet.
+
+        Returns (id, tag, memo, by_who, last_modified, cleared_at) rows
+        matching condition, which can use those columns. Until the reclaim
+        writes their tombstones, history reads take them from here.
+        """
+        columns = """
+            (SELECT MIN(cleared_at) FROM memory_clears
+             WHERE cleared_through >= m.id) AS cleared_at
+            FROM {table} AS m WHERE m.id <= (
+                SELECT COALESCE(MAX(value), 0) FROM memory_meta
+                WHERE key = 'cleared_through'
+            )
+        """
+        rows = self.conn.execute(
+            f"""
+            SELECT id, tag, memo, by_who, last_modified, cleared_at FROM (
+                SELECT m.id, m.tag_id, m.memo, m.by_id, m.last_modified,
+                    {columns.format(table="memories")}
+            ) AS c
+            LEFT JOIN (SELECT id AS tid, name AS tag FROM tags) ON tid = c.tag_id
+            LEFT JOIN (SELECT id AS aid, name AS by_who FROM authors) ON aid = c.by_id
+            WHERE {condition}
+            """,
+            params,
+        ).fetchall()
+        for row in self.conn.execute(
+            f"""
+            SELECT * FROM (
+                SELECT m.id, m.tag, m.memo_blob, m.codec, m.dict_id, m.by_who,
+                    m.last_modified, {columns.format(table="memories_archive")}
+            ) WHERE {condition}
+            """,
+            params,
+        ).fetchall():
+            rows.append(
+                (row[0], row[1], self._decompress_memo(*row[2:5])) + tuple(row[5:])
+            )
+        return rows
+
+    def _history_rows(self, index: int, from_version: int = 0):
+        """History rows of one memory from a version upwards, newest first."""
+        return self.conn.execute(
+            """
+            SELECT version, tag, memo, memo_delta, codec, dict_id, by_who,
+                last_modified, valid_to, deleted
+            FROM memory_history WHERE memory_id = ? AND version >= ?
+            ORDER BY version DESC
+            """,
+            (index, from_version),
+        ).fetchall()
+
+    def _current_memo(self, index: int):
+        """Memo text of the live (hot or archived) row, or None if it was deleted."""
+        row = self.conn.execute(
+            "SELECT memo FROM memories WHERE id = ?", (index,)
+        ).fetchone()
+        if row:
+            return row[0]
+        row = self.conn.execute(
+            "SELECT memo_blob, codec, dict_id FROM memories_archive WHERE id = ?",
+            (index,),
+        ).fetchone()
+        return self._decompress_memo(*row) if row else None
+
+    def _resolve_versions(self, index: int, rows):
+        """Rebuild memo text for history rows given newest first, walking delta chains."""
+        newer = self._current_memo(index)
+        versions = []
+        for (
+            version,
+            tag,
+            memo,
+            memo_delta,
+            codec,
+            dict_id,
+            by_who,
+            last_modified,
+            valid_to,
+            deleted,
+        ) in rows:
+            if codec == "delta":
+                memo = self.compressor.patch(newer or "", memo_delta)
+            elif codec is not None:
+                memo = self._decompress_memo(memo_delta, codec, dict_id)
+            versions.append(
+                {
+                    "index": index,
+                    "version": version,
+                    "tag": tag,
+                    "memo": memo,
+                    "by": by_who,
+                    "last_modified": last_modified,
+                    "valid_to": valid_to,
+                    "deleted": bool(deleted),
+                }
+            )
+            newer = memo
+        return versions
+
+    def changes_since(self, seq: int = 0, batch_size: int = 500):
+        """Yield batches of change-log entries with a sequence number greater than seq."""
+        if self.conn is None:
+            return
+        while True:
+            rows = self.conn.execute(
+                """
+                SELECT seq, op, memory_id, tag, memo, by_who, last_modified
+                FROM memory_changelog WHERE seq > ? ORDER BY seq LIMIT ?
+                """,
+                (seq, batch_size),
+            ).fetchall()
+            if not rows:
+                return
+            yield [
+                {
+                    "seq": row[0],
+                    "op": row[1],
+                    "memory_id": row[2],
+                    "tag": row[3],
+                    "memo": row[4],
+                    "by": row[5],
+                    "last_modified": row[6],
+                }
+                for row in rows
+            ]
+            seq = rows[-1][0]
+
+    def last_applied_seq(self, source: str) -> int:
+        """Return the last sequence number applied from a replication source."""
+        if self.conn is None:
+            return 0
+        row = self.conn.execute(
+            "SELECT last_seq FROM replication_state WHERE source = ?", (source,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def apply_changes(self, changes: list, source: str):
+        """Replay a batch of change-log entries from another node in one transaction.
+
+        Entries at or below the last sequence recorded for the source are
+        skipped and every operation is an upsert or delete, so re-applying a
+        batch is harmless.
+        """
+        if self.conn is None:
+            return self._no_connection()
+
+        last_seq = self.last_applied_seq(source)
+        applied = 0
+        cleared = False
+        cursor = self.conn.cursor()
+        try:
+            for change in changes:
+                if change["seq"] <= last_seq:
+                    continue
+                index = change["memory_id"]
+                if change["op"] in ("insert", "update"):
+                    cursor.execute(
+                        """
+                        INSERT INTO memories (id, tag_id, memo, by_id, last_modified)
+                        VALUES (?, ?, ?, ?, ?)
+                        ON CONFLICT(id) DO UPDATE SET tag_id = excluded.tag_id,
+                            memo = excluded.memo, by_id = excluded.by_id,
+                            last_modified = excluded.last_modified
+                        """,
+                        (
+                            index,
+                            self._intern(cursor, "tags", change["tag"]),
+                            change["memo"],
+                            self._intern(cursor, "authors", change["by"]),
+                            change["last_modified"],
+                        ),
+                    )
+                    self._index_memo(cursor, index, change["memo"])
+                elif change["op"] == "delete":
+                    cursor.execute("DELETE FROM memories WHERE id = ?", (index,))
+                elif change["op"] == "archive":
+                    cursor.execute(
+                        """
+                        SELECT id, tag, memo, by_who, last_modified
+                        FROM live_memories WHERE id = ?
+                        """,
+                        (index,),
+                    )
+                    rows = cursor.fetchall()
+                    if rows:
+                        dict_id = self._archive_dictionary(cursor)
+                        archived_at = datetime.datetime.now().strftime(
+                            "%Y-%m-%d_%H:%M:%S"
+                        )
+                        self._archive_rows(cursor, rows, dict_id, archived_at)
+                elif change["op"] == "archive_delete":
+                    cursor.execute(
+                        "DELETE FROM memories_archive WHERE id = ?", (index,)
+                    )
+                elif change["op"] == "clear":
+                    cursor.execute(
+                        """
+                        INSERT OR REPLACE INTO memory_meta (key, value)
+                        SELECT 'cleared_through', MAX(?, COALESCE(MAX(value), 0))
+                        FROM memory_meta WHERE key = 'cleared_through'
+                        """,
+                        (index,),
+                    )
+                    cursor.execute(
+                        """
+                        INSERT OR IGNORE INTO memory_clears (cleared_through, cleared_at)
+                        VALUES (?, ?)
+                        """,
+                        (
+                            index,
+                            change["last_modified"]
+                            or datetime.datetime.now().strftime("%Y-%m-%d_%H:%M:%S"),
+                        ),
+                    )
+                    cleared = True
+                last_seq = change["seq"]
+                applied += 1
+            cursor.execute(
+                """
+                INSERT OR REPLACE INTO replication_state (source, last_seq)
+                VALUES (?, ?)
+                """,
+                (source, last_seq),
+            )
+            self.conn.commit()
+            if cleared:
+                self._reclaim_cleared_rows()
+            return f"Applied {applied} changes from {source} up to sequence {last_seq}."
         except sqlite3.Error as e:
-            return f"Database error clearing all memories: {e}"
+            self.conn.rollback()
+            return f"Database error applying changes from {source}: {e}"
+
+    def sync_from(self, leader, source: str = None, batch_size: int = 500):
+        """Pull and apply every change from another MemoryFunctions not yet applied here."""
+        source = source or os.path.abspath(leader.db_name)
+        messages = []
+        for batch in leader.changes_since(self.last_applied_seq(source), batch_size):
+            message = self.apply_changes(batch, source)
+            messages.append(message)
+            if message.startswith("Database error"):
+                break
+        return messages[-1] if messages else f"Already up to date with {source}."
+
+    def truncate_change_log(self, up_to_seq: int, batch_size: int = 1000):
+        """Drop change-log entries every follower has applied, in small batches."""
+        if self.conn is None:
+            return self._no_connection()
+
+        removed = 0
+        try:
+            while True:
+                cursor = self.conn.execute(
+                    """
+                    DELETE FROM memory_changelog WHERE seq IN (
+                        SELECT seq FROM memory_changelog WHERE seq <= ?
+                        ORDER BY seq LIMIT ?
+                    )
+                    """,
+                    (up_to_seq, batch_size),
+                )
+                self.conn.commit()
+                removed += cursor.rowcount
+                if cursor.rowcount < batch_size:
+                    break
+            return f"Removed {removed} change-log entries up to sequence {up_to_seq}."
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            return f"Database error truncating change log: {e}"
 
     def list_memory_files(
         self,
     ):  # Renamed to list_memory_files to align with Tools class
         """List available memory database files in the designated directory."""
-        memory_files = []
         try:
-            for file in os.listdir(self.directory):
-                if file.endswith(".db"):  # Looking for .db files now
-                    memory_files.append(file)
+            return self.catalog.names()
         except Exception as e:
             print(f"Error listing memory files: {e}")
             return {"error": f"Error accessing directory: {str(e)}"}
-        return memory_files
 
-    def current_memory_file(
-        self,
-    ):  # Renamed to current_memory_file for consistency
+    def memory_file_stats(self):
+        """Return per-file statistics (rows, tags, bytes, last write) from the catalog."""
+        try:
+            return self.catalog.stats()
+        except Exception as e:
+            print(f"Error collecting memory file statistics: {e}")
+            return {"error": f"Error accessing directory: {str(e)}"}
+
+    def current_memory_file(self):  # Renamed to current_memory_file for consistency
         """Return the name of the currently active memory database file."""
         return os.path.basename(self.db_name)
 
@@ -1044,12 +4495,40 @@ class MemoryFunctions:
         self, file_to_delete: str
     ):  # Renamed to delete_memory_file for consistency
         """Delete a memory database file from the directory."""
-        file_path = os.path.join(self.directory, file_to_delete)
+        file_path = self._file_path(file_to_delete)
         try:
             if (
                 os.path.exists(file_path) and file_path != self.db_name
             ):  # Prevent deleting current DB
-                os.remove(file_path)
+                lock = self._lock_for(os.path.basename(file_path))
+                if not lock.acquire(timeout=0.5):
+                    return f"Cannot delete '{file_to_delete}': it is in use by another process."
+                stem = os.path.splitext(file_path)[0]
+                # Writes spooled by workers locked out of the file go with it
+                spool_lock = self._lock_for(os.path.basename(stem) + ".spool")
+                if not spool_lock.acquire(timeout=0.5):
+                    lock.release()
+                    return f"Cannot delete '{file_to_delete}': it is in use by another process."
+                trash_dir = os.path.join(self.directory, ".trash")
+                os.makedirs(trash_dir, exist_ok=True)
+                stamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")
+                trashed = []
+                try:
+                    # Renames are constant time; the reclaimer removes the data.
+                    for path in [
+                        file_path + suffix
+                        for suffix in ("", "-wal", "-shm", "-journal")
+                    ] + [stem + ".spool", stem + ".spool.replay"]:
+                        if os.path.exists(path):
+                            name = os.path.basename(path)
+                            target = os.path.join(trash_dir, f"{name}.{stamp}")
+                            os.rename(path, target)
+                            trashed.append(target)
+                finally:
+                    spool_lock.release()
+                    lock.release()
+                self.generation.bump()  # Tell other processes to drop caches
+                BackgroundReclaimer.shared().remove_files(trashed)
                 return f"File '{file_to_delete}' deleted successfully."
             elif file_path == self.db_name:
                 return "Cannot delete the currently active database file. Switch to another file first."
@@ -1062,8 +4541,10 @@ class MemoryFunctions:
         self, file_to_download: str
     ):  # Renamed and adapted for DB download
         """Prepare a memory database file for download."""
-        file_path = os.path.join(self.directory, file_to_download)
-        if not os.path.exists(file_path) or not file_path.endswith(".db"):
+        file_path = self._file_path(file_to_download)
+        if not os.path.exists(file_path) or not file_path.endswith(
+            _deferred(STORAGE_BACKENDS[self.backend]).suffix
+        ):
             return {
                 "error": f"Database file '{file_to_download}' not found or invalid."
             }
@@ -1071,25 +4552,1901 @@ class MemoryFunctions:
 
     def download_all_memory_files(self):  # New function to download all DB files
         """Prepare all memory database files for download as tarball."""
+        import tarfile  # Imported on use to keep tool loads fast
+
         tarball_path = os.path.join(self.directory, "all_memory_dbs.tar.gz")
         db_files_to_tar = []
         try:
             with tarfile.open(tarball_path, "w:gz") as tar:
-                for file in os.listdir(self.directory):
-                    if file.endswith(".db"):
-                        db_file_path = os.path.join(self.directory, file)
+                for file in self.catalog.names():
+                    db_file_path = os.path.join(self.directory, file)
+                    with self._lock_for(file, shared=True):
+                        if not os.path.exists(db_file_path):
+                            continue  # Deleted by another process meanwhile
                         tar.add(db_file_path, arcname=file)
-                        db_files_to_tar.append(db_file_path)
+                    db_files_to_tar.append(db_file_path)
             return tarball_path  # Return path to the created tarball
         except Exception as e:
             print(f"Error creating tarball of database files: {e}")
             return {"error": f"Error creating tarball: {str(e)}"}
 
+    def _record_access(self, ids, db_path: str = None):
+        """Count reads of memories; they are written in batches by _flush_access.
+
+        Safe to call from worker threads. Bulk listings such as
+        get_all_memories are not counted, since they touch every row alike.
+        """
+        if not ids or self.backend != "sqlite":
+            return
+        now = datetime.datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
+        with self._access_lock:
+            pending = self._pending_access.setdefault(db_path or self.db_name, {})
+            for index in ids:
+                entry = pending.setdefault(index, [0, now])
+                entry[0] += 1
+                entry[1] = now
+            due = (
+                sum(len(rows) for rows in self._pending_access.values())
+                >= self.ACCESS_FLUSH_ROWS
+                or time.monotonic() - self._access_flushed >= self.ACCESS_FLUSH_SECONDS
+            )
+        if due:
+            self._flush_access()
+
+    def _flush_access(self):
+        """Write pending access counts, one transaction per file, on a connection of its own."""
+        with self._access_lock:
+            pending, self._pending_access = self._pending_access, {}
+            self._access_flushed = time.monotonic()
+        for db_path, rows in pending.items():
+            # On the owning thread reuse self.conn: a second connection would
+            # wait for this thread's own unfinished read statements.
+            own = (
+                db_path == self.db_name
+                and threading.get_ident() == self._conn_thread
+                and not self._session_pending  # Must not load it just for this
+                and self.conn is not None
+            )
+            try:
+                if own:
+                    conn = self.conn
+                elif db_path == self.db_name:
+                    conn = self._open_connection()  # Also reaches in-memory sessions
+                else:
+                    conn = sqlite3.connect(db_path)
+                try:
+                    conn.executemany(
+                        """
+                        UPDATE memories
+                        SET access_count = access_count + ?,
+                            last_accessed = MAX(COALESCE(last_accessed, ''), ?)
+                        WHERE id = ?
+                        """,
+                        [(reads, last, index) for index, (reads, last) in rows.items()],
+                    )
+                    conn.commit()
+                finally:
+                    if not own:
+                        conn.close()
+            except sqlite3.Error as e:
+                print(f"Database error recording memory access: {e}")
+
+    def enforce_quota(
+        self,
+        max_rows: int = 0,
+        max_bytes: int = 0,
+        policy: str = "lru",
+        action: str = "archive",
+        batch_size: int = 50,
+    ):
+        """Archive or delete the lowest-value memories until the file is within quota.
+
+        max_rows and max_bytes of 0 mean unlimited; bytes count the tag, memo
+        and author text of hot memories. policy is "lru" (least recently read
+        or modified first), "lfu" (fewest reads first) or "weighted" (reads
+        times tag priority, decayed by days since last use). Victims are
+        removed in batches of batch_size with one commit each.
+        """
+        if self.conn is None:
+            return self._no_connection()
+        if policy not in ("lru", "lfu", "weighted"):
+            return f"Unknown eviction policy '{policy}', use lru, lfu or weighted."
+        if action not in ("archive", "delete"):
+            return f"Unknown eviction action '{action}', use archive or delete."
+        if not max_rows and not max_bytes:
+            return "No memory quota set."
+
+        self._flush_access()
+        size = "LENGTH(COALESCE(tag, '')) + LENGTH(COALESCE(memo, '')) + LENGTH(COALESCE(by_who, ''))"
+        last_used = self.LAST_USED
+        params = ()
+        if policy == "lru":
+            order = f"{last_used}, id"
+        elif policy == "lfu":
+            order = f"access_count, {last_used}, id"
+        else:
+            priority = " ".join("WHEN ? THEN ?" for _ in self.TAG_PRIORITY)
+            params = tuple(
+                value for item in self.TAG_PRIORITY.items() for value in item
+            )
+            order = f"""
+                (1 + access_count) * (CASE tag {priority} ELSE 1 END)
+                / (1 + julianday('now', 'localtime')
+                     - julianday(REPLACE({last_used}, '_', ' '))), id
+            """
+        archived_at = datetime.datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
+        cursor = self.conn.cursor()
+        evicted = 0
+        try:
+            rows, total_bytes = cursor.execute(
+                f"SELECT COUNT(*), COALESCE(SUM({size}), 0) FROM live_memories"
+            ).fetchone()
+            excess_rows = rows - max_rows if max_rows else 0
+            excess_bytes = total_bytes - max_bytes if max_bytes else 0
+            dict_id = None
+            if action == "archive" and (excess_rows > 0 or excess_bytes > 0):
+                dict_id = self._archive_dictionary(cursor)
+            while excess_rows > 0 or excess_bytes > 0:
+                victims = []
+                for row in cursor.execute(
+                    f"""
+                    SELECT id, tag, memo, by_who, last_modified, {size}
+                    FROM live_memories ORDER BY {order} LIMIT ?
+                    """,
+                    params + (batch_size,),
+                ).fetchall():
+                    if excess_rows <= 0 and excess_bytes <= 0:
+                        break
+                    victims.append(row[:5])
+                    excess_rows -= 1
+                    excess_bytes -= row[5]
+                if not victims:
+                    break
+                if action == "archive":
+                    self._archive_rows(cursor, victims, dict_id, archived_at)
+                else:
+                    cursor.executemany(
+                        "DELETE FROM memories WHERE id = ?",
+                        [(row[0],) for row in victims],
+                    )
+                self.conn.commit()  # One short write transaction per batch
+                evicted += len(victims)
+            if self.debug and evicted:
+                print(f"Evicted {evicted} memories ({policy}, {action}).")
+            verb = "Archived" if action == "archive" else "Deleted"
+            return f"{verb} {evicted} memories to stay within the memory quota."
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            return f"Database error enforcing memory quota: {e}"
+
+    def _interned_names(self, table: str) -> dict:
+        """name -> id of the tags or authors table, reloaded after other connections wrote."""
+        version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if version != self._interned_version:
+            self._interned = {
+                name: dict(self.conn.execute(f"SELECT name, id FROM {name}"))
+                for name in ("tags", "authors")
+            }
+            self._interned_version = version
+        return self._interned[table]
+
+    def _intern(self, cursor, table: str, name: str):
+        """Return the id of name in the tags or authors table, adding it if new."""
+        if name is None:
+            return None
+        known = self._interned_names(table)
+        if name in known:
+            return known[name]
+        # Not cached: the insert is only final once the caller commits.
+        cursor.execute(f"INSERT OR IGNORE INTO {table} (name) VALUES (?)", (name,))
+        return cursor.execute(
+            f"SELECT id FROM {table} WHERE name = ?", (name,)
+        ).fetchone()[0]
+
+    def _index_memo(self, cursor, index: int, memo: str):
+        """Replace the entity and word index entries of one hot memory."""
+        self._index_entities(cursor, index, memo)
+        self._index_terms(cursor, "memory_terms", index, memo)
+
+    def _index_entities(self, cursor, index: int, memo: str):
+        """Replace the entity index entries of one memory."""
+        cursor.execute("DELETE FROM memory_entities WHERE memory_id = ?", (index,))
+        cursor.executemany(
+            "INSERT OR IGNORE INTO memory_entities (entity, memory_id) VALUES (?, ?)",
+            [(entity, index) for entity in self.entity_extractor.extract(memo or "")],
+        )
+
+    def memories_about(self, entity: str) -> dict:
+        """Return the hot and archived memories mentioning a person or keyword.
+
+        Answered from the entity index, so the cost grows with the number of
+        matches rather than with the file.
+        """
+        entity = self.entity_extractor.normalize(entity)
+        if self.backend != "sqlite":
+            try:
+                rows = self.store.about(entity, self.entity_extractor)
+            except OSError as e:
+                return {"error": f"Database error: {e}"}
+            return {
+                index: {
+                    "tag": tag,
+                    "memo": memo,
+                    "by": by_who,
+                    "last_modified": modified,
+                }
+                for index, tag, memo, by_who, modified in rows
+            }
+        if self.conn is None:
+            return {"error": "No database connection."}
+
+        try:
+            memories = {}
+            for index, tag, memo, by_who, last_modified in self.conn.execute(
+                """
+                SELECT m.id, m.tag, m.memo, m.by_who, m.last_modified
+                FROM memory_entities AS e JOIN live_memories AS m ON m.id = e.memory_id
+                WHERE e.entity = ?
+                """,
+                (entity,),
+            ):
+                memories[index] = {
+                    "tag": tag,
+                    "memo": memo,
+                    "by": by_who,
+                    "last_modified": last_modified,
+                }
+            self._record_access(list(memories))
+            for (
+                index,
+                tag,
+                blob,
+                codec,
+                dict_id,
+                by_who,
+                last_modified,
+            ) in self.conn.execute(
+                """
+                    SELECT a.id, a.tag, a.memo_blob, a.codec, a.dict_id, a.by_who,
+                        a.last_modified
+                    FROM memory_entities AS e
+                    JOIN live_memories_archive AS a ON a.id = e.memory_id
+                    WHERE e.entity = ?
+                    """,
+                (entity,),
+            ).fetchall():
+                memories[index] = {
+                    "tag": tag,
+                    "memo": self._decompress_memo(blob, codec, dict_id),
+                    "by": by_who,
+                    "last_modified": last_modified,
+                    "archived": True,
+                }
+            return memories
+        except sqlite3.Error as e:
+            print(f"Database error retrieving memories about {entity}: {e}")
+            return {"error": f"Database error: {e}"}
+
+    def _known_tags(self):
+        """The current file's taxonomy, or the last one read while the file is locked."""
+        if self.backend != "sqlite" or self.conn is None:
+            return self._default_tags
+        try:
+            return self._interned_names("tags")
+        except sqlite3.Error:
+            return self._interned["tags"] or self._default_tags
+
+    def memory_tags(self) -> list:
+        """Return the tags of the current file's taxonomy."""
+        return sorted(self._known_tags())
+
+    def valid_tag(self, tag: str) -> str:
+        """Return tag if it is in the current file's taxonomy, otherwise "others"."""
+        return tag if tag in self._known_tags() else "others"
+
+    def add_memory_tag(self, tag: str):
+        """Add a tag to the current file's taxonomy."""
+        if self.conn is None:
+            return self._no_connection()
+
+        tag = tag.strip().lower()
+        if not tag:
+            return "Tag name cannot be empty."
+        try:
+            tag_id = self._intern(self.conn.cursor(), "tags", tag)
+            self.conn.commit()
+            self._interned_names("tags")[tag] = tag_id
+            return f"Tag '{tag}' is available in {os.path.basename(self.db_name)}."
+        except sqlite3.Error as e:
+            return f"Database error adding tag {tag}: {e}"
+
     def close_db_connection(self):
         """Close the database connection."""
-        if self.conn:
-            self.conn.close()
-            self.conn = None  # Reset connection attribute
+        if self._conn is not None:
+            self._flush_access()
+            self._end_session()
+            self._conn.close()
+            self._conn = None  # Reset connection attribute
+        self._locked_out = False
+        self._store.close()
+        if self._file_lock:
+            self._file_lock.release()
+            self._file_lock = None
+
+
+_defer(
+    r'''
+class MemoryCatalog:
+    """Cached index of the memory files in a directory and their statistics.
+
+    File names are only re-read when the directory mtime changes, and per-file
+    statistics are only recomputed for files whose size or mtime changed since
+    the last look, so listing stays cheap with many per-user files.
+    """
+
+    _instances = {}
+
+    def __init__(self, directory, backend="sqlite"):
+        self.directory = directory
+        self.backend = _deferred(STORAGE_BACKENDS[backend])
+        self._dir_mtime = None
+        self._names = []
+        self._signatures = {}  # file name -> (mtime_ns, size) of db + wal
+        self._stats = {}  # file name -> statistics dict
+
+    @classmethod
+    def for_directory(cls, directory, backend="sqlite"):
+        """Return the process-wide catalog of a backend's files in a directory."""
+        key = (os.path.abspath(directory), backend)
+        if key not in cls._instances:
+            cls._instances[key] = cls(directory, backend)
+        return cls._instances[key]
+
+    def names(self):
+        """Return the sorted memory file names, rescanning only if the directory changed."""
+        dir_mtime = os.stat(self.directory).st_mtime_ns
+        if dir_mtime != self._dir_mtime:
+            self._names = sorted(self._scan())
+            self._dir_mtime = dir_mtime
+        return list(self._names)
+
+    def stats(self):
+        """Return {file name: statistics} for every memory file, refreshing changed files."""
+        signatures = self._scan()
+        for name in list(self._stats):
+            if name not in signatures:
+                del self._stats[name]
+                self._signatures.pop(name, None)
+        for name, signature in signatures.items():
+            if self._signatures.get(name) != signature or name not in self._stats:
+                self._stats[name] = self._collect(name, signature)
+                self._signatures[name] = signature
+        self._names = sorted(signatures)
+        self._dir_mtime = os.stat(self.directory).st_mtime_ns
+        return {name: dict(self._stats[name]) for name in self._names}
+
+    def invalidate(self, name=None):
+        """Forget cached statistics for one file, or the whole directory."""
+        if name is None:
+            self._dir_mtime = None
+            self._signatures.clear()
+        else:
+            self._signatures.pop(name, None)
+
+    def _scan(self):
+        """Single os.scandir pass returning {file name: (mtime_ns, size)} for memory files."""
+        suffix = self.backend.suffix
+        databases = {}
+        wal_files = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.endswith(suffix) and entry.is_file():
+                    databases[entry.name] = entry.stat()
+                elif entry.name.endswith(suffix + "-wal") and entry.is_file():
+                    wal_files[entry.name[: -len("-wal")]] = entry.stat()
+        signatures = {}
+        for name, st in databases.items():
+            wal = wal_files.get(name)
+            signatures[name] = (
+                st.st_mtime_ns,
+                st.st_size,
+                wal.st_mtime_ns if wal else None,
+                wal.st_size if wal else None,
+            )
+        return signatures
+
+    def _collect(self, name, signature):
+        """Read row count and tag histogram of one file without opening it for writes."""
+        mtime_ns = max(signature[0], signature[2] or 0)
+        stats = {
+            "bytes": signature[1] + (signature[3] or 0),
+            "last_modified": datetime.datetime.fromtimestamp(mtime_ns / 1e9).strftime(
+                "%Y-%m-%d_%H:%M:%S"
+            ),
+            "rows": 0,
+            "tags": {},
+        }
+        try:
+            stats["tags"], stats["archived"] = self.backend.file_stats(
+                os.path.join(self.directory, name)
+            )
+            stats["rows"] = sum(stats["tags"].values())
+        except (sqlite3.Error, OSError) as e:
+            stats["error"] = f"Database error: {e}"
+        return stats
+'''
+)
+
+
+_defer(
+    r'''
+try:
+    import zstandard
+except ImportError:  # Optional: archive falls back to zlib
+    zstandard = None
+
+
+class MemoCompressor:
+    """Compress archived memos with zstd when installed, zlib otherwise.
+
+    Both codecs can use a shared dictionary of words common to many sample
+    memos, which matters for short texts that compress poorly on their own.
+    """
+
+    def __init__(self, codec: str = None):
+        self.codec = codec or ("zstd" if zstandard is not None else "zlib")
+
+    def train(self, samples, size: int = 16384, min_samples: int = 5):
+        """Build a shared dictionary from sample memos, or None if there is too little data.
+
+        Only lowercase words without digits found in at least min_samples
+        different samples go in. Names, numbers and other text identifying
+        one memo never end up in the dictionary, which outlives the memos it
+        was trained on. zstd reads it as a raw content dictionary, like zlib.
+        """
+        samples = [sample for sample in samples if sample]
+        if len(samples) < 8:
+            return None
+        counts = Counter()
+        for sample in samples:
+            counts.update(
+                word
+                for word in set(re.findall(r"\w+", sample))
+                if word.isalpha() and word.islower()
+            )
+        common = [word for word, count in counts.items() if count >= min_samples]
+        if not common:
+            return None
+        # Most frequent words last, where both codecs find matches cheapest
+        common.sort(key=lambda word: (counts[word], word))
+        return " ".join(common).encode("utf-8")[-min(size, 32768) :]
+
+    def compress(self, text: str, dictionary: bytes = None) -> bytes:
+        data = text.encode("utf-8")
+        if self.codec == "zstd":
+            dict_data = (
+                zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+            )
+            return zstandard.ZstdCompressor(level=9, dict_data=dict_data).compress(data)
+        compressor = (
+            zlib.compressobj(9, zdict=dictionary) if dictionary else zlib.compressobj(9)
+        )
+        return compressor.compress(data) + compressor.flush()
+
+    def delta(self, base: str, text: str) -> bytes:
+        """Encode text as copy ranges from base plus literal inserts."""
+        import difflib  # Only history compaction delta-encodes
+
+        ops = []
+        matcher = difflib.SequenceMatcher(None, base, text, autojunk=False)
+        for op, i1, i2, j1, j2 in matcher.get_opcodes():
+            if op == "equal":
+                ops.append([i1, i2])
+            elif op in ("replace", "insert"):
+                ops.append(text[j1:j2])
+        return zlib.compress(json.dumps(ops, ensure_ascii=False).encode("utf-8"), 9)
+
+    def patch(self, base: str, delta: bytes) -> str:
+        """Rebuild text from base and a delta produced by delta()."""
+        ops = json.loads(zlib.decompress(delta).decode("utf-8"))
+        return "".join(
+            base[op[0] : op[1]] if isinstance(op, list) else op for op in ops
+        )
+
+    def decompress(self, blob: bytes, codec: str, dictionary: bytes = None) -> str:
+        if codec == "zstd":
+            if zstandard is None:
+                raise RuntimeError(
+                    "zstandard is required to read this archived memory."
+                )
+            dict_data = (
+                zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+            )
+            data = zstandard.ZstdDecompressor(dict_data=dict_data).decompress(blob)
+        else:
+            decompressor = (
+                zlib.decompressobj(zdict=dictionary)
+                if dictionary
+                else zlib.decompressobj()
+            )
+            data = decompressor.decompress(blob) + decompressor.flush()
+        return data.decode("utf-8")
+'''
+)
+
+
+class FileLock:
+    """Advisory inter-process lock on a sidecar file.
+
+    Uses fcntl.flock, so it is a no-op on platforms without fcntl. Usable as
+    a context manager, which raises TimeoutError if the lock is not acquired.
+    """
+
+    def __init__(self, path: str, shared: bool = False):
+        self.path = path
+        self.shared = shared
+        self._fd = None
+
+    def acquire(self, timeout: float = 5.0) -> bool:
+        if fcntl is None or self._fd is not None:
+            return True
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        mode = (fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX) | fcntl.LOCK_NB
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(fd, mode)
+                self._fd = fd
+                return True
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    os.close(fd)
+                    return False
+                time.sleep(0.01)
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        if not self.acquire():
+            raise TimeoutError(f"Timed out waiting for lock {self.path}")
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class GenerationCounter:
+    """Counter in a shared memory-mapped file, bumped on destructive operations.
+
+    Reading it is a plain memory access, so every process can poll it on each
+    database access and drop its caches when the value moves.
+    """
+
+    _instances = {}
+
+    def __init__(self, path: str):
+        import mmap  # Loaded with the first memory file, not with the tool
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < 8:
+                os.ftruncate(fd, 8)
+            self._map = mmap.mmap(fd, 8)
+        finally:
+            os.close(fd)
+        self._lock = FileLock(path + ".lock")
+
+    @classmethod
+    def for_directory(cls, directory):
+        """Return the process-wide counter for a memory directory."""
+        key = os.path.abspath(directory)
+        if key not in cls._instances:
+            cls._instances[key] = cls(os.path.join(key, ".locks", "generation"))
+        return cls._instances[key]
+
+    def value(self) -> int:
+        return struct.unpack_from("<Q", self._map)[0]
+
+    def bump(self) -> int:
+        with self._lock:
+            value = self.value() + 1
+            struct.pack_into("<Q", self._map, 0, value)
+        return value
+
+
+class BackgroundReclaimer:
+    """Daemon thread that frees the space of cleared memories and deleted files.
+
+    Destructive operations only hide data (a visibility horizon or a rename
+    into .trash) and hand the expensive part to this thread, which works in
+    small batches on its own connection.
+    """
+
+    _instance = None
+
+    def __init__(self):
+        self._jobs = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls):
+        """Return the process-wide reclaimer."""
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def reclaim_rows(self, db_path: str, unfinished_only: bool = False):
+        """Delete rows hidden by clear_memory and hand the free pages back.
+
+        With unfinished_only nothing is done unless hidden rows are left.
+        """
+        self._submit(("unfinished" if unfinished_only else "rows", db_path))
+
+    def remove_files(self, paths: list):
+        """Remove files that were renamed into the trash."""
+        if paths:
+            self._submit(("files", paths))
+
+    def wait(self):
+        """Block until every queued job is done."""
+        self._jobs.join()
+
+    def _submit(self, job):
+        self._jobs.put(job)
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="memory-reclaimer", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            kind, target = self._jobs.get()
+            try:
+                if kind in ("rows", "unfinished"):
+                    self._purge_cleared_rows(target, kind == "unfinished")
+                else:
+                    for path in target:
+                        if os.path.exists(path):
+                            os.remove(path)
+            except Exception as e:
+                print(f"Background reclamation error: {e}")
+            finally:
+                self._jobs.task_done()
+
+    def _purge_cleared_rows(self, db_path: str, unfinished_only: bool):
+        try:
+            # mode=rw: a file deleted since the job was queued is not recreated
+            conn = sqlite3.connect(
+                f"file:{quote(os.path.abspath(db_path))}?mode=rw", uri=True
+            )
+        except sqlite3.OperationalError:
+            return
+        try:
+            if not unfinished_only or self.has_cleared_rows(conn):
+                self.purge_cleared_rows(conn)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def has_cleared_rows(conn) -> bool:
+        """Whether rows hidden by a clear are still stored."""
+        for table in ("memories", "memories_archive"):
+            if conn.execute(
+                f"""
+                SELECT 1 FROM {table} WHERE id <= (
+                    SELECT COALESCE(MAX(value), 0) FROM memory_meta
+                    WHERE key = 'cleared_through'
+                ) LIMIT 1
+                """
+            ).fetchone():
+                return True
+        return False
+
+    @staticmethod
+    def purge_cleared_rows(conn, batch_size: int = 500):
+        """Delete hidden rows in short batches on the given connection."""
+        for table in ("memories", "memories_archive"):
+            while True:
+                cursor = conn.execute(
+                    f"""
+                        DELETE FROM {table} WHERE id IN (
+                            SELECT id FROM {table} WHERE id <= (
+                                SELECT COALESCE(MAX(value), 0) FROM memory_meta
+                                WHERE key = 'cleared_through'
+                            ) LIMIT ?
+                        )
+                        """,
+                    (batch_size,),
+                )
+                conn.commit()
+                if cursor.rowcount < batch_size:
+                    break
+                time.sleep(0.01)  # Let foreground writers in between batches
+        # Dictionaries only the purged rows used, except the current ones
+        conn.execute(
+            """
+            DELETE FROM archive_dicts
+            WHERE id NOT IN (SELECT MAX(id) FROM archive_dicts GROUP BY codec)
+                AND id NOT IN (
+                    SELECT dict_id FROM memories_archive WHERE dict_id IS NOT NULL
+                    UNION
+                    SELECT dict_id FROM memory_history WHERE dict_id IS NOT NULL
+                )
+            """
+        )
+        conn.commit()
+        conn.execute("PRAGMA incremental_vacuum").fetchall()
+
+
+_defer(
+    r'''
+class SessionPersister:
+    """Daemon thread copying in-memory session databases to disk.
+
+    Each session keeps a connection of its own to the shared in-memory
+    database, which keeps it alive and lets PRAGMA data_version tell whether
+    anything was committed since the last copy.
+    """
+
+    _instance = None
+
+    def __init__(self):
+        self._sessions = {}  # db path -> [connection, interval, next due, data_version]
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @classmethod
+    def shared(cls):
+        """Return the process-wide persister, flushing all sessions at exit."""
+        if cls._instance is None:
+            cls._instance = cls()
+            atexit.register(cls._instance.flush_all)
+        return cls._instance
+
+    def register(self, db_path: str, uri: str, interval: int):
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        with self._lock:
+            self._sessions[db_path] = [
+                conn,
+                interval,
+                time.monotonic() + interval,
+                None,
+            ]
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="memory-session-persister", daemon=True
+                )
+                self._thread.start()
+
+    def unregister(self, db_path: str):
+        self.persist(db_path)
+        with self._lock:
+            session = self._sessions.pop(db_path, None)
+        if session:
+            session[0].close()
+
+    def persist(self, db_path: str) -> str:
+        """Copy one session to its file with the backup API if it changed."""
+        with self._lock:
+            session = self._sessions.get(db_path)
+            if session is None:
+                return f"No in-memory session for {os.path.basename(db_path)}."
+            conn, interval, _, last_version = session
+            version = conn.execute("PRAGMA data_version").fetchone()[0]
+            session[2] = time.monotonic() + interval
+            if version == last_version:
+                return f"Session {os.path.basename(db_path)} is already persisted."
+            with sqlite3.connect(db_path) as disk:
+                conn.backup(disk, pages=256)
+            session[3] = version
+        return f"Session {os.path.basename(db_path)} persisted to disk."
+
+    def flush_all(self):
+        for db_path in list(self._sessions):
+            try:
+                self.persist(db_path)
+            except sqlite3.Error as e:
+                print(f"Error persisting session {db_path}: {e}")
+
+    def _run(self):
+        while self._sessions:
+            time.sleep(1)
+            now = time.monotonic()
+            for db_path, session in list(self._sessions.items()):
+                if session[2] <= now:
+                    try:
+                        self.persist(db_path)
+                    except sqlite3.Error as e:
+                        print(f"Error persisting session {db_path}: {e}")
+'''
+)
+
+
+_defer(
+    r'''
+class BackupScheduler:
+    """Periodic online backups of every memory file in a directory.
+
+    Files are copied with the SQLite backup API in steps of PAGES_PER_STEP
+    pages, sleeping STEP_SLEEP seconds between steps so writers get the
+    database in between. Up to `workers` files are copied in parallel.
+    Files whose size and mtime match the last backup are skipped, and only
+    the newest `keep` backups of each file are retained.
+    """
+
+    PAGES_PER_STEP = 64
+    STEP_SLEEP = 0.005
+    MAX_RESTARTS = 3  # Throttled copies restarted by writers this often go unthrottled
+
+    _instances = {}
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.catalog = _deferred("MemoryCatalog").for_directory(directory)
+        self.settings = None  # (interval minutes, backup dir, keep, workers)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def for_directory(cls, directory: str):
+        key = os.path.abspath(directory)
+        if key not in cls._instances:
+            cls._instances[key] = cls(directory)
+        return cls._instances[key]
+
+    def configure(self, interval: int, backup_dir: str, keep: int, workers: int):
+        """Apply settings; an interval of 0 minutes stops scheduled backups."""
+        settings = (interval, backup_dir, max(keep, 1), max(workers, 1))
+        if settings == self.settings:
+            return
+        self.settings = settings
+        self._wake.set()  # Re-read the interval now
+        if interval > 0 and (self._thread is None or not self._thread.is_alive()):
+            self._thread = threading.Thread(
+                target=self._run, name="memory-backups", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while self.settings and self.settings[0] > 0:
+            self._wake.clear()
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Error backing up memory files: {e}")
+            self._wake.wait(self.settings[0] * 60)
+
+    def run_once(self) -> str:
+        """Back up every changed file now and apply the retention policy."""
+        _, backup_dir, keep, workers = self.settings
+        with self._lock:  # One pass at a time, scheduled or on demand
+            os.makedirs(backup_dir, exist_ok=True)
+            manifest_path = os.path.join(backup_dir, "manifest.json")
+            try:
+                with open(manifest_path) as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):
+                manifest = {}
+            changed = {
+                name: list(signature)
+                for name, signature in self.catalog._scan().items()
+                if manifest.get(name) != list(signature)
+            }
+            errors = []
+            from concurrent.futures import ThreadPoolExecutor  # Backups only
+
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = {
+                    name: pool.submit(self._backup_file, name, backup_dir)
+                    for name in changed
+                }
+                for name, future in futures.items():
+                    try:
+                        future.result()
+                        manifest[name] = changed[name]
+                    except (sqlite3.Error, OSError) as e:
+                        errors.append(f"{name}: {e}")
+            tmp_path = manifest_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(manifest, f)
+            os.replace(tmp_path, manifest_path)
+            self._prune(backup_dir, keep)
+        message = f"Backed up {len(changed) - len(errors)} changed memory files to {backup_dir}."
+        if errors:
+            message += " Failed: " + "; ".join(errors)
+        return message
+
+    def _backup_file(self, name: str, backup_dir: str):
+        path = os.path.join(self.directory, name)
+        stamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")
+        target = os.path.join(backup_dir, f"{name[:-3]}.{stamp}.db")
+        # Held shared, so delete_memory_file waits for the copy to finish.
+        with FileLock(os.path.join(self.directory, ".locks", name + ".lock"), True):
+            source = sqlite3.connect(
+                f"file:{quote(os.path.abspath(path))}?mode=ro", uri=True
+            )
+            dest = sqlite3.connect(target + ".tmp")
+            try:
+                try:
+                    source.backup(
+                        dest, pages=self.PAGES_PER_STEP, progress=self._throttle()
+                    )
+                except _BackupRestarted:
+                    source.backup(dest)  # Busy file: copy in one step instead
+            finally:
+                dest.close()
+                source.close()
+        os.replace(target + ".tmp", target)
+
+    def _throttle(self):
+        """Progress callback sleeping between steps and counting restarts."""
+        state = {"remaining": None, "restarts": 0}
+
+        def progress(status, remaining, total):
+            if state["remaining"] is not None and remaining > state["remaining"]:
+                state["restarts"] += 1  # A writer changed the source mid-copy
+                if state["restarts"] >= self.MAX_RESTARTS:
+                    raise _BackupRestarted()
+            state["remaining"] = remaining
+            time.sleep(self.STEP_SLEEP)
+
+        return progress
+
+    @staticmethod
+    def _prune(backup_dir: str, keep: int):
+        backups = {}
+        for entry in sorted(os.listdir(backup_dir)):
+            parts = entry.rsplit(".", 2)  # <file stem>.<stamp>.db
+            if len(parts) == 3 and parts[2] == "db":
+                backups.setdefault(parts[0], []).append(entry)
+        for entries in backups.values():
+            for entry in entries[:-keep]:
+                os.remove(os.path.join(backup_dir, entry))
+
+
+class _BackupRestarted(Exception):
+    """Raised from the backup progress callback to stop a starved throttled copy."""
+'''
+)
+
+
+class WriteSpool:
+    """Append-only local file of memory writes the database could not take.
+
+    Each entry is one JSON object with a unique key, written after a newline
+    so that a torn append only loses itself. Appends from all threads share
+    fsyncs: the first writer that finds no fsync running syncs everything
+    written so far, and the others wait for it to finish. replay() moves the
+    spool aside under the file lock, so new writes start a fresh spool, and
+    feeds it to the database in batches. The database records the keys it
+    applied, so replaying the same entries again does nothing.
+    """
+
+    _spools = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, path: str, file_lock: FileLock, replay_lock: FileLock):
+        self.path = path
+        self.replay_path = path + ".replay"
+        self.file_lock = file_lock  # Appends and the move aside, across processes
+        self.replay_lock = replay_lock  # One replay at a time, across processes
+        self._cond = threading.Condition()
+        self._replaying = threading.Lock()
+        self._fd = None
+        self._written = 0
+        self._synced = 0
+        self._syncing = False
+
+    @classmethod
+    def for_path(cls, path: str, file_lock: FileLock, replay_lock: FileLock):
+        with cls._registry_lock:
+            spool = cls._spools.get(path)
+            if spool is None:
+                spool = cls._spools[path] = cls(path, file_lock, replay_lock)
+            return spool
+
+    def pending(self) -> bool:
+        return os.path.exists(self.path) or os.path.exists(self.replay_path)
+
+    def append(self, op: str, **fields) -> str:
+        """Add a write and return its key once it is on disk."""
+        return self.append_many(op, [fields])[0]
+
+    def append_many(self, op: str, rows: list) -> list:
+        """Add writes of one kind with a single write and fsync; returns their keys."""
+        keys = [os.urandom(16).hex() for _ in rows]
+        data = "".join(
+            "\n" + json.dumps(dict(fields, op=op, key=key), ensure_ascii=False)
+            for fields, key in zip(rows, keys)
+        )
+        with self._cond:
+            with self.file_lock:
+                self._open()
+                os.write(self._fd, data.encode("utf-8"))
+            self._written += 1
+            ticket = self._written
+            while self._synced < ticket:
+                if self._syncing:
+                    self._cond.wait()
+                    continue
+                self._syncing = True
+                target, fd = self._written, self._fd
+                self._cond.release()
+                try:
+                    os.fsync(fd)
+                finally:
+                    self._cond.acquire()
+                    self._syncing = False
+                    self._cond.notify_all()
+                self._synced = max(self._synced, target)
+        return keys
+
+    def replay(self, apply, finish, batch_size: int = 500) -> int:
+        """Pass spooled entries in order to apply(batch) and remove them once all went in.
+
+        finish() runs after the spool file is gone. Returns the number of
+        entries replayed, 0 if another thread or process is replaying.
+        """
+        if not self._replaying.acquire(blocking=False):
+            return 0
+        try:
+            if not self.replay_lock.acquire(timeout=0):
+                return 0
+            try:
+                replayed = 0
+                while True:  # Writes spooled meanwhile are replayed before returning
+                    count = self._replay(apply, finish, batch_size)
+                    if count is None:
+                        return replayed
+                    replayed += count
+            finally:
+                self.replay_lock.release()
+        finally:
+            self._replaying.release()
+
+    def _replay(self, apply, finish, batch_size: int):
+        with self._cond, self.file_lock:
+            if not os.path.exists(self.replay_path) and os.path.exists(self.path):
+                os.replace(self.path, self.replay_path)  # Left over if a replay failed
+        entries = []
+        try:
+            with open(self.replay_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        pass  # Separator or torn append
+        except FileNotFoundError:
+            return None
+        for start in range(0, len(entries), batch_size):
+            apply(entries[start : start + batch_size])
+        os.remove(self.replay_path)
+        finish()
+        return len(entries)
+
+    def _open(self):
+        """Open the spool, reopening once a replay moved it aside; call with both locks."""
+        try:
+            if self._fd is not None and (
+                os.fstat(self._fd).st_ino == os.stat(self.path).st_ino
+            ):
+                return
+        except FileNotFoundError:
+            pass
+        while self._syncing:
+            self._cond.wait()
+        if self._fd is not None:
+            os.fsync(self._fd)  # Everything appended so far went to the old file
+            os.close(self._fd)
+            self._synced = self._written
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+
+class EntityExtractor:
+    """Cheap local extraction of the people and things a memo is about.
+
+    Runs of capitalised words are taken as names. Each word of a multi-word
+    name is indexed too, so "Anna" finds "Anna Smith". Relationship words
+    like "sister" or "boss" are kept as keywords. Entities are lowercased,
+    without a trailing possessive.
+    """
+
+    # Compiled on first use by re's own cache, not when the tool loads
+    NAME = r"\b[A-Z][\w'’-]*(?:\s+[A-Z][\w'’-]*){0,2}"
+    RELATIONSHIPS = frozenset(
+        """
+        wife husband partner spouse girlfriend boyfriend fiance fiancee
+        mother father mom mum dad parent parents son daughter child children kids
+        sister brother sibling grandmother grandfather grandma grandpa
+        aunt uncle cousin niece nephew friend friends boss manager colleague
+        coworker teammate neighbor neighbour roommate doctor therapist teacher
+        """.split()
+    )
+    NOT_NAMES = frozenset(
+        """
+        i i'm i've i'll i'd the a an my our your his her their its this that
+        these those he she we they it you user llm ok yes no
+        monday tuesday wednesday thursday friday saturday sunday
+        january february march april may june july august september october
+        november december
+        """.split()
+    )
+
+    def normalize(self, entity: str) -> str:
+        return re.sub(r"['’]s$", "", entity.strip().lower())
+
+    def extract(self, text: str) -> set:
+        entities = set()
+        for match in re.finditer(self.NAME, text):
+            words = [
+                word
+                for word in (self.normalize(word) for word in match.group().split())
+                if word not in self.NOT_NAMES and word not in MemoryFunctions.STOP_WORDS
+            ]
+            if words:
+                entities.add(" ".join(words))
+                entities.update(words)
+        entities.update(
+            word
+            for word in re.findall(r"\w+", text.lower())
+            if word in self.RELATIONSHIPS
+        )
+        return entities
+
+
+class StorageBackend:
+    """Protocol for the storage behind MemoryFunctions' core operations.
+
+    Rows are (id, tag, memo, by_who, last_modified) tuples and ids are
+    assigned by the backend. get() returns the dict retrieve_from_memory
+    hands out. Failures raise sqlite3.Error or OSError. Features tied to
+    SQLite (archive, point-in-time reads, replication, quotas, sessions)
+    stay in MemoryFunctions and need the sqlite backend.
+    """
+
+    name = None
+    suffix = None  # File name suffix of the memory files the backend keeps
+
+    def add(self, tag: str, memo: str, by_who: str, last_modified: str) -> int:
+        return self.add_many([(tag, memo, by_who, last_modified)])[0]
+
+    def add_many(self, rows) -> list:
+        """Store (tag, memo, by_who, last_modified) rows in one write; returns their ids."""
+        raise NotImplementedError
+
+    def update(
+        self, index: int, tag: str, memo: str, by_who: str, last_modified: str
+    ) -> bool:
+        raise NotImplementedError
+
+    def update_many(self, patches, last_modified: str) -> dict:
+        """Apply (index, fields) patches, fields holding some of tag, memo and by_who.
+
+        Fields left out keep their value. Returns {index: whether it exists}.
+        """
+        results = {}
+        for index, fields in patches:
+            row = self.get(index)
+            results[index] = row is not None and self.update(
+                index,
+                fields.get("tag", row["tag"]),
+                fields.get("memo", row["memo"]),
+                fields.get("by_who", row["by"]),
+                last_modified,
+            )
+        return results
+
+    def delete(self, index: int) -> bool:
+        raise NotImplementedError
+
+    def get(self, index: int):
+        raise NotImplementedError
+
+    def scan(self, tag: str = None) -> list:
+        """Return every live row, or only those with tag."""
+        raise NotImplementedError
+
+    def search(self, terms: set, limit: int) -> list:
+        """Return the rows sharing the most words with terms, most recent first on ties."""
+        scored = []
+        for index, tag, memo, by_who, last_modified in self.scan():
+            words = set(re.findall(r"\w+", (memo or "").lower()))
+            score = len(terms & words) + (1 if tag in terms else 0)
+            if score:
+                scored.append((score, last_modified or "", index, tag, memo, by_who))
+        scored.sort(reverse=True)
+        return [
+            (index, tag, memo, by_who, last_modified)
+            for _, last_modified, index, tag, memo, by_who in scored[:limit]
+        ]
+
+    def contains(self, memo: str) -> bool:
+        return any(row[2] == memo for row in self.scan())
+
+    def about(self, entity: str, extractor) -> list:
+        """Return the rows whose memo mentions entity, as extractor finds entities."""
+        return [row for row in self.scan() if entity in extractor.extract(row[2] or "")]
+
+    def clear(self, cleared_at: str):
+        """Delete every row."""
+        for row in self.scan():
+            self.delete(row[0])
+
+    def history(self, index: int) -> list:
+        """Return the versions of a row in memory_history's format, oldest first."""
+        raise NotImplementedError
+
+    def rewrite_memos(self, transform):
+        """Replace every stored memo, old versions included, with transform(memo)."""
+        raise NotImplementedError
+
+    def snapshot(self, path: str):
+        """Write a consistent copy of the store to path."""
+        raise NotImplementedError
+
+    @classmethod
+    def file_stats(cls, path: str) -> tuple:
+        """Return ({tag: live rows}, archived rows) of a file, without opening it for writes."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SQLiteBackend(StorageBackend):
+    """Default backend: the memories table of the MemoryFunctions' current file.
+
+    Uses the owner's connection, so sessions, locks and triggers apply as
+    before. Scans open a connection of their own to be usable from worker
+    threads.
+    """
+
+    name = "sqlite"
+    suffix = ".db"
+    COLUMNS = {"tag": "tag_id", "memo": "memo", "by_who": "by_id"}  # update_many fields
+
+    def __init__(self, memory):
+        self.memory = memory
+
+    def add_many(self, rows) -> list:
+        conn = self.memory.conn
+        cursor = conn.cursor()
+        ids = [self._insert(cursor, *row) for row in rows]
+        conn.commit()
+        return ids
+
+    def update(
+        self, index: int, tag: str, memo: str, by_who: str, last_modified: str
+    ) -> bool:
+        conn = self.memory.conn
+        cursor = conn.cursor()
+        if not self._update(cursor, index, tag, memo, by_who, last_modified):
+            conn.rollback()
+            return False
+        conn.commit()
+        return True
+
+    def _insert(self, cursor, tag, memo, by_who, last_modified) -> int:
+        cursor.execute(
+            """
+            INSERT INTO memories (tag_id, memo, by_id, last_modified)
+            VALUES (?, ?, ?, ?)
+            """,
+            (
+                self.memory._intern(cursor, "tags", tag),
+                memo,
+                self.memory._intern(cursor, "authors", by_who),
+                last_modified,
+            ),
+        )
+        index = cursor.lastrowid
+        self.memory._index_memo(cursor, index, memo)
+        return index
+
+    def _update(self, cursor, index, tag, memo, by_who, last_modified) -> bool:
+        # Modified memories become hot again
+        self.memory._restore_archived(cursor, index)
+        cursor.execute(
+            """
+            UPDATE memories
+            SET tag_id = ?, memo = ?, by_id = ?, last_modified = ?
+            WHERE id = (SELECT id FROM live_memories WHERE id = ?)
+            """,
+            (
+                self.memory._intern(cursor, "tags", tag),
+                memo,
+                self.memory._intern(cursor, "authors", by_who),
+                last_modified,
+                index,
+            ),
+        )
+        if cursor.rowcount == 0:
+            return False
+        self.memory._index_memo(cursor, index, memo)
+        return True
+
+    def update_many(self, patches, last_modified: str) -> dict:
+        """One transaction, with one executemany per set of patched columns."""
+        conn = self.memory.conn
+        cursor = conn.cursor()
+        indices = [index for index, _ in patches]
+        try:
+            found = set()
+            for start in range(0, len(indices), 500):
+                chunk = indices[start : start + 500]
+                cursor.execute(
+                    f"SELECT id FROM live_memories WHERE id IN ({', '.join('?' * len(chunk))})",
+                    chunk,
+                )
+                found.update(index for (index,) in cursor.fetchall())
+            # Modified memories become hot again
+            found.update(
+                index
+                for index in indices
+                if index not in found and self.memory._restore_archived(cursor, index)
+            )
+            groups = {}
+            for index, fields in patches:
+                if index in found:
+                    groups.setdefault(tuple(sorted(fields)), []).append((index, fields))
+            for names, group in groups.items():
+                assignments = ", ".join(f"{self.COLUMNS[name]} = ?" for name in names)
+                cursor.executemany(
+                    f"UPDATE memories SET {assignments}, last_modified = ? WHERE id = ?",
+                    [
+                        tuple(self._value(cursor, name, fields[name]) for name in names)
+                        + (last_modified, index)
+                        for index, fields in group
+                    ],
+                )
+                if "memo" in names:
+                    for index, fields in group:
+                        self.memory._index_memo(cursor, index, fields["memo"])
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        return {index: index in found for index in indices}
+
+    def _patch(self, cursor, index, fields, last_modified) -> bool:
+        """update_many for one row, within the caller's transaction."""
+        # Modified memories become hot again
+        self.memory._restore_archived(cursor, index)
+        names = sorted(fields)
+        assignments = ", ".join(f"{self.COLUMNS[name]} = ?" for name in names)
+        cursor.execute(
+            f"""
+            UPDATE memories SET {assignments}, last_modified = ?
+            WHERE id = (SELECT id FROM live_memories WHERE id = ?)
+            """,
+            tuple(self._value(cursor, name, fields[name]) for name in names)
+            + (last_modified, index),
+        )
+        if cursor.rowcount == 0:
+            return False
+        if "memo" in fields:
+            self.memory._index_memo(cursor, index, fields["memo"])
+        return True
+
+    def _value(self, cursor, name: str, value):
+        if name == "tag":
+            return self.memory._intern(cursor, "tags", value)
+        if name == "by_who":
+            return self.memory._intern(cursor, "authors", value)
+        return value
+
+    def delete(self, index: int) -> bool:
+        conn = self.memory.conn
+        if not self._delete(conn.cursor(), index):
+            return False
+        conn.commit()
+        return True
+
+    def _delete(self, cursor, index) -> bool:
+        cursor.execute(
+            "DELETE FROM memories WHERE id = (SELECT id FROM live_memories WHERE id = ?)",
+            (index,),
+        )
+        if cursor.rowcount == 0:
+            cursor.execute(
+                """
+                DELETE FROM memories_archive
+                WHERE id = (SELECT id FROM live_memories_archive WHERE id = ?)
+                """,
+                (index,),
+            )
+        return cursor.rowcount > 0
+
+    def apply_spooled(self, entries: list) -> int:
+        """Apply WriteSpool entries in one transaction, skipping keys applied before."""
+        conn = self.memory.conn
+        cursor = conn.cursor()
+        applied = 0
+        try:
+            for entry in entries:
+                cursor.execute(
+                    "INSERT OR IGNORE INTO spool_applied (key) VALUES (?)",
+                    (entry["key"],),
+                )
+                if cursor.rowcount == 0:
+                    continue
+                if entry["op"] == "add":
+                    self._insert(
+                        cursor,
+                        self.memory.valid_tag(entry["tag"]),
+                        entry["memo"],
+                        entry["by"],
+                        entry["last_modified"],
+                    )
+                elif entry["op"] == "update" and "fields" in entry:  # A bulk patch
+                    self._patch(
+                        cursor,
+                        entry["index"],
+                        self.memory._valid_fields(entry["fields"]),
+                        entry["last_modified"],
+                    )
+                elif entry["op"] == "update":
+                    self._update(
+                        cursor,
+                        entry["index"],
+                        self.memory.valid_tag(entry["tag"]),
+                        entry["memo"],
+                        entry["by"],
+                        entry["last_modified"],
+                    )
+                elif entry["op"] == "delete":
+                    self._delete(cursor, entry["index"])
+                applied += 1
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        return applied
+
+    def get(self, index: int):
+        cursor = self.memory.conn.cursor()
+        cursor.execute(
+            "SELECT tag, memo, by_who, last_modified FROM live_memories WHERE id = ?",
+            (index,),
+        )
+        row = cursor.fetchone()
+        if row:
+            return {
+                "index": index,
+                "tag": row[0],
+                "memo": row[1],
+                "by": row[2],
+                "last_modified": row[3],
+            }
+        cursor.execute(
+            """
+            SELECT tag, memo_blob, codec, dict_id, by_who, last_modified
+            FROM live_memories_archive WHERE id = ?
+            """,
+            (index,),
+        )
+        row = cursor.fetchone()
+        if row:
+            return {
+                "index": index,
+                "tag": row[0],
+                "memo": self.memory._decompress_memo(row[1], row[2], row[3]),
+                "by": row[4],
+                "last_modified": row[5],
+                "archived": True,
+            }
+        return None
+
+    def scan(self, tag: str = None) -> list:
+        conn = self.memory._open_connection()
+        try:
+            if tag is None:
+                return conn.execute(
+                    "SELECT id, tag, memo, by_who, last_modified FROM live_memories"
+                ).fetchall()
+            return conn.execute(
+                """
+                SELECT id, tag, memo, by_who, last_modified FROM live_memories
+                WHERE tag_id = (SELECT id FROM tags WHERE name = ?)
+                """,
+                (tag,),
+            ).fetchall()
+        finally:
+            conn.close()
+
+    def search(self, terms: set, limit: int) -> list:
+        """Score only the rows memory_terms or their tag match, not every row."""
+        terms = sorted(terms)
+        marks = ", ".join("?" * len(terms))
+        conn = self.memory._open_connection()
+        try:
+            return conn.execute(
+                f"""
+                SELECT l.id, l.tag, l.memo, l.by_who, l.last_modified
+                FROM (
+                    SELECT id, SUM(score) AS score FROM (
+                        SELECT memory_id AS id, COUNT(*) AS score FROM memory_terms
+                        WHERE term IN ({marks}) GROUP BY memory_id
+                        UNION ALL
+                        SELECT m.id, 1 FROM memories AS m
+                        JOIN tags AS t ON t.id = m.tag_id WHERE t.name IN ({marks})
+                    ) GROUP BY id
+                ) AS h
+                JOIN live_memories AS l ON l.id = h.id
+                ORDER BY h.score DESC, COALESCE(l.last_modified, '') DESC, l.id DESC
+                LIMIT ?
+                """,
+                (*terms, *terms, limit),
+            ).fetchall()
+        finally:
+            conn.close()
+
+    def contains(self, memo: str) -> bool:
+        return (
+            self.memory.conn.execute(
+                "SELECT 1 FROM live_memories WHERE memo = ? LIMIT 1", (memo,)
+            ).fetchone()
+            is not None
+        )
+
+    def clear(self, cleared_at: str):
+        cursor = self.memory.conn.cursor()
+        # Hide every existing row at once by moving the visibility horizon
+        # to the last id handed out; the rows are deleted in the background.
+        cursor.execute(
+            """
+            INSERT OR REPLACE INTO memory_meta (key, value)
+            VALUES ('cleared_through', COALESCE(
+                (SELECT seq FROM sqlite_sequence WHERE name = 'memories'), 0
+            ))
+            """
+        )
+        # History dates the hidden rows' deletion to now, not to the reclaim
+        cursor.execute(
+            """
+            INSERT OR IGNORE INTO memory_clears (cleared_through, cleared_at)
+            SELECT value, ? FROM memory_meta WHERE key = 'cleared_through'
+            """,
+            (cleared_at,),
+        )
+        cursor.execute(
+            """
+            INSERT INTO memory_changelog (op, memory_id, last_modified)
+            SELECT 'clear', value, ? FROM memory_meta
+            WHERE key = 'cleared_through'
+            """,
+            (cleared_at,),
+        )
+        self.memory.conn.commit()
+        self.memory._reclaim_cleared_rows()
+
+    def snapshot(self, path: str):
+        dest = sqlite3.connect(path)
+        try:
+            self.memory.conn.backup(dest)
+        finally:
+            dest.close()
+
+    @classmethod
+    def file_stats(cls, path: str) -> tuple:
+        conn = sqlite3.connect(f"file:{quote(os.path.abspath(path))}?mode=ro", uri=True)
+        try:
+            try:
+                rows = conn.execute(
+                    "SELECT tag, COUNT(*) FROM live_memories GROUP BY tag"
+                ).fetchall()
+                archived = conn.execute(
+                    "SELECT COUNT(*) FROM live_memories_archive"
+                ).fetchone()[0]
+            except sqlite3.Error:  # File not opened since the archive tier
+                rows = conn.execute(
+                    "SELECT tag, COUNT(*) FROM memories GROUP BY tag"
+                ).fetchall()
+                archived = 0
+        finally:
+            conn.close()
+        return {tag: count for tag, count in rows}, archived
+
+
+_defer(
+    r'''
+class AppendLogBackend(StorageBackend):
+    """Write-optimised backend: an append-only JSON-lines log with an in-memory index.
+
+    Every write is a single append of one line per row, with no page
+    updates or journal. Lines reach the OS on every write but are not
+    fsynced. The log is replayed on open and re-read from the last known
+    offset whenever another process has appended. write_lock serialises
+    writers across processes. Once dead lines outnumber live rows, the log
+    is compacted through snapshot(), which also drops the old versions
+    history() reads from the log.
+    """
+
+    name = "appendlog"
+    suffix = ".log"
+    COMPACT_MIN_DEAD = 1000  # Never compact small logs
+
+    def __init__(self, path: str, write_lock):
+        self.path = path
+        self.write_lock = write_lock
+        self._lock = threading.RLock()
+        self._fd = None
+        self._reset(None)
+        if write_lock is not None:  # Listed from the start, like a new SQLite file
+            os.close(os.open(path, os.O_WRONLY | os.O_CREAT))
+        with self._lock:
+            self._catch_up()
+
+    def _reset(self, inode):
+        self._rows = {}  # id -> row, in insertion order
+        self._next_id = 1
+        self._dead = 0  # Log lines no longer describing a live row
+        self._offset = 0  # Bytes of the log already applied
+        self._inode = inode
+
+    def _catch_up(self):
+        """Apply lines appended since the last look; reload if the log was replaced."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            st = None
+        inode = st.st_ino if st else None
+        if inode != self._inode or (st and st.st_size < self._offset):
+            self._reset(inode)
+            if self._fd is not None:
+                os.close(self._fd)  # Still points at the replaced log
+                self._fd = None
+        if st is None or st.st_size == self._offset:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1  # Leave a partly written last line for later
+        for line in data[:end].splitlines():
+            try:
+                self._apply(json.loads(line))
+            except (ValueError, KeyError):
+                self._dead += 1  # Torn line left by a crashed writer
+        self._offset += end
+
+    def _apply(self, entry: dict):
+        index = entry["id"]
+        if entry["op"] == "next_id":
+            self._next_id = max(self._next_id, index)
+            return
+        if entry["op"] == "clear":  # Every row below id
+            self._next_id = max(self._next_id, index)
+            self._dead += len(self._rows) + 1
+            self._rows = {}
+            return
+        self._next_id = max(self._next_id, index + 1)
+        if entry["op"] == "put":
+            if index in self._rows:
+                self._dead += 1
+            self._rows[index] = (
+                index,
+                entry["tag"],
+                entry["memo"],
+                entry["by"],
+                entry["last_modified"],
+            )
+        elif self._rows.pop(index, None) is not None:
+            self._dead += 2  # The delete line and the put it cancels
+        else:
+            self._dead += 1
+
+    def _write(self, entries: list):
+        """Append entries; call with both locks held after _catch_up()."""
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+            self._inode = os.fstat(self._fd).st_ino
+        data = "".join(json.dumps(entry) + "\n" for entry in entries).encode()
+        size = os.fstat(self._fd).st_size
+        if size > self._offset:
+            data = b"\n" + data  # Terminate a torn line so it is skipped
+        os.write(self._fd, data)
+        self._offset = size + len(data)
+        for entry in entries:
+            self._apply(entry)
+        if self._dead >= self.COMPACT_MIN_DEAD and self._dead > len(self._rows):
+            self.snapshot(self.path)
+
+    @staticmethod
+    def _put(index, tag, memo, by_who, last_modified) -> dict:
+        return {
+            "op": "put",
+            "id": index,
+            "tag": tag,
+            "memo": memo,
+            "by": by_who,
+            "last_modified": last_modified,
+        }
+
+    def add_many(self, rows) -> list:
+        with self._lock, self.write_lock:
+            self._catch_up()
+            ids = list(range(self._next_id, self._next_id + len(rows)))
+            self._write([self._put(index, *row) for index, row in zip(ids, rows)])
+            return ids
+
+    def update(
+        self, index: int, tag: str, memo: str, by_who: str, last_modified: str
+    ) -> bool:
+        with self._lock, self.write_lock:
+            self._catch_up()
+            if index not in self._rows:
+                return False
+            self._write([self._put(index, tag, memo, by_who, last_modified)])
+            return True
+
+    def update_many(self, patches, last_modified: str) -> dict:
+        with self._lock, self.write_lock:
+            self._catch_up()
+            results = {}
+            lines = []
+            for index, fields in patches:
+                row = self._rows.get(index)
+                results[index] = row is not None
+                if row is not None:
+                    lines.append(
+                        self._put(
+                            index,
+                            fields.get("tag", row[1]),
+                            fields.get("memo", row[2]),
+                            fields.get("by_who", row[3]),
+                            last_modified,
+                        )
+                    )
+            if lines:
+                self._write(lines)
+            return results
+
+    def delete(self, index: int) -> bool:
+        with self._lock, self.write_lock:
+            self._catch_up()
+            if index not in self._rows:
+                return False
+            deleted_at = datetime.datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
+            self._write([{"op": "delete", "id": index, "last_modified": deleted_at}])
+            return True
+
+    def clear(self, cleared_at: str):
+        with self._lock, self.write_lock:
+            self._catch_up()
+            self._write(
+                [{"op": "clear", "id": self._next_id, "last_modified": cleared_at}]
+            )
+
+    def history(self, index: int) -> list:
+        """Versions of a row still in the log, that is since it was last compacted."""
+        with self._lock:
+            self._catch_up()
+            with open(self.path, "rb") as f:
+                data = f.read(self._offset)
+        versions = []
+        live = None
+        for line in data.splitlines():
+            try:
+                entry = json.loads(line)
+                op, row_id = entry["op"], entry["id"]
+            except (ValueError, KeyError):
+                continue  # Torn line
+            if op == "put" and row_id == index:
+                if live is not None:
+                    live["valid_to"] = entry["last_modified"]
+                    versions.append(live)
+                live = {
+                    "index": index,
+                    "tag": entry["tag"],
+                    "memo": entry["memo"],
+                    "by": entry["by"],
+                    "last_modified": entry["last_modified"],
+                    "valid_to": None,
+                    "deleted": False,
+                }
+            elif live is not None and (
+                op == "delete" and row_id == index or op == "clear" and row_id > index
+            ):
+                live["valid_to"] = entry.get("last_modified")
+                live["deleted"] = True
+                versions.append(live)
+                live = None
+        for number, version in enumerate(versions, 1):
+            version["version"] = number
+        if live is not None:
+            del live["valid_to"], live["deleted"]
+            live["version"] = "current"
+            versions.append(live)
+        return versions
+
+    def rewrite_memos(self, transform):
+        """Rewrite the log with transform(memo) in every put line, keeping history()."""
+        with self._lock, self.write_lock:
+            self._catch_up()
+            with open(self.path, "rb") as f:
+                data = f.read(self._offset)
+            lines = []
+            for line in data.splitlines():
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # Torn line
+                if entry.get("op") == "put" and entry.get("memo") is not None:
+                    entry["memo"] = transform(entry["memo"])
+                lines.append(json.dumps(entry) + "\n")
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                f.write("".join(lines))
+            os.replace(tmp_path, self.path)
+            self._catch_up()  # New inode: reload the rewritten log
+
+    def get(self, index: int):
+        with self._lock:
+            self._catch_up()
+            row = self._rows.get(index)
+        if row is None:
+            return None
+        return {
+            "index": index,
+            "tag": row[1],
+            "memo": row[2],
+            "by": row[3],
+            "last_modified": row[4],
+        }
+
+    def scan(self, tag: str = None) -> list:
+        with self._lock:
+            self._catch_up()
+            if tag is None:
+                return list(self._rows.values())
+            return [row for row in self._rows.values() if row[1] == tag]
+
+    def snapshot(self, path: str):
+        """Write the live rows as a fresh log; used with self.path to compact."""
+        with self._lock:
+            self._catch_up()
+            lines = [json.dumps({"op": "next_id", "id": self._next_id})]
+            lines.extend(json.dumps(self._put(*row)) for row in self._rows.values())
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w") as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(tmp_path, path)
+            if path == self.path:
+                self._catch_up()  # New inode: reload the compacted log
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+    @classmethod
+    def file_stats(cls, path: str) -> tuple:
+        log = cls(path, write_lock=None)  # Only reads: no write lock needed
+        try:
+            return dict(Counter(row[1] for row in log.scan())), 0
+        finally:
+            log.close()
+'''
+)
+
+
+# Names accepted by MemoryFunctions(backend=...) and the STORAGE_BACKEND valve,
+# with the class of each; resolve it with _deferred().
+STORAGE_BACKENDS = {
+    "sqlite": "SQLiteBackend",
+    "appendlog": "AppendLogBackend",
+}
 
 
 class EventEmitter:
@@ -1110,6 +6467,78 @@ class EventEmitter:
             )
 
 
+class RuleBasedMemoryExtractor:
+    """Cheap local extractor for facts users state about themselves.
+
+    Any object with an extract(text) method returning (tag, memo) pairs can
+    replace it through Pipeline.memory_extractor.
+    """
+
+    # Words that cannot start the object of "I like ...": pronouns and
+    # clauses refer back to the conversation rather than name a thing.
+    NOT_OBJECTS = (
+        "that|this|it|these|those|them|you|your|yours|him|her|what|how|when|where"
+        "|who|which|to|so|very|the way|the idea|about"
+    )
+
+    # (pattern, tag, memo template); names must be capitalised to count
+    RULES = [
+        (
+            r"\b(?i:my name is) ([A-Z][\w'-]+(?: [A-Z][\w'-]+)?)",
+            "personal",
+            "User's name is {0}",
+        ),
+        (
+            r"\b(?i:my (wife|husband|partner|girlfriend|boyfriend|mother|father|mom"
+            r"|dad|sister|brother|son|daughter|friend|boss)(?:'s name)? is) "
+            r"([A-Z][\w'-]+)",
+            "relationship",
+            "User's {0} is {1}",
+        ),
+        (
+            r"(?i)\bI (?:work|am working) ((?:at|for|as) [^.,!?\n]+)",
+            "work",
+            "User works {0}",
+        ),
+        (
+            r"(?i)\bI (?:study|am studying) ([^.,!?\n]+)",
+            "education",
+            "User studies {0}",
+        ),
+        (
+            r"(?i)\bI (?:live|am living) in ([^.,!?\n]+)",
+            "life",
+            "User lives in {0}",
+        ),
+        (
+            r"(?i)\bI(?:'m| am) allergic to ([^.,!?\n]+)",
+            "wellness",
+            "User is allergic to {0}",
+        ),
+        (
+            # A noun phrase of at most five words ending the clause
+            rf"(?i)\bI (?:really )?(?:like|love|enjoy) (?!(?:{NOT_OBJECTS})\b)"
+            r"([a-z][\w'-]*(?: [\w'-]+){0,4})(?= *(?:[.,;!?\n]|$))",
+            "personal",
+            "User likes {0}",
+        ),
+        (r"(?i)\bremind me to ([^.!?\n]+)", "reminder", "Remind the user to {0}"),
+        (r"(?i)\bremember that ([^.!?\n]+)", "others", "{0}"),
+    ]
+
+    def __init__(self):
+        self.rules = [
+            (re.compile(pattern), tag, template) for pattern, tag, template in self.RULES
+        ]
+
+    def extract(self, text: str) -> list:
+        """Return (tag, memo) pairs for every rule matching text."""
+        facts = []
+        for pattern, tag, template in self.rules:
+            for match in pattern.finditer(text or ""):
+                facts.append((tag, template.format(*match.groups()).strip()))
+        return facts
+
 if __name__ == "__main__":
     # Example of how to run the pipeline (for testing purposes outside OpenWebUI)
     async def main():
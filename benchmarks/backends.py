@@ -0,0 +1,121 @@
+"""Per-operation timings of every storage backend on the same workload.
+
+Each backend gets a fresh memory file in its own directory and runs the
+same sequence: single adds, one bulk add, point reads, updates, a bulk
+update, a relevance search, listing with file stats, deletes and a clear.
+
+    python benchmarks/backends.py --rows 2000
+"""
+
+import argparse
+import importlib.machinery
+import importlib.util
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOOL_PATH = os.path.join(ROOT, "Flash AI v1.2")
+
+
+def load_tool(name: str):
+    """Load the tool file as a module; it has no .py suffix to import it by."""
+    loader = importlib.machinery.SourceFileLoader(name, TOOL_PATH)
+    spec = importlib.util.spec_from_loader(name, loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def timed(timings: dict, operation: str, call, *args):
+    started = time.perf_counter()
+    result = call(*args)
+    timings[operation] = time.perf_counter() - started
+    return result
+
+
+def bench_backend(tool, backend: str, rows: int, directory: str) -> dict:
+    memory = tool.MemoryFunctions(debug=False, directory=directory, backend=backend)
+    timings = {}
+    try:
+        timed(
+            timings,
+            "add",
+            lambda: [
+                memory.add_to_memory("work", f"Memo {number} about Acme", "user")
+                for number in range(rows)
+            ],
+        )
+        timed(
+            timings,
+            "add_many",
+            memory.add_many_to_memory,
+            [("hobby", f"Bulk memo {number}", "LLM") for number in range(rows)],
+        )
+        timed(
+            timings,
+            "get",
+            lambda: [memory.retrieve_from_memory(index) for index in range(1, rows + 1)],
+        )
+        timed(
+            timings,
+            "update",
+            lambda: [
+                memory.update_memory_by_index(index, "work", f"Memo {index} v2", "user")
+                for index in range(1, rows + 1)
+            ],
+        )
+        timed(
+            timings,
+            "update_many",
+            memory.update_memories_bulk,
+            [{"index": index, "tag": "personal"} for index in range(1, rows + 1)],
+        )
+        timed(timings, "search", memory.relevant_memories, "bulk memo acme")
+        timed(timings, "stats", memory.memory_file_stats)
+        timed(
+            timings,
+            "delete",
+            lambda: [
+                memory.delete_memory_by_index(index)
+                for index in range(rows + 1, 2 * rows + 1)
+            ],
+        )
+        timed(timings, "clear", memory.clear_memory)
+    finally:
+        memory.close_db_connection()
+    return timings
+
+
+def run(rows: int = 1000, directory: str = None) -> dict:
+    """Return {backend: {operation: seconds}}."""
+    directory = directory or tempfile.mkdtemp(prefix="memory_backends_")
+    tool = load_tool("flash_ai_backend_bench")
+    report = {
+        backend: bench_backend(tool, backend, rows, os.path.join(directory, backend))
+        for backend in tool.STORAGE_BACKENDS
+    }
+    tool.BackgroundReclaimer.shared().wait()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--directory", help="memory directory (default: a temp dir)")
+    args = parser.parse_args()
+
+    report = run(args.rows, args.directory)
+    operations = list(next(iter(report.values())))
+    print(f"{'operation':<12}" + "".join(f"{backend:>12}" for backend in report))
+    for operation in operations:
+        print(
+            f"{operation:<12}"
+            + "".join(f"{timings[operation]:>11.3f}s" for timings in report.values())
+        )
+
+
+if __name__ == "__main__":
+    main()
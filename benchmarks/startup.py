@@ -0,0 +1,156 @@
+"""Cold-start benchmark: import, construction and first call of each tool.
+
+Every run is a fresh interpreter, as after an Open WebUI restart or a new
+uvicorn worker. It loads the tool file, builds Tools (or the Pipeline and
+its tools) and awaits one recall_memories call, reporting the median of
+each step. Runs are made on a memory directory left by earlier runs and
+on a fresh one. The Pipeline needs the Open WebUI Pipelines blueprints
+and is skipped without them.
+
+With --against, the tool files of a git revision are loaded through
+git show and measured in the same runs, alternating with the working
+tree, and the difference of the totals is printed.
+
+    python benchmarks/startup.py --runs 15
+    python benchmarks/startup.py --runs 15 --against HEAD~1
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOOLS = {
+    "flash": os.path.join(ROOT, "Flash AI v1.2"),
+    "pipeline": os.path.join(ROOT, "Chatmemory V1.2 Pipeline.py"),
+}
+STEPS = ("import", "construct", "first_call")
+
+RUN = r"""
+import asyncio, importlib.machinery, importlib.util, json, sys, time
+path, kind = sys.argv[1], sys.argv[2]
+started = time.perf_counter()
+loader = importlib.machinery.SourceFileLoader("tool", path)
+spec = importlib.util.spec_from_loader("tool", loader)
+tool = importlib.util.module_from_spec(spec)
+loader.exec_module(tool)
+imported = time.perf_counter()
+tools = tool.Tools() if kind == "flash" else tool.Pipeline().tools
+tools.valves.DEBUG = False
+constructed = time.perf_counter()
+asyncio.run(tools.recall_memories())
+called = time.perf_counter()
+print(json.dumps([imported - started, constructed - imported, called - constructed]))
+"""
+
+
+def tool_at(revision: str, kind: str, directory: str) -> str:
+    """Write a tool file as it was at a git revision into directory; return its path."""
+    content = subprocess.run(
+        ["git", "show", f"{revision}:{os.path.relpath(TOOLS[kind], ROOT)}"],
+        cwd=ROOT,
+        capture_output=True,
+        check=True,
+    ).stdout
+    path = os.path.join(directory, re.sub(r"[^\w.-]", "_", f"{kind}@{revision}"))
+    with open(path, "wb") as f:
+        f.write(content)
+    return path
+
+
+def measure(path: str, kind: str, directory: str, fresh: bool) -> dict:
+    """Seconds of each step in one fresh interpreter loading path, run in directory."""
+    if fresh:
+        shutil.rmtree(os.path.join(directory, "memory_dbs"), ignore_errors=True)
+    result = subprocess.run(
+        [sys.executable, "-c", RUN, path, kind],
+        cwd=directory,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return dict(zip(STEPS, json.loads(result.stdout.strip().splitlines()[-1])))
+
+
+def run(
+    kinds=("flash", "pipeline"),
+    runs: int = 15,
+    directory: str = None,
+    against: str = None,
+) -> dict:
+    """Return {name: {"existing"|"fresh": {step: median seconds}}}.
+
+    name is the kind for the working tree and "<kind>@<against>" for the
+    revision, which runs in its own directory so neither reads the other's
+    memory files.
+    """
+    directory = directory or tempfile.mkdtemp(prefix="memory_startup_")
+    report = {}
+    for kind in kinds:
+        sources = {kind: (TOOLS[kind], os.path.join(directory, "current"))}
+        if against:
+            sources[f"{kind}@{against}"] = (
+                tool_at(against, kind, directory),
+                os.path.join(directory, "against"),
+            )
+        try:
+            for path, workdir in sources.values():
+                os.makedirs(workdir, exist_ok=True)
+                measure(path, kind, workdir, fresh=False)  # Leaves files for "existing"
+        except subprocess.CalledProcessError as e:
+            print(f"Skipping {kind}: {e.stderr.strip().splitlines()[-1]}")
+            continue
+        for name in sources:
+            report[name] = {}
+        for label, fresh in (("existing", False), ("fresh", True)):
+            samples = {name: [] for name in sources}
+            for _ in range(runs):  # Alternating, so drift hits both alike
+                for name, (path, workdir) in sources.items():
+                    samples[name].append(measure(path, kind, workdir, fresh))
+            for name in sources:
+                report[name][label] = {
+                    step: statistics.median(sample[step] for sample in samples[name])
+                    for step in STEPS
+                }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=15)
+    parser.add_argument("--tool", choices=sorted(TOOLS), action="append")
+    parser.add_argument("--directory", help="working directory (default: a temp dir)")
+    parser.add_argument(
+        "--against", metavar="REV", help="also measure the tools at a git revision"
+    )
+    args = parser.parse_args()
+
+    report = run(args.tool or sorted(TOOLS), args.runs, args.directory, args.against)
+    width = max(len(name) for name in report) if report else 0
+    for name, labels in report.items():
+        for label, steps in labels.items():
+            print(
+                f"{name:<{width}} {label:<9} "
+                + ", ".join(f"{step} {steps[step] * 1000:.1f} ms" for step in STEPS)
+                + f", total {sum(steps.values()) * 1000:.1f} ms"
+            )
+    for name in report:
+        if "@" in name:
+            continue
+        for label, steps in report[name].items():
+            baseline = sum(report[f"{name}@{args.against}"][label].values())
+            change = sum(steps.values()) - baseline
+            print(
+                f"{name} {label}: {change * 1000:+.1f} ms "
+                f"({change / baseline:+.0%}) against {args.against}"
+            )
+
+
+if __name__ == "__main__":
+    main()
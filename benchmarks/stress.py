@@ -0,0 +1,144 @@
+"""Multi-process stress benchmark for memory files shared by several workers.
+
+Each worker process is spawned and loads the tool on its own, like a
+uvicorn worker would, and runs random switch/delete/add/list operations on
+a few shared files. Every worker also appends numbered memos to shared.db,
+which is never deleted; afterwards every memo a worker was told was added
+must be in shared.db exactly once, otherwise an update was lost.
+
+    python benchmarks/stress.py --processes 8 --operations 300
+"""
+
+import argparse
+import importlib.machinery
+import importlib.util
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOOL_PATH = os.path.join(ROOT, "Flash AI v1.2")
+SHARED_FILE = "shared.db"
+CHURN_FILES = [f"churn{number}.db" for number in range(5)]
+
+
+def load_tool(name: str):
+    """Load the tool file as a fresh module, as each worker process does."""
+    loader = importlib.machinery.SourceFileLoader(name, TOOL_PATH)
+    spec = importlib.util.spec_from_loader(name, loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def worker(number: int, operations: int, directory: str, results) -> None:
+    tool = load_tool(f"flash_ai_worker{number}")
+    memory = tool.MemoryFunctions(db_name=SHARED_FILE, debug=False, directory=directory)
+    rng = random.Random(number)
+    added, errors, refused = [], [], 0
+    started = time.perf_counter()
+    for step in range(operations):
+        choice = rng.random()
+        try:
+            if choice < 0.25:
+                memory.switch_memory_file(rng.choice(CHURN_FILES))
+            elif choice < 0.4:
+                result = memory.delete_memory_file(rng.choice(CHURN_FILES))
+                if "in use by another process" in result:
+                    refused += 1
+                elif not (
+                    "deleted successfully" in result
+                    or "does not exist" in result
+                    or "currently active" in result
+                ):
+                    errors.append(result)
+            elif choice < 0.7:
+                memory.switch_memory_file(SHARED_FILE)
+                memo = f"worker {number} memo {step}"
+                result = memory.add_to_memory("work", memo, "user")
+                if result == "Memory added successfully.":
+                    added.append(memo)
+                else:
+                    errors.append(result)
+            elif choice < 0.85:
+                memory.add_to_memory("work", f"churn {number}-{step}", "user")
+            else:
+                if isinstance(memory.list_memory_files(), dict):
+                    errors.append("list_memory_files failed")
+                memory.get_all_memories()
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+    memory.close_db_connection()
+    results.put((added, errors, refused, time.perf_counter() - started))
+
+
+def run(processes: int = 8, operations: int = 300, directory: str = None) -> dict:
+    """Run the workers and check shared.db for lost or duplicated updates."""
+    directory = directory or tempfile.mkdtemp(prefix="memory_stress_")
+    # Spawned, not forked: a fork can copy SQLite's locks mid-use by a thread.
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    workers = [
+        context.Process(target=worker, args=(number, operations, directory, results))
+        for number in range(processes)
+    ]
+    started = time.perf_counter()
+    for process in workers:
+        process.start()
+    reports = [results.get() for _ in workers]
+    for process in workers:
+        process.join()
+    elapsed = time.perf_counter() - started
+
+    tool = load_tool("flash_ai_stress_check")
+    memory = tool.MemoryFunctions(db_name=SHARED_FILE, debug=False, directory=directory)
+    stored = [entry["memo"] for entry in memory.get_all_memories().values()]
+    memory.close_db_connection()
+    acknowledged = [memo for report in reports for memo in report[0]]
+    missing = set(acknowledged) - set(stored)
+    duplicated = {memo for memo in acknowledged if stored.count(memo) > 1}
+
+    total = processes * operations
+    return {
+        "processes": processes,
+        "operations": total,
+        "seconds": elapsed,
+        "ops_per_second": total / elapsed,
+        "errors": [error for report in reports for error in report[1]],
+        "deletes_refused": sum(report[2] for report in reports),
+        "acknowledged": len(acknowledged),
+        "lost": sorted(missing),
+        "duplicated": sorted(duplicated),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--operations", type=int, default=300)
+    parser.add_argument("--directory", help="memory directory (default: a temp dir)")
+    args = parser.parse_args()
+
+    report = run(args.processes, args.operations, args.directory)
+    print(
+        f"{report['processes']} processes, {report['operations']} operations in "
+        f"{report['seconds']:.2f}s ({report['ops_per_second']:.0f} ops/s)"
+    )
+    print(
+        f"errors={len(report['errors'])} "
+        f"deletes refused (file in use)={report['deletes_refused']} "
+        f"acknowledged adds={report['acknowledged']} "
+        f"lost={len(report['lost'])} duplicated={len(report['duplicated'])}"
+    )
+    for error in report["errors"][:10]:
+        print("  ", error)
+    if report["errors"] or report["lost"] or report["duplicated"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
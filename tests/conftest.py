@@ -0,0 +1,77 @@
+"""Shared fixtures.
+
+The tools are single files without a .py suffix (Open WebUI pastes them in
+as they are), so they are loaded by path instead of imported.
+"""
+
+import importlib.machinery
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FLASH_PATH = os.path.join(ROOT, "Flash AI v1.2")
+PIPELINE_PATH = os.path.join(ROOT, "Chatmemory V1.2 Pipeline.py")
+
+
+def load_module(path: str, name: str):
+    """Load a tool file as a module registered under name."""
+    loader = importlib.machinery.SourceFileLoader(name, path)
+    spec = importlib.util.spec_from_loader(name, loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope="session")
+def flash():
+    """The Flash AI tool module; MemoryFunctions and helpers are shared with the Pipeline."""
+    return load_module(FLASH_PATH, "flash_ai")
+
+
+@pytest.fixture(scope="session")
+def pipeline_module():
+    """The Pipeline module, which needs the Open WebUI Pipelines blueprints."""
+    pytest.importorskip("blueprints.function_calling_blueprint")
+    return load_module(PIPELINE_PATH, "chatmemory_pipeline")
+
+
+@pytest.fixture
+def memory_dir(tmp_path, monkeypatch):
+    """Empty memory directory; the working directory moves there too."""
+    monkeypatch.chdir(tmp_path)
+    return str(tmp_path / "memory_dbs")
+
+
+@pytest.fixture
+def make_memory(flash, memory_dir):
+    """Factory for MemoryFunctions on memory_dir, all closed after the test."""
+    opened = []
+
+    def make(db_name="chat_memory.db", **kwargs):
+        kwargs.setdefault("directory", memory_dir)
+        memory = flash.MemoryFunctions(db_name=db_name, **kwargs)
+        opened.append(memory)
+        return memory
+
+    yield make
+    for memory in opened:
+        memory.close_db_connection()
+    flash.BackgroundReclaimer.shared().wait()
+
+
+@pytest.fixture
+def memory(make_memory):
+    return make_memory()
+
+
+@pytest.fixture
+def tools(flash, make_memory):
+    """Tools bound to a MemoryFunctions on memory_dir, with debug output off."""
+    tools = flash.Tools()
+    tools.valves.DEBUG = False
+    tools.memory = make_memory()
+    return tools
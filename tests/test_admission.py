@@ -0,0 +1,232 @@
+"""Admission control: concurrency limits, the priority queue and overload errors."""
+
+import asyncio
+
+import pytest
+
+
+@pytest.fixture
+def admission(flash):
+    """A fresh controller, not shared with any Tools."""
+    return flash.AdmissionController()
+
+
+async def hold(admission, key, priority, order, release):
+    async with admission.admit(key, priority):
+        order.append((key, priority))
+        await release.wait()
+
+
+def test_queued_calls_run_by_priority_then_arrival(admission):
+    admission.configure(1, 1, 10, 5.0)
+    order = []
+
+    async def scenario():
+        release = asyncio.Event()
+        first = asyncio.create_task(hold(admission, "a", "write", order, release))
+        await asyncio.sleep(0)
+        waiting = [
+            asyncio.create_task(hold(admission, "a", priority, order, release))
+            for priority in ("bulk", "write", "interactive", "bulk")
+        ]
+        await asyncio.sleep(0)
+        assert admission.metrics()["queue_depth"] == 4
+        release.set()
+        await asyncio.gather(first, *waiting)
+
+    asyncio.run(scenario())
+
+    assert [priority for _, priority in order] == [
+        "write",
+        "interactive",
+        "write",
+        "bulk",
+        "bulk",
+    ]
+
+
+def test_busy_file_does_not_block_other_files(admission):
+    admission.configure(2, 1, 10, 5.0)
+    order = []
+
+    async def scenario():
+        release = asyncio.Event()
+        tasks = [asyncio.create_task(hold(admission, "a", "write", order, release))]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(hold(admission, "a", "write", order, release)))
+        tasks.append(asyncio.create_task(hold(admission, "b", "write", order, release)))
+        await asyncio.sleep(0)
+        assert admission.metrics()["active_per_file"] == {"a": 1, "b": 1}
+        release.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+
+    assert [key for key, _ in order] == ["a", "b", "a"]
+
+
+def test_full_queue_rejects_at_once(flash, admission):
+    admission.configure(1, 1, 0, 5.0)
+
+    async def scenario():
+        release = asyncio.Event()
+        running = asyncio.create_task(hold(admission, "a", "write", [], release))
+        await asyncio.sleep(0)
+        with pytest.raises(flash.AdmissionOverloaded, match="1 calls running"):
+            async with admission.admit("a", "interactive"):
+                pass
+        release.set()
+        await running
+
+    asyncio.run(scenario())
+
+    assert admission.metrics()["calls"]["interactive"]["rejected"] == 1
+
+
+def test_wait_longer_than_max_wait_fails(flash, admission):
+    admission.configure(1, 1, 10, 0.05)
+
+    async def scenario():
+        release = asyncio.Event()
+        running = asyncio.create_task(hold(admission, "a", "write", [], release))
+        await asyncio.sleep(0)
+        with pytest.raises(flash.AdmissionOverloaded, match="within 0.05 seconds"):
+            async with admission.admit("a", "bulk"):
+                pass
+        release.set()
+        await running
+
+    asyncio.run(scenario())
+
+    metrics = admission.metrics()
+    assert metrics["calls"]["bulk"]["timed_out"] == 1
+    assert (metrics["queue_depth"], metrics["active"]) == (0, 0)
+
+
+def test_cancelled_waiter_leaves_the_queue(admission):
+    admission.configure(1, 1, 10, 5.0)
+
+    async def scenario():
+        release = asyncio.Event()
+        running = asyncio.create_task(hold(admission, "a", "write", [], release))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(hold(admission, "a", "write", [], release))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert admission.metrics()["queue_depth"] == 0
+        release.set()
+        await running
+
+    asyncio.run(scenario())
+
+    assert admission.metrics()["active"] == 0
+
+
+def test_waiter_cancelled_as_it_is_admitted_gives_the_slot_back(admission):
+    admission.configure(1, 1, 10, 5.0)
+
+    async def scenario():
+        release = asyncio.Event()
+        running = asyncio.create_task(hold(admission, "a", "write", [], release))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(hold(admission, "a", "write", [], release))
+        await asyncio.sleep(0)
+        admission.configure(2, 2, 10, 5.0)  # Admitted, not yet resumed
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert admission.metrics()["active"] == 1
+        release.set()
+        await running
+
+    asyncio.run(scenario())
+
+
+def test_raised_limits_admit_waiters(admission):
+    admission.configure(1, 1, 10, 5.0)
+    order = []
+
+    async def scenario():
+        release = asyncio.Event()
+        tasks = [
+            asyncio.create_task(hold(admission, "a", "write", order, release))
+            for _ in range(3)
+        ]
+        await asyncio.sleep(0)
+        admission.configure(3, 3, 10, 5.0)
+        for _ in range(3):  # Woken through call_soon, then resumed
+            await asyncio.sleep(0)
+        assert len(order) == 3
+        release.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+
+
+def test_nested_calls_reuse_the_slot(admission):
+    admission.configure(1, 1, 0, 5.0)
+
+    async def scenario():
+        async with admission.admit("a", "bulk"):
+            async with admission.admit("a", "write"):
+                return admission.metrics()["active"]
+
+    assert asyncio.run(scenario()) == 1
+
+
+def test_calls_after_an_early_release_are_admitted(flash, admission):
+    admission.configure(1, 1, 0, 5.0)
+
+    async def scenario():
+        async with admission.admit("a", "bulk"):
+            flash.AdmissionController.release_current()
+            assert admission.metrics()["active"] == 0
+            async with admission.admit("a", "write"):
+                return admission.metrics()["active"]
+
+    assert asyncio.run(scenario()) == 1
+    assert admission.metrics()["active"] == 0
+
+
+@pytest.fixture
+def controllers(flash, monkeypatch):
+    """No controllers left over from other tests."""
+    monkeypatch.setattr(flash.AdmissionController, "_controllers", {})
+
+
+def test_tools_keep_their_own_limits(flash, tools, controllers):
+    tools.valves.MAX_CONCURRENT_CALLS = 3
+    other = flash.Tools()
+    other.valves.MAX_CONCURRENT_CALLS = 5
+    alike = flash.Tools()
+    alike.valves.MAX_CONCURRENT_CALLS = 3
+
+    assert tools._admission() is alike._admission()
+    assert tools._admission() is not other._admission()
+    assert tools._admission().metrics()["limits"]["max_concurrent"] == 3
+    assert other._admission().metrics()["limits"]["max_concurrent"] == 5
+
+
+def test_overloaded_tool_call_returns_a_busy_message(tools, controllers):
+    tools.valves.MAX_CONCURRENT_CALLS = 1
+    tools.valves.MAX_QUEUED_CALLS = 0
+    admission = tools._admission()
+
+    async def scenario():
+        release = asyncio.Event()
+        running = asyncio.create_task(
+            hold(admission, tools.memory.db_name, "write", [], release)
+        )
+        await asyncio.sleep(0)
+        result = await tools.recall_memories()
+        metrics = await tools.memory_call_metrics()  # Not admission controlled
+        release.set()
+        await running
+        return result, metrics
+
+    result, metrics = asyncio.run(scenario())
+
+    assert result.startswith("Memory is busy, recall_memories was not run (")
+    assert '"rejected": 1' in metrics
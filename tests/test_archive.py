@@ -0,0 +1,188 @@
+"""Compressed archive tier: moving, reading, searching and dictionaries."""
+
+COMMON = [
+    "User went to the gym in the morning and felt great",
+    "User had coffee with the team in the morning",
+    "User wants to read more books in the evening",
+    "User went for a walk in the park with the dog",
+    "User cooked dinner for the family in the evening",
+    "User likes to read the news in the morning",
+    "User plans to visit the museum with the kids",
+    "User went to the market in the morning",
+    "User watched a movie with the family in the evening",
+    "User wants to learn to cook in the evening",
+]
+
+
+def age_all(memory, stamp="2020-01-01_10:00:00"):
+    memory.conn.execute("UPDATE memories SET last_modified = ?", (stamp,))
+    memory.conn.commit()
+
+
+def test_archive_moves_old_memories_and_reads_them_back(memory):
+    memory.add_to_memory("work", "Quarterly report goes to Dana", "user")
+    age_all(memory)
+    memory.add_to_memory("work", "Fresh memo", "user")
+
+    assert memory.archive_memories(30).startswith("Archived 1 ")
+    assert list(memory.get_all_memories()) == [2]
+    assert memory.retrieve_from_memory(1) == {
+        "index": 1,
+        "tag": "work",
+        "memo": "Quarterly report goes to Dana",
+        "by": "user",
+        "last_modified": "2020-01-01_10:00:00",
+        "archived": True,
+    }
+
+
+def test_recently_read_memories_stay_hot(memory):
+    memory.add_to_memory("work", "Read yesterday", "user")
+    memory.add_to_memory("work", "Read long ago", "user")
+    age_all(memory)
+    memory.conn.execute(
+        "UPDATE memories SET last_accessed = '2020-02-01_10:00:00' WHERE id = 2"
+    )
+    memory.conn.commit()
+    memory.retrieve_from_memory(1)  # Still pending when archiving starts
+
+    assert memory.archive_memories(30).startswith("Archived 1 ")
+    assert list(memory.get_all_memories()) == [1]
+
+
+def test_updating_an_archived_memory_makes_it_hot(memory):
+    memory.add_to_memory("work", "Old memo", "user")
+    age_all(memory)
+    memory.archive_memories(30)
+
+    assert memory.update_memory_by_index(1, "work", "New memo", "user").endswith(
+        "successfully."
+    )
+    assert memory.get_all_memories()[1]["memo"] == "New memo"
+    assert memory.search_archived_memories() == {}
+
+
+def test_keyword_search_only_decompresses_index_matches(memory, monkeypatch):
+    for memo in COMMON + ["Dentist appointment on Tuesday"]:
+        memory.add_to_memory("life", memo, "user")
+    age_all(memory)
+    memory.archive_memories(30)
+
+    decompressed = []
+    original = memory._decompress_memo
+
+    def spy(blob, codec, dict_id):
+        decompressed.append(dict_id)
+        return original(blob, codec, dict_id)
+
+    monkeypatch.setattr(memory, "_decompress_memo", spy)
+    found = memory.search_archived_memories(keyword="dentist")
+    assert [entry["memo"] for entry in found.values()] == [
+        "Dentist appointment on Tuesday"
+    ]
+    assert len(decompressed) == 1
+
+    # Words match by prefix, the whole keyword as text
+    assert len(memory.search_archived_memories(keyword="dent")) == 1
+    assert len(memory.search_archived_memories(keyword="in the morn")) == 4
+    assert memory.search_archived_memories(keyword="morning the") == {}
+    assert len(memory.search_archived_memories(tag="life", keyword="movie")) == 1
+    assert memory.search_archived_memories(tag="work", keyword="movie") == {}
+
+
+def test_dictionary_keeps_no_memo_specific_text(memory):
+    for memo in COMMON:
+        memory.add_to_memory("life", memo, "user")
+    memory.add_to_memory("personal", "SSN is 123-45-6709", "user")
+    memory.add_to_memory("person", "Zebediah is the morning barista", "user")
+    age_all(memory)
+    memory.archive_memories(30)
+
+    dictionaries = memory.conn.execute("SELECT data FROM archive_dicts").fetchall()
+    assert dictionaries
+    for (data,) in dictionaries:
+        assert b"morning" in data
+        for secret in (b"123", b"6709", b"SSN", b"Zebediah", b"barista"):
+            assert secret not in data
+    assert memory.retrieve_from_memory(11)["memo"] == "SSN is 123-45-6709"
+
+
+def test_dictionary_is_retrained_once_stale(memory):
+    for memo in COMMON:
+        memory.add_to_memory("life", memo, "user")
+    age_all(memory)
+    memory.archive_memories(30, batch_size=5)
+    first = memory.conn.execute("SELECT MAX(id) FROM archive_dicts").fetchone()[0]
+
+    memory.conn.execute("UPDATE archive_dicts SET created = '2000-01-01_00:00:00'")
+    memory.conn.commit()
+    for memo in COMMON:
+        memory.add_to_memory("life", memo, "user")
+    age_all(memory)
+    memory.archive_memories(30)
+
+    second = memory.conn.execute("SELECT MAX(id) FROM archive_dicts").fetchone()[0]
+    assert second != first
+    assert len(memory.search_archived_memories(limit=100)) == 20
+
+
+def test_purge_drops_dictionaries_nothing_uses(memory, flash):
+    for memo in COMMON:
+        memory.add_to_memory("life", memo, "user")
+    age_all(memory)
+    memory.archive_memories(30)
+    (trained,) = memory.conn.execute("SELECT id FROM archive_dicts").fetchone()
+    memory.conn.execute("UPDATE archive_dicts SET created = '2000-01-01_00:00:00'")
+    memory.conn.commit()
+    for memo in COMMON:
+        memory.add_to_memory("life", memo, "user")
+    age_all(memory)
+    memory.archive_memories(30)  # Retrains: the first dictionary is no longer current
+
+    memory.clear_memory()
+    flash.BackgroundReclaimer.shared().wait()
+    ids = [row[0] for row in memory.conn.execute("SELECT id FROM archive_dicts")]
+    assert trained in ids  # History versions of the cleared rows still use it
+
+    memory.conn.execute("DELETE FROM memory_history")
+    memory.conn.commit()
+    memory.clear_memory()
+    flash.BackgroundReclaimer.shared().wait()
+    ids = [row[0] for row in memory.conn.execute("SELECT id FROM archive_dicts")]
+    assert trained not in ids and len(ids) == 1
+
+
+def test_migration_reencodes_rows_of_raw_text_dictionaries(make_memory, flash):
+    memory = make_memory()
+    for memo in COMMON:
+        memory.add_to_memory("life", memo, "user")
+    age_all(memory)
+    memory.archive_memories(30)
+    # A dictionary as written before version 6: raw memo text
+    raw = "My PIN is 4321 and my bank is Acme".encode()
+    cursor = memory.conn.execute(
+        "INSERT INTO archive_dicts (codec, data, created) VALUES (?, ?, ?)",
+        (memory.compressor.codec, raw, "2020-01-01_00:00:00"),
+    )
+    old_id = cursor.lastrowid
+    memory.conn.executemany(
+        "UPDATE memories_archive SET memo_blob = ?, dict_id = ? WHERE id = ?",
+        [
+            (memory.compressor.compress(memo, raw), old_id, index)
+            for index, memo in enumerate(COMMON, 1)
+        ],
+    )
+    memory.conn.execute("DELETE FROM archive_terms")
+    memory.conn.execute("DELETE FROM memory_meta WHERE key = 'archive_terms_backfill'")
+    memory.conn.execute("PRAGMA user_version = 5")
+    memory.conn.commit()
+    memory.close_db_connection()
+    flash.MemoryFunctions._schema_checked.clear()
+
+    memory = make_memory()
+
+    datas = [row[0] for row in memory.conn.execute("SELECT data FROM archive_dicts")]
+    assert raw not in datas and all(b"4321" not in data for data in datas)
+    archived = memory.search_archived_memories(limit=100)
+    assert [entry["memo"] for entry in archived.values()] == COMMON
+    assert len(memory.search_archived_memories(keyword="museum")) == 1
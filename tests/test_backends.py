@@ -0,0 +1,188 @@
+"""Behavior every storage backend must share, run against each of them."""
+
+import importlib.util
+import os
+
+import pytest
+
+from conftest import ROOT
+
+BACKENDS = ["sqlite", "appendlog"]
+
+
+@pytest.fixture(params=BACKENDS)
+def backend_memory(request, make_memory):
+    return make_memory(backend=request.param)
+
+
+def memos(memory):
+    return [entry["memo"] for entry in memory.get_all_memories().values()]
+
+
+def test_every_backend_is_covered(flash):
+    assert sorted(flash.STORAGE_BACKENDS) == sorted(BACKENDS)
+
+
+def test_add_update_delete(backend_memory):
+    memory = backend_memory
+    assert memory.add_to_memory("work", "Report due Friday", "user") == (
+        "Memory added successfully."
+    )
+    memory.add_to_memory("hobby", "Plays chess", "LLM")
+    memory.update_memory_by_index(1, "work", "Report due Monday", "user")
+    memory.delete_memory_by_index(2)
+
+    assert memory.retrieve_from_memory(1)["memo"] == "Report due Monday"
+    assert memory.retrieve_from_memory(2) is None
+    assert memos(memory) == ["Report due Monday"]
+    assert memory.has_memory("Report due Monday")
+
+
+def test_bulk_add_and_update(backend_memory):
+    memory = backend_memory
+    memory.add_many_to_memory([("work", f"Task {number}", "user") for number in range(3)])
+
+    result = memory.update_memories_bulk([{"index": 2, "memo": "Task two"}])
+
+    assert result == {2: "Memory index 2 updated successfully."}
+    assert memos(memory) == ["Task 0", "Task two", "Task 2"]
+
+
+def test_rows_survive_reopening(backend_memory, make_memory):
+    backend_memory.add_to_memory("work", "Kept", "user")
+    backend_memory.close_db_connection()
+
+    reopened = make_memory(backend=backend_memory.backend)
+
+    assert memos(reopened) == ["Kept"]
+
+
+def test_clear_hides_rows_and_keeps_ids(backend_memory, make_memory):
+    memory = backend_memory
+    memory.add_to_memory("work", "Old", "user")
+
+    assert memory.clear_memory() == "ALL MEMORIES CLEARED!"
+    assert memory.get_all_memories() == {}
+    memory.add_to_memory("work", "New", "user")
+    memory.close_db_connection()
+
+    reopened = make_memory(backend=memory.backend)
+    assert reopened.get_all_memories().keys() == {2}
+
+
+def test_files_are_listed_with_their_stats(backend_memory, make_memory):
+    backend_memory.add_to_memory("work", "One", "user")
+    backend_memory.add_to_memory("personal", "Two", "user")
+    other = make_memory("other.db", backend=backend_memory.backend)
+    other.add_to_memory("work", "Three", "user")
+    suffix = ".db" if backend_memory.backend == "sqlite" else ".log"
+
+    assert backend_memory.list_memory_files() == [
+        f"chat_memory{suffix}",
+        f"other{suffix}",
+    ]
+    stats = backend_memory.memory_file_stats()[f"chat_memory{suffix}"]
+    assert (stats["rows"], stats["tags"]) == (2, {"work": 1, "personal": 1})
+
+
+def test_memories_about(backend_memory):
+    memory = backend_memory
+    memory.add_to_memory("relationship", "Anna is the user's sister", "user")
+    memory.add_to_memory("work", "User works at Acme", "user")
+
+    assert [entry["memo"] for entry in memory.memories_about("anna").values()] == [
+        "Anna is the user's sister"
+    ]
+
+
+def test_relevant_memories_rank_by_shared_words(backend_memory):
+    memory = backend_memory
+    memory.add_to_memory("wellness", "User is allergic to peanuts", "user")
+    memory.add_to_memory("work", "User works at Acme", "user")
+    memory.add_to_memory("wellness", "User eats peanuts and walnuts", "user")
+    memory.delete_memory_by_index(1)
+
+    assert list(memory.relevant_memories("Peanuts and walnuts, any allergy?")) == [3]
+    assert list(memory.relevant_memories("work stuff")) == [2]
+    assert list(memory.relevant_memories("wellness")) == [3]
+    assert memory.relevant_memories("nothing matches here") == {}
+
+
+def test_history_of_an_updated_and_a_deleted_memory(backend_memory):
+    memory = backend_memory
+    memory.add_to_memory("work", "First", "user")
+    memory.add_to_memory("work", "Gone", "user")
+    memory.update_memory_by_index(1, "work", "Second", "user")
+    memory.delete_memory_by_index(2)
+
+    assert [
+        (version["version"], version["memo"]) for version in memory.memory_history(1)
+    ] == [(1, "First"), ("current", "Second")]
+    assert [
+        (version["memo"], version["deleted"]) for version in memory.memory_history(2)
+    ] == [("Gone", True)]
+
+
+def test_history_after_clear(backend_memory):
+    memory = backend_memory
+    memory.add_to_memory("work", "Cleared", "user")
+    memory.clear_memory()
+
+    (version,) = memory.memory_history(1)
+    assert (version["memo"], version["deleted"]) == ("Cleared", True)
+
+
+def test_delete_file_of_the_backend(backend_memory, make_memory, memory_dir):
+    other = make_memory("other.db", backend=backend_memory.backend)
+    other.add_to_memory("work", "Memo", "user")
+    other.close_db_connection()
+
+    assert backend_memory.delete_memory_file("other.db") == (
+        "File 'other.db' deleted successfully."
+    )
+    assert backend_memory.list_memory_files() == [
+        os.path.basename(backend_memory.db_name)
+    ]
+
+
+def test_sqlite_search_reads_the_word_index(flash, memory, monkeypatch):
+    memory.add_to_memory("work", "Quarterly report goes to Dana", "user")
+    memory.add_to_memory("work", "Lunch with the team", "user")
+    memory.archive_memories(-1)
+    memory.add_to_memory("life", "Plan the quarterly trip", "user")
+    assert list(memory.relevant_memories("quarterly report")) == [3]  # 1 is archived
+    memory.update_memories_bulk([{"index": 1, "tag": "personal"}])  # Restores it
+    monkeypatch.setattr(
+        flash.SQLiteBackend,
+        "scan",
+        lambda *args: pytest.fail("relevant_memories scanned every row"),
+    )
+
+    assert list(memory.relevant_memories("quarterly report")) == [1, 3]
+    memory.delete_memory_by_index(1)
+    assert list(memory.relevant_memories("quarterly report")) == [3]
+    assert memory.conn.execute(
+        "SELECT COUNT(*) FROM memory_terms WHERE memory_id = 1"
+    ).fetchone() == (0,)
+
+
+def test_sqlite_only_features_say_so(make_memory):
+    memory = make_memory(backend="appendlog")
+    message = "Not available with the appendlog storage backend, only with sqlite."
+
+    assert memory.archive_memories(1) == message
+    assert memory.enforce_quota() == message
+    assert memory.memories_as_of("2024-01-01 00:00:00") == {"error": message}
+
+
+def test_backend_benchmark_runs(tmp_path):
+    spec = importlib.util.spec_from_file_location(
+        "backends_benchmark", os.path.join(ROOT, "benchmarks", "backends.py")
+    )
+    benchmark = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(benchmark)
+
+    report = benchmark.run(rows=50, directory=str(tmp_path))
+
+    assert sorted(report) == sorted(BACKENDS)
+    assert all(timings["add"] >= 0 for timings in report.values())
@@ -0,0 +1,99 @@
+"""Throttled online backups of the memory files."""
+
+import asyncio
+import os
+import sqlite3
+
+import pytest
+
+
+@pytest.fixture
+def backups(tools, tmp_path):
+    tools.valves.BACKUP_DIR = str(tmp_path / "backups")
+    tools.valves.BACKUP_KEEP = 2
+    return tools
+
+
+def backup_files(tools):
+    return sorted(
+        name for name in os.listdir(tools.valves.BACKUP_DIR) if name.endswith(".db")
+    )
+
+
+def backed_up_memos(tools, name):
+    with sqlite3.connect(os.path.join(tools.valves.BACKUP_DIR, name)) as conn:
+        return [row[0] for row in conn.execute("SELECT memo FROM live_memories")]
+
+
+def test_backup_copies_every_file(backups, make_memory):
+    backups.memory.add_to_memory("work", "Report due Friday", "user")
+    make_memory("other.db").add_to_memory("personal", "Likes tea", "user")
+
+    message = asyncio.run(backups.backup_memory_files())
+
+    assert message == (
+        f"Backed up 2 changed memory files to {backups.valves.BACKUP_DIR}."
+    )
+    chat, other = backup_files(backups)
+    assert chat.startswith("chat_memory.") and other.startswith("other.")
+    assert backed_up_memos(backups, chat) == ["Report due Friday"]
+    assert backed_up_memos(backups, other) == ["Likes tea"]
+
+
+def test_unchanged_files_are_skipped_and_old_backups_pruned(backups):
+    backups.memory.add_to_memory("work", "First", "user")
+    asyncio.run(backups.backup_memory_files())
+
+    assert asyncio.run(backups.backup_memory_files()).startswith("Backed up 0 ")
+    for memo in ("Second", "Third"):
+        backups.memory.add_to_memory("work", memo, "user")
+        asyncio.run(backups.backup_memory_files())
+
+    first, second = backup_files(backups)  # BACKUP_KEEP of them
+    assert backed_up_memos(backups, second) == ["First", "Second", "Third"]
+    assert backed_up_memos(backups, first) == ["First", "Second"]
+
+
+def test_unreadable_file_is_reported_and_retried(backups, memory_dir):
+    backups.memory.add_to_memory("work", "Report due Friday", "user")
+    with open(os.path.join(memory_dir, "broken.db"), "wb") as f:
+        f.write(b"not a database" * 100)
+
+    message = asyncio.run(backups.backup_memory_files())
+
+    assert message.startswith(
+        f"Backed up 1 changed memory files to {backups.valves.BACKUP_DIR}. Failed: broken.db: "
+    )
+    assert [name.split(".")[0] for name in backup_files(backups)] == ["chat_memory"]
+    assert "broken.db" in asyncio.run(backups.backup_memory_files())  # Not skipped
+
+
+def test_copy_restarted_by_writers_goes_unthrottled(flash, memory_dir):
+    scheduler = flash.BackupScheduler(memory_dir)
+    scheduler.STEP_SLEEP = 0
+    progress = scheduler._throttle()
+
+    progress(0, 10, 20)
+    for _ in range(scheduler.MAX_RESTARTS - 1):
+        progress(0, 20, 20)  # A write restarted the copy
+        progress(0, 10, 20)
+    with pytest.raises(flash._BackupRestarted):
+        progress(0, 20, 20)
+
+
+def test_scheduled_backups_follow_the_interval_valve(backups, flash):
+    backups.memory.add_to_memory("work", "Report due Friday", "user")
+    scheduler = flash.BackupScheduler.for_directory(backups.memory.directory)
+    backups.valves.BACKUP_INTERVAL_MINUTES = 60
+
+    asyncio.run(backups.current_memory_file())  # Any call applies the valves
+    for _ in range(100):  # The first pass runs at once
+        if os.path.isdir(backups.valves.BACKUP_DIR) and backup_files(backups):
+            break
+        scheduler._thread.join(timeout=0.05)
+
+    assert len(backup_files(backups)) == 1
+    backups.valves.BACKUP_INTERVAL_MINUTES = 0
+    asyncio.run(backups.current_memory_file())
+    scheduler._thread.join(timeout=5)
+    assert not scheduler._thread.is_alive()
@@ -0,0 +1,102 @@
+"""Bulk adds and sparse bulk updates, including while the file is locked."""
+
+import sqlite3
+
+import pytest
+
+
+@pytest.fixture
+def other(memory_dir):
+    """Connection of another process, to lock chat_memory.db with BEGIN EXCLUSIVE."""
+    other = sqlite3.connect(f"{memory_dir}/chat_memory.db", isolation_level=None)
+    yield other
+    if other.in_transaction:
+        other.rollback()
+    other.close()
+
+
+def rows(memory):
+    return {
+        index: (entry["tag"], entry["memo"], entry["by"])
+        for index, entry in memory.get_all_memories().items()
+    }
+
+
+def test_patches_change_only_the_given_fields(memory):
+    memory.add_many_to_memory([("work", "Report", "user"), ("personal", "Tea", "LLM")])
+
+    results = memory.update_memories_bulk(
+        [
+            {"index": 1, "memo": "Report due Friday"},
+            {"index": 1, "tag": "reminder"},
+            {"index": 2, "tag": "no such tag", "by": "user"},
+            {"index": 3, "memo": "Missing"},
+            {"index": 2},
+            {"memo": "No index"},
+        ]
+    )
+
+    assert results == {
+        1: "Memory index 1 updated successfully.",
+        2: "Memory index 2 updated successfully.",
+        3: "Memory index 3 does not exist.",
+        "patch 6": "Patch has no valid index.",
+    }
+    assert rows(memory) == {
+        1: ("reminder", "Report due Friday", "user"),
+        2: ("others", "Tea", "user"),
+    }
+
+
+def test_patches_to_a_locked_file_are_spooled_and_replayed(memory, other):
+    memory.add_many_to_memory([("work", "Report", "user"), ("personal", "Tea", "LLM")])
+    other.execute("BEGIN EXCLUSIVE")
+
+    results = memory.update_memories_bulk(
+        [{"index": 1, "memo": "Report due Friday"}, {"index": 2, "tag": "wellness"}]
+    )
+
+    assert list(results) == [1, 2]
+    assert all(
+        message.startswith("Memory update queued") for message in results.values()
+    )
+    other.rollback()
+    memory.add_to_memory("work", "After", "user")  # Replays the spool first
+    assert rows(memory) == {
+        1: ("work", "Report due Friday", "user"),
+        2: ("wellness", "Tea", "LLM"),
+        3: ("work", "After", "user"),
+    }
+
+
+def test_failed_patches_are_reported_per_row(memory, monkeypatch):
+    memory.add_to_memory("work", "Report", "user")
+
+    def broken(patches, last_modified):
+        raise sqlite3.IntegrityError("constraint failed")
+
+    monkeypatch.setattr(memory.store, "update_many", broken)
+
+    assert memory.update_memories_bulk([{"index": 1, "memo": "x"}]) == {
+        1: "Database error updating memory index 1: constraint failed"
+    }
+
+
+def test_bulk_adds_to_a_locked_file_are_spooled_and_replayed(memory, other):
+    memory.add_to_memory("work", "First", "user")
+    other.execute("BEGIN EXCLUSIVE")
+
+    messages = memory.add_many_to_memory(
+        [("personal", "Tea", "LLM"), ("no such tag", "Chess", "user")]
+    )
+
+    assert len(messages) == 2
+    assert all(message.startswith("Memory add queued") for message in messages)
+    other.rollback()
+    memory.add_to_memory("work", "After", "user")
+    assert rows(memory) == {
+        1: ("work", "First", "user"),
+        2: ("personal", "Tea", "LLM"),
+        3: ("others", "Chess", "user"),
+        4: ("work", "After", "user"),
+    }
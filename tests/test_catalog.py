@@ -0,0 +1,55 @@
+"""MemoryCatalog: cached file listing and per-file statistics."""
+
+
+def test_list_memory_files_returns_sorted_db_names(make_memory, memory_dir):
+    memory = make_memory("b.db")
+    make_memory("a.db")
+    open(f"{memory_dir}/notes.txt", "w").close()
+
+    assert memory.list_memory_files() == ["a.db", "b.db"]
+
+
+def test_listing_picks_up_new_and_deleted_files(make_memory, flash):
+    memory = make_memory("a.db")
+    assert memory.list_memory_files() == ["a.db"]
+
+    make_memory("c.db").close_db_connection()
+    assert memory.list_memory_files() == ["a.db", "c.db"]
+
+    memory.delete_memory_file("c.db")
+    assert memory.list_memory_files() == ["a.db"]
+
+
+def test_stats_report_rows_tags_and_archive(memory):
+    memory.add_to_memory("work", "Project deadline is Friday", "user")
+    memory.add_to_memory("work", "Standup moved to 10am", "user")
+    memory.add_to_memory("personal", "Likes green tea", "LLM")
+
+    stats = memory.memory_file_stats()["chat_memory.db"]
+
+    assert stats["rows"] == 3
+    assert stats["tags"] == {"work": 2, "personal": 1}
+    assert stats["archived"] == 0
+    assert stats["bytes"] > 0
+    assert stats["last_modified"]
+
+
+def test_stats_only_recollect_changed_files(make_memory, monkeypatch, flash):
+    first = make_memory("a.db")
+    make_memory("b.db")
+    first.memory_file_stats()
+
+    collected = []
+    original = flash.MemoryCatalog._collect
+
+    def spy(self, name, signature):
+        collected.append(name)
+        return original(self, name, signature)
+
+    monkeypatch.setattr(flash.MemoryCatalog, "_collect", spy)
+    assert first.memory_file_stats()["a.db"]["rows"] == 0
+    assert collected == []
+
+    first.add_to_memory("work", "New row", "user")
+    assert first.memory_file_stats()["a.db"]["rows"] == 1
+    assert collected == ["a.db"]
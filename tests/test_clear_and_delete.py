@@ -0,0 +1,127 @@
+"""Constant-time clear and file deletion with background reclamation."""
+
+import os
+import sqlite3
+
+
+def physical_rows(memory):
+    return memory.conn.execute("SELECT COUNT(*) FROM memories").fetchone()[0]
+
+
+def test_clear_hides_rows_at_once_and_reclaims_them_later(memory, flash, monkeypatch):
+    for number in range(3):
+        memory.add_to_memory("work", f"Memo {number}", "user")
+    monkeypatch.setattr(memory, "_reclaim_cleared_rows", lambda: None)
+
+    assert memory.clear_memory() == "ALL MEMORIES CLEARED!"
+    assert memory.get_all_memories() == {}
+    assert physical_rows(memory) == 3
+
+    memory.add_to_memory("work", "After the clear", "user")
+    assert list(memory.get_all_memories()) == [4]
+
+    monkeypatch.undo()
+    memory._reclaim_cleared_rows()
+    flash.BackgroundReclaimer.shared().wait()
+    assert physical_rows(memory) == 1
+
+
+def test_reopening_finishes_an_interrupted_reclaim(make_memory, flash, monkeypatch):
+    memory = make_memory()
+    memory.add_to_memory("work", "Memo", "user")
+    monkeypatch.setattr(flash.MemoryFunctions, "_reclaim_cleared_rows", lambda self: None)
+    memory.clear_memory()
+    memory.close_db_connection()  # The process exits before the reclaim
+    monkeypatch.undo()
+    flash.MemoryFunctions._schema_checked.clear()
+
+    memory = make_memory()
+    flash.BackgroundReclaimer.shared().wait()
+    assert physical_rows(memory) == 0
+
+
+def test_reclaimed_rows_are_deleted_as_of_the_clear(memory, flash, monkeypatch):
+    memory.add_to_memory("work", "Memo", "user")
+    memory.archive_memories(-1)  # Archive it too
+    memory.add_to_memory("life", "Hot memo", "user")
+    monkeypatch.setattr(memory, "_reclaim_cleared_rows", lambda: None)
+    memory.clear_memory()
+    # The reclaim is delayed long after the clear
+    memory.conn.execute("UPDATE memory_clears SET cleared_at = '2021-05-01_12:00:00'")
+    memory.conn.commit()
+
+    monkeypatch.undo()
+    memory._reclaim_cleared_rows()
+    flash.BackgroundReclaimer.shared().wait()
+
+    tombstones = memory.conn.execute(
+        "SELECT memory_id, valid_to, deleted FROM memory_history ORDER BY memory_id"
+    ).fetchall()
+    assert tombstones == [(1, "2021-05-01_12:00:00", 1), (2, "2021-05-01_12:00:00", 1)]
+
+
+def test_clear_time_replicates(make_memory, memory_dir, flash):
+    leader = make_memory(directory=memory_dir + "_leader")
+    follower = make_memory(directory=memory_dir + "_follower")
+    leader.add_to_memory("work", "Memo", "user")
+    leader.clear_memory()
+    (cleared_at,) = leader.conn.execute(
+        "SELECT cleared_at FROM memory_clears"
+    ).fetchone()
+
+    follower.sync_from(leader, source="leader")
+    flash.BackgroundReclaimer.shared().wait()
+
+    assert follower.conn.execute(
+        "SELECT cleared_through, cleared_at FROM memory_clears"
+    ).fetchall() == [(1, cleared_at)]
+    assert follower.conn.execute("SELECT valid_to FROM memory_history").fetchall() == [
+        (cleared_at,)
+    ]
+
+
+def test_delete_memory_file_moves_it_to_the_trash(make_memory, memory_dir, flash):
+    memory = make_memory()
+    other = make_memory("other.db")
+    other.add_to_memory("work", "Memo", "user")
+    other.close_db_connection()
+
+    assert memory.delete_memory_file("other.db") == (
+        "File 'other.db' deleted successfully."
+    )
+    assert not os.path.exists(os.path.join(memory_dir, "other.db"))
+    flash.BackgroundReclaimer.shared().wait()
+    assert not [
+        name
+        for name in os.listdir(os.path.join(memory_dir, ".trash"))
+        if name.startswith("other.db")
+    ]
+
+
+def test_delete_memory_file_refuses_files_in_use(make_memory):
+    memory = make_memory()
+    make_memory("busy.db")  # Holds its shared lock, like another worker would
+
+    assert "in use by another process" in memory.delete_memory_file("busy.db")
+    assert "currently active" in memory.delete_memory_file("chat_memory.db")
+    assert "does not exist" in memory.delete_memory_file("missing.db")
+
+
+def test_delete_memory_file_takes_its_spooled_writes(make_memory, memory_dir):
+    memory = make_memory()
+    other = make_memory("other.db")
+    locker = sqlite3.connect(f"{memory_dir}/other.db", isolation_level=None)
+    locker.execute("BEGIN EXCLUSIVE")
+    assert other.add_to_memory("work", "Spooled", "user").startswith(
+        "Memory add queued"
+    )
+    locker.rollback()
+    locker.close()
+    other.close_db_connection()
+    assert os.path.exists(os.path.join(memory_dir, "other.spool"))
+
+    memory.delete_memory_file("other.db")
+
+    assert sorted(os.listdir(memory_dir)) == [".locks", ".trash", "chat_memory.db"]
+    recreated = make_memory("other.db")  # Does not replay the old file's writes
+    assert recreated.get_all_memories() == {}
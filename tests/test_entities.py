@@ -0,0 +1,101 @@
+"""Entity extraction and the entity index behind memories_about."""
+
+import asyncio
+import json
+import sqlite3
+
+import pytest
+
+
+def about(memory, entity):
+    return sorted(entry["memo"] for entry in memory.memories_about(entity).values())
+
+
+@pytest.mark.parametrize(
+    "text, entities",
+    [
+        ("User met Anna Smith at Acme", {"anna smith", "anna", "smith", "acme"}),
+        ("My sister's birthday is in May", {"sister"}),
+        ("User called Bob's boss on Monday", {"bob", "boss"}),
+        ("The user likes tea", set()),
+    ],
+)
+def test_extractor(flash, text, entities):
+    assert flash.EntityExtractor().extract(text) == entities
+
+
+def test_lookup_by_name_part_relationship_and_possessive(memory):
+    memory.add_to_memory("relationship", "Anna Smith is the user's sister", "user")
+    memory.add_to_memory("work", "User works with Bob at Acme", "user")
+
+    assert about(memory, "Anna") == ["Anna Smith is the user's sister"]
+    assert about(memory, "anna smith") == ["Anna Smith is the user's sister"]
+    assert about(memory, "Sister") == ["Anna Smith is the user's sister"]
+    assert about(memory, "Bob's") == ["User works with Bob at Acme"]
+    assert memory.memories_about("Carol") == {}
+
+
+def test_index_follows_updates_and_deletes(memory):
+    memory.add_to_memory("relationship", "Anna is the user's sister", "user")
+    memory.add_to_memory("work", "Bob is the user's boss", "user")
+
+    memory.update_memory_by_index(
+        1, "relationship", "Maria is the user's sister", "user"
+    )
+    memory.delete_memory_by_index(2)
+
+    assert about(memory, "anna") == []
+    assert about(memory, "maria") == ["Maria is the user's sister"]
+    assert about(memory, "bob") == []
+    assert memory.conn.execute(
+        "SELECT COUNT(*) FROM memory_entities WHERE memory_id = 2"
+    ).fetchone() == (0,)
+
+
+def test_archived_memories_are_found(memory):
+    memory.add_to_memory("relationship", "Anna is the user's sister", "user")
+    memory.archive_memories(-1)
+
+    (entry,) = memory.memories_about("anna").values()
+    assert (entry["memo"], entry["archived"]) == ("Anna is the user's sister", True)
+
+
+def test_existing_files_are_indexed_on_open(make_memory, flash):
+    memory = make_memory()
+    memory.add_to_memory("relationship", "Anna is the user's sister", "user")
+    memory.archive_memories(-1)
+    memory.add_to_memory("work", "Bob is the user's boss", "user")
+    memory.conn.executescript(
+        """
+        DROP TABLE memory_entities;
+        DELETE FROM memory_meta WHERE key LIKE 'entity_backfill_%';
+        PRAGMA user_version = 3;
+        """
+    )
+    memory.close_db_connection()
+    flash.MemoryFunctions._schema_checked.clear()
+
+    reopened = make_memory()
+
+    assert about(reopened, "anna") == ["Anna is the user's sister"]
+    assert about(reopened, "boss") == ["Bob is the user's boss"]
+
+
+def test_locked_file_reports_an_error(memory, memory_dir):
+    memory.add_to_memory("relationship", "Anna is the user's sister", "user")
+    memory.conn.execute("PRAGMA busy_timeout = 0")
+    other = sqlite3.connect(f"{memory_dir}/chat_memory.db", isolation_level=None)
+    other.execute("BEGIN EXCLUSIVE")
+    try:
+        result = memory.memories_about("anna")
+    finally:
+        other.rollback()
+        other.close()
+
+    assert result == {"error": "Database error: database is locked"}
+
+
+def test_tool_reports_no_match(tools):
+    result = asyncio.run(tools.memories_about("Carol"))
+
+    assert json.loads(result) == {"message": "No memory about Carol found."}
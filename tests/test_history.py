@@ -0,0 +1,151 @@
+"""Version history, time-travel reads and history compaction."""
+
+import datetime
+import types
+
+import pytest
+
+
+@pytest.fixture
+def clock(flash, monkeypatch):
+    """Set the time the memory module sees with clock.set("YYYY-MM-DD HH:MM:SS")."""
+
+    class Clock(datetime.datetime):
+        now_value = None
+
+        @classmethod
+        def now(cls, tz=None):
+            return cls.now_value
+
+    state = types.SimpleNamespace()
+
+    def set_time(text):
+        Clock.now_value = datetime.datetime.fromisoformat(text)
+
+    state.set = set_time
+    monkeypatch.setattr(
+        flash,
+        "datetime",
+        types.SimpleNamespace(datetime=Clock, timedelta=datetime.timedelta),
+    )
+    return state
+
+
+def without_reclaim(memory, monkeypatch):
+    """Simulate a reclaim that has not run yet, e.g. as the process exited."""
+    monkeypatch.setattr(memory, "_reclaim_cleared_rows", lambda: None)
+
+
+def reclaim(memory, flash, monkeypatch):
+    monkeypatch.undo()
+    memory._reclaim_cleared_rows()
+    flash.BackgroundReclaimer.shared().wait()
+
+
+def test_update_and_delete_keep_previous_versions(memory, clock):
+    clock.set("2024-01-01 10:00:00")
+    memory.add_to_memory("work", "Meeting on Monday", "user")
+    clock.set("2024-01-01 11:00:00")
+    memory.update_memory_by_index(1, "work", "Meeting on Tuesday", "LLM")
+
+    history = memory.memory_history(1)
+    assert [(entry["version"], entry["memo"]) for entry in history] == [
+        (1, "Meeting on Monday"),
+        ("current", "Meeting on Tuesday"),
+    ]
+    assert history[0]["valid_to"] == "2024-01-01_11:00:00"
+
+    memory.delete_memory_by_index(1)
+    history = memory.memory_history(1)
+    assert [entry["deleted"] for entry in history] == [False, True]
+    assert history[-1]["memo"] == "Meeting on Tuesday"
+
+
+def test_memories_as_of_returns_past_versions(memory, clock):
+    clock.set("2024-01-01 10:00:00")
+    memory.add_to_memory("work", "Meeting on Monday", "user")
+    clock.set("2024-01-01 11:00:00")
+    memory.update_memory_by_index(1, "work", "Meeting on Tuesday", "LLM")
+
+    assert memory.memories_as_of("2024-01-01 09:00:00") == {}
+    assert memory.memories_as_of("2024-01-01 10:30:00")[1]["memo"] == (
+        "Meeting on Monday"
+    )
+    assert memory.memories_as_of("2024-01-01 11:30:00")[1]["memo"] == (
+        "Meeting on Tuesday"
+    )
+    assert "error" in memory.memories_as_of("yesterday")
+
+
+@pytest.mark.parametrize("reclaimed", [False, True])
+def test_clear_then_as_of_and_history(memory, flash, clock, monkeypatch, reclaimed):
+    clock.set("2024-01-01 10:00:00")
+    memory.add_to_memory("work", "First", "user")
+    clock.set("2024-01-01 10:05:00")
+    memory.add_to_memory("life", "Second", "LLM")
+    memory.archive_memories(-1, batch_size=1)  # One of them archived
+    memory.update_memory_by_index(2, "life", "Second", "LLM")
+    without_reclaim(memory, monkeypatch)
+    clock.set("2024-01-01 10:10:00")
+    memory.clear_memory()
+    clock.set("2024-01-01 12:00:00")  # The reclaim runs much later, if at all
+    if reclaimed:
+        reclaim(memory, flash, monkeypatch)
+
+    assert list(memory.memories_as_of("2024-01-01 10:02:00")) == [1]
+    assert memory.memories_as_of("2024-01-01 10:06:00") == {
+        1: {
+            "tag": "work",
+            "memo": "First",
+            "by": "user",
+            "last_modified": "2024-01-01_10:00:00",
+        },
+        2: {
+            "tag": "life",
+            "memo": "Second",
+            "by": "LLM",
+            "last_modified": "2024-01-01_10:05:00",
+        },
+    }
+    assert memory.memories_as_of("2024-01-01 10:11:00") == {}
+
+    history = memory.memory_history(1)
+    assert [
+        (entry["memo"], entry["valid_to"], entry["deleted"]) for entry in history
+    ] == [("First", "2024-01-01_10:10:00", True)]
+    assert history[-1]["version"] == 1
+    assert memory.memory_history(2)[-1]["valid_to"] == "2024-01-01_10:10:00"
+
+
+def test_history_while_the_reclaim_runs(make_memory):
+    # The reclaim starts right after the clear; history must see the row
+    # either as cleared or as a tombstone, never neither.
+    for number in range(25):
+        memory = make_memory(f"race{number}.db")
+        memory.add_to_memory("work", "Cleared", "user")
+        memory.clear_memory()
+
+        assert [entry["memo"] for entry in memory.memory_history(1)] == ["Cleared"]
+
+
+def test_compaction_prunes_and_delta_encodes(memory, clock):
+    long_memo = "The quarterly planning notes cover hiring, budget and travel. " * 5
+    clock.set("2024-01-01 10:00:00")
+    memory.add_to_memory("work", long_memo, "user")
+    for minute in range(1, 6):
+        clock.set(f"2024-01-01 10:0{minute}:00")
+        memory.update_memory_by_index(1, "work", long_memo + str(minute), "user")
+
+    clock.set("2024-01-02 10:00:00")
+    message = memory.compact_history(retention_days=30, keep_versions=3)
+
+    assert message.startswith("History compacted: 2 old versions removed")
+    history = memory.memory_history(1)
+    assert [entry["memo"] for entry in history] == [
+        long_memo + "2",
+        long_memo + "3",
+        long_memo + "4",
+        long_memo + "5",
+    ]
+    codecs = memory.conn.execute("SELECT codec FROM memory_history").fetchall()
+    assert ("delta",) in codecs
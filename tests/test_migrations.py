@@ -0,0 +1,242 @@
+"""Schema versioning with PRAGMA user_version and lazy per-file migrations."""
+
+import sqlite3
+
+import pytest
+
+
+@pytest.fixture
+def statements(flash, monkeypatch):
+    """SQL run on connections opened from now on."""
+    seen = []
+    original = flash.MemoryFunctions._open_connection
+
+    def traced(self):
+        conn = original(self)
+        conn.set_trace_callback(seen.append)
+        return conn
+
+    monkeypatch.setattr(flash.MemoryFunctions, "_open_connection", traced)
+    return seen
+
+
+def set_version(memory, version):
+    memory.conn.execute(f"PRAGMA user_version = {version}")
+    memory.conn.commit()
+    memory.close_db_connection()
+
+
+def version_2_file(make_memory, flash, monkeypatch):
+    """A file written before tags and authors were interned."""
+    monkeypatch.setattr(flash.MemoryFunctions, "SCHEMA_VERSION", 2)
+    memory = make_memory()
+    memory.conn.executemany(
+        "INSERT INTO memories (tag, memo, by_who, last_modified) VALUES (?, ?, ?, ?)",
+        [
+            ("work", "Report due Friday", "user", "2024-01-01_10:00:00"),
+            ("hobby", "Plays chess", "LLM", "2024-01-02_10:00:00"),
+        ],
+    )
+    memory.conn.commit()
+    memory.close_db_connection()
+    monkeypatch.undo()
+    flash.MemoryFunctions._schema_checked.clear()
+
+
+def test_up_to_date_file_costs_one_pragma_read(make_memory, flash, statements):
+    set_version(make_memory(), flash.MemoryFunctions.SCHEMA_VERSION)
+    flash.MemoryFunctions._schema_checked.clear()
+    statements.clear()
+
+    make_memory()
+
+    assert statements == ["PRAGMA user_version"]
+
+
+def test_interning_migration_converts_rows_without_history(
+    make_memory, flash, monkeypatch
+):
+    version_2_file(make_memory, flash, monkeypatch)
+
+    memory = make_memory()
+
+    assert memory.conn.execute("PRAGMA user_version").fetchone()[0] == (
+        flash.MemoryFunctions.SCHEMA_VERSION
+    )
+    assert {
+        index: (e["tag"], e["by"]) for index, e in memory.get_all_memories().items()
+    } == {
+        1: ("work", "user"),
+        2: ("hobby", "LLM"),
+    }
+    assert memory.conn.execute(
+        "SELECT COUNT(*) FROM memories WHERE tag IS NOT NULL OR by_who IS NOT NULL"
+    ).fetchone() == (0,)
+    assert memory.conn.execute("SELECT COUNT(*) FROM memory_history").fetchone() == (0,)
+    assert [
+        row[0] for row in memory.conn.execute("SELECT op FROM memory_changelog")
+    ] == [
+        "insert",
+        "insert",
+    ]
+
+
+def test_writers_wait_while_the_triggers_are_swapped(
+    make_memory, flash, memory_dir, monkeypatch
+):
+    version_2_file(make_memory, flash, monkeypatch)
+    path = f"{memory_dir}/chat_memory.db"
+    attempts = []
+
+    def write_from_another_process(statement):
+        if statement.lstrip().startswith("DROP TRIGGER IF EXISTS memories_log_insert"):
+            other = sqlite3.connect(path, timeout=0)
+            try:
+                other.execute(
+                    "INSERT INTO memories (memo, last_modified) VALUES ('x', 'now')"
+                )
+                attempts.append("written")
+            except sqlite3.OperationalError as e:
+                attempts.append(str(e))
+            finally:
+                other.close()
+
+    original = flash.MemoryFunctions._open_connection
+
+    def traced(self):
+        conn = original(self)
+        conn.set_trace_callback(write_from_another_process)
+        return conn
+
+    monkeypatch.setattr(flash.MemoryFunctions, "_open_connection", traced)
+    memory = make_memory()
+    monkeypatch.undo()
+
+    assert attempts == ["database is locked"] * 2  # Before and after the conversion
+    with sqlite3.connect(path) as other:  # Logged once the migration is done
+        other.execute("INSERT INTO memories (memo, last_modified) VALUES ('x', 'now')")
+    assert memory.conn.execute(
+        "SELECT op, memory_id FROM memory_changelog ORDER BY seq DESC LIMIT 1"
+    ).fetchone() == ("insert", 3)
+
+
+def test_writes_between_conversion_batches_are_logged(
+    make_memory, flash, memory_dir, monkeypatch
+):
+    monkeypatch.setattr(flash.MemoryFunctions, "SCHEMA_VERSION", 2)
+    memory = make_memory()
+    memory.conn.executemany(
+        "INSERT INTO memories (tag, memo, by_who, last_modified) VALUES (?, ?, ?, ?)",
+        [
+            ("work", f"Memo {number}", "user", "2024-01-01_10:00:00")
+            for number in range(1200)
+        ],
+    )
+    memory.conn.commit()
+    memory.close_db_connection()
+    monkeypatch.undo()
+    flash.MemoryFunctions._schema_checked.clear()
+    path = f"{memory_dir}/chat_memory.db"
+    converted = []
+
+    def write_between_batches(statement):
+        if "SELECT MAX(id) FROM" in statement and not converted:
+            with sqlite3.connect(path, timeout=0) as other:
+                converted.append(
+                    other.execute(
+                        "SELECT COUNT(*) FROM memories WHERE tag IS NULL"
+                    ).fetchone()[0]
+                )
+                if converted[0]:
+                    other.execute(
+                        """
+                        UPDATE memories SET memo = 'Changed', last_modified = 'later'
+                        WHERE id = 1100
+                        """
+                    )
+                    other.execute(
+                        """
+                        INSERT INTO memories (tag_id, memo, by_id, last_modified)
+                        VALUES ((SELECT id FROM tags WHERE name = 'personal'), 'New',
+                                (SELECT id FROM authors WHERE name = 'user'), 'now')
+                        """
+                    )
+                else:
+                    converted.clear()  # The first batch is not done yet
+
+    original = flash.MemoryFunctions._open_connection
+
+    def traced(self):
+        conn = original(self)
+        conn.set_trace_callback(write_between_batches)
+        return conn
+
+    monkeypatch.setattr(flash.MemoryFunctions, "_open_connection", traced)
+    memory = make_memory()
+    monkeypatch.undo()
+
+    assert converted == [500]  # Committed batch by batch
+    assert memory.conn.execute(
+        "SELECT op, memory_id, tag, memo FROM memory_changelog WHERE memory_id > 1200"
+        " OR op = 'update'"
+    ).fetchall() == [
+        ("update", 1100, "work", "Changed"),
+        ("insert", 1201, "personal", "New"),
+    ]
+    assert [
+        (version["version"], version["tag"], version["memo"])
+        for version in memory.memory_history(1100)
+    ] == [(1, "work", "Memo 1099"), ("current", "work", "Changed")]
+    assert memory.conn.execute(
+        "SELECT COUNT(*) FROM memories WHERE tag IS NOT NULL OR by_who IS NOT NULL"
+    ).fetchone() == (0,)
+    assert memory.conn.execute("SELECT COUNT(*) FROM memory_history").fetchone() == (1,)
+
+
+def test_open_waits_out_another_migrator(make_memory, flash, memory_dir, monkeypatch):
+    memory = make_memory()
+    memory.add_to_memory("work", "Before", "user")
+    set_version(memory, flash.MemoryFunctions.SCHEMA_VERSION - 1)
+    flash.MemoryFunctions._schema_checked.clear()
+    migrator = flash.FileLock(f"{memory_dir}/.locks/chat_memory.db.migrate.lock")
+    assert migrator.acquire()
+    monkeypatch.setattr(flash.MemoryFunctions, "MIGRATE_LOCK_WAIT", 0.05)
+
+    memory = make_memory()
+    assert memory.conn is None  # Not used on a partly migrated schema
+    assert memory.add_to_memory("work", "During", "user").startswith(
+        "Memory add queued"
+    )
+    with sqlite3.connect(f"{memory_dir}/chat_memory.db") as conn:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == (
+            flash.MemoryFunctions.SCHEMA_VERSION - 1
+        )
+
+    migrator.release()
+    assert memory.add_to_memory("work", "After", "user") == "Memory added successfully."
+    assert [entry["memo"] for entry in memory.get_all_memories().values()] == [
+        "Before",
+        "During",
+        "After",
+    ]
+    assert memory.conn.execute("PRAGMA user_version").fetchone()[0] == (
+        flash.MemoryFunctions.SCHEMA_VERSION
+    )
+
+
+def test_word_index_is_backfilled_on_open(make_memory, flash):
+    memory = make_memory()
+    memory.add_to_memory("work", "Report due Friday", "user")
+    memory.conn.executescript(
+        """
+        DROP TABLE memory_terms;
+        DELETE FROM memory_meta WHERE key = 'terms_backfill';
+        PRAGMA user_version = 7;
+        """
+    )
+    memory.close_db_connection()
+    flash.MemoryFunctions._schema_checked.clear()
+
+    reopened = make_memory()
+
+    assert list(reopened.relevant_memories("friday report")) == [1]
@@ -0,0 +1,107 @@
+"""Pipeline inlet/outlet memory hooks and the rule-based extractor.
+
+Skipped unless the Open WebUI Pipelines blueprints are importable.
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def pipeline(pipeline_module, make_memory, monkeypatch):
+    async def prepared(self, body, user=None):
+        return body  # The blueprint's own function-calling request
+
+    monkeypatch.setattr(pipeline_module.FunctionCallingBlueprint, "inlet", prepared)
+    pipeline = pipeline_module.Pipeline()
+    pipeline.valves.DEBUG = False
+    pipeline.tools.memory = make_memory()
+    return pipeline
+
+
+def user_turn(text):
+    return {"messages": [{"role": "user", "content": text}]}
+
+
+@pytest.mark.parametrize(
+    "text, facts",
+    [
+        ("My name is Anna Smith.", [("personal", "User's name is Anna Smith")]),
+        ("my sister is Maria", [("relationship", "User's sister is Maria")]),
+        ("I work at Acme, it's fine", [("work", "User works at Acme")]),
+        ("I really like hiking.", [("personal", "User likes hiking")]),
+        ("I love green tea", [("personal", "User likes green tea")]),
+        ("remind me to call mom", [("reminder", "Remind the user to call mom")]),
+        ("I like that idea", []),
+        ("I love it!", []),
+        ("I like your suggestion, thanks", []),
+        ("I like to think so", []),
+        ("Yes, I like the way you put it", []),
+        ("I love how this turned out", []),
+        ("my name is anna", []),
+    ],
+)
+def test_extractor_rules(pipeline_module, text, facts):
+    assert pipeline_module.RuleBasedMemoryExtractor().extract(text) == facts
+
+
+def test_extraction_is_off_by_default(pipeline):
+    assert pipeline.valves.AUTO_EXTRACT_MEMORIES is False
+
+    asyncio.run(pipeline.outlet(user_turn("My name is Anna Smith.")))
+
+    assert pipeline._memory_queue is None
+    assert pipeline.tools.memory.get_all_memories() == {}
+
+
+def test_outlet_stores_new_facts_once(pipeline):
+    pipeline.valves.AUTO_EXTRACT_MEMORIES = True
+
+    async def turns():
+        await pipeline.outlet(user_turn("My name is Anna Smith. I love jazz."))
+        await pipeline.outlet(user_turn("Again: my name is Anna Smith"))
+        await pipeline.on_shutdown()
+
+    asyncio.run(turns())
+
+    memos = [entry["memo"] for entry in pipeline.tools.memory.get_all_memories().values()]
+    assert memos == ["User's name is Anna Smith", "User likes jazz"]
+
+
+def test_inlet_injects_relevant_memories(pipeline):
+    pipeline.tools.memory.add_to_memory("wellness", "User is allergic to peanuts", "user")
+    pipeline.tools.memory.add_to_memory("work", "User works at Acme", "user")
+
+    body = asyncio.run(pipeline.inlet(user_turn("Any peanuts in this recipe?")))
+
+    system = body["messages"][0]
+    assert system["role"] == "system"
+    assert "[wellness] User is allergic to peanuts (index 1)" in system["content"]
+    assert "Acme" not in system["content"]
+
+
+def test_extracted_facts_are_written_off_the_event_loop(pipeline, monkeypatch):
+    pipeline.valves.AUTO_EXTRACT_MEMORIES = True
+    pipeline.tools.valves.MAX_MEMORIES = 1
+    memory_class = type(pipeline.tools.memory)
+    threads = []
+    original = memory_class.add_to_memory
+
+    def add(self, *args):
+        threads.append(threading.get_ident())
+        return original(self, *args)
+
+    monkeypatch.setattr(memory_class, "add_to_memory", add)
+
+    async def turns():
+        await pipeline.outlet(user_turn("My name is Anna Smith. I love jazz."))
+        await pipeline.on_shutdown()
+
+    asyncio.run(turns())
+
+    assert len(threads) == 2 and threading.get_ident() not in threads
+    assert [
+        entry["memo"] for entry in pipeline.tools.memory.get_all_memories().values()
+    ] == ["User likes jazz"]  # The quota ran on the writer's connection too
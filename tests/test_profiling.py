@@ -0,0 +1,88 @@
+"""Sampled profile captures of individual tool calls."""
+
+import asyncio
+import json
+import os
+
+import pytest
+
+
+@pytest.fixture
+def profiled(tools, tmp_path):
+    tools.valves.PROFILE_SAMPLE_RATE = 1.0
+    tools.valves.PROFILE_DIR = str(tmp_path / "profiles")
+    return tools
+
+
+def captures(tools):
+    return sorted(
+        name for name in os.listdir(tools.valves.PROFILE_DIR) if name.endswith(".json")
+    )
+
+
+def test_call_writes_summary_and_collapsed_stacks(profiled):
+    profiled.memory.add_to_memory("work", "Report due Friday", "user")
+
+    result = asyncio.run(profiled.recall_memories())
+
+    assert "Report due Friday" in result
+    (name,) = captures(profiled)
+    with open(os.path.join(profiled.valves.PROFILE_DIR, name)) as f:
+        summary = json.load(f)
+    assert summary["tool"] == "recall_memories"
+    assert summary["wall_ms"] > 0
+    assert any("FROM" in entry["statement"] for entry in summary["sql"])
+    assert os.path.exists(
+        os.path.join(profiled.valves.PROFILE_DIR, summary["collapsed_stacks"])
+    )
+    assert profiled.memory.sql_trace is None  # Only traced during the call
+
+
+def test_calls_are_not_profiled_by_default(tools, memory_dir):
+    asyncio.run(tools.recall_memories())
+
+    assert not os.path.exists(os.path.join(memory_dir, ".profiles"))
+
+
+def test_only_the_newest_captures_are_kept(profiled):
+    profiled.valves.PROFILE_MAX_FILES = 2
+
+    for _ in range(3):
+        asyncio.run(profiled.recall_memories())
+
+    assert len(captures(profiled)) == 2
+    assert len(os.listdir(profiled.valves.PROFILE_DIR)) == 4
+
+
+def test_failing_call_is_still_captured(profiled, monkeypatch):
+    def broken(tag=None):
+        raise RuntimeError("broken")
+
+    monkeypatch.setattr(profiled.memory, "get_all_memories", broken)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(profiled.recall_memories())
+    monkeypatch.undo()
+    asyncio.run(profiled.recall_memories())  # The capture slot was released
+
+    assert len(captures(profiled)) == 2
+
+
+def test_unwritable_profile_dir_does_not_fail_the_call(profiled, tmp_path, capsys):
+    (tmp_path / "file").write_text("")
+    profiled.valves.PROFILE_DIR = str(tmp_path / "file")
+
+    assert asyncio.run(profiled.recall_memories())
+    assert "Error writing profile for recall_memories" in capsys.readouterr().out
+    assert asyncio.run(profiled.recall_memories())
+
+
+def test_one_capture_at_a_time(flash, tmp_path):
+    first = flash.ToolProfiler.start(1.0, str(tmp_path), 10)
+    try:
+        assert flash.ToolProfiler.start(1.0, str(tmp_path), 10) is None
+    finally:
+        first.stop("first")
+    second = flash.ToolProfiler.start(1.0, str(tmp_path), 10)
+    second.stop("second")
+    assert flash.ToolProfiler.start(0.0, str(tmp_path), 10) is None
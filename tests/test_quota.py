@@ -0,0 +1,149 @@
+"""Memory quotas and access-aware eviction."""
+
+import asyncio
+import sqlite3
+
+import pytest
+
+
+def stored(memory, rows):
+    """Add rows of (tag, memo, last used, reads) with set usage statistics."""
+    for tag, memo, last_used, reads in rows:
+        memory.add_to_memory(tag, memo, "user")
+    memory.conn.executemany(
+        "UPDATE memories SET last_modified = ?, access_count = ? WHERE memo = ?",
+        [(last_used, reads, memo) for _, memo, last_used, reads in rows],
+    )
+    memory.conn.commit()
+
+
+def hot(memory):
+    return sorted(
+        memo for (memo,) in memory.conn.execute("SELECT memo FROM live_memories")
+    )
+
+
+@pytest.fixture
+def three(memory):
+    stored(
+        memory,
+        [
+            ("others", "Old and often read", "2024-01-01_10:00:00", 9),
+            ("others", "Recent, never read", "2024-03-01_10:00:00", 0),
+            ("personal", "Middle, read thrice", "2024-02-01_10:00:00", 3),
+        ],
+    )
+    return memory
+
+
+def test_lru_evicts_the_least_recently_used(three):
+    assert three.enforce_quota(max_rows=2, policy="lru") == (
+        "Archived 1 memories to stay within the memory quota."
+    )
+    assert hot(three) == ["Middle, read thrice", "Recent, never read"]
+
+
+def test_lfu_evicts_the_least_read(three):
+    three.enforce_quota(max_rows=2, policy="lfu")
+
+    assert hot(three) == ["Middle, read thrice", "Old and often read"]
+
+
+def test_weighted_keeps_high_priority_tags(three):
+    three.enforce_quota(max_rows=1, policy="weighted")
+
+    assert hot(three) == ["Middle, read thrice"]
+
+
+def test_reads_count_towards_lru(memory):
+    stored(
+        memory,
+        [
+            ("others", "Read just now", "2024-01-01_10:00:00", 0),
+            ("others", "Untouched", "2024-02-01_10:00:00", 0),
+        ],
+    )
+    memory.retrieve_from_memory(1)
+
+    memory.enforce_quota(max_rows=1, policy="lru")
+
+    assert hot(memory) == ["Read just now"]
+
+
+def test_archived_victims_stay_retrievable(three):
+    three.enforce_quota(max_rows=2, policy="lru")
+
+    victim = three.retrieve_from_memory(1)
+    assert (victim["memo"], victim["archived"]) == ("Old and often read", True)
+
+
+def test_deleted_victims_are_gone(three):
+    assert three.enforce_quota(max_rows=1, policy="lru", action="delete") == (
+        "Deleted 2 memories to stay within the memory quota."
+    )
+    assert three.retrieve_from_memory(1) is None
+    assert hot(three) == ["Recent, never read"]
+
+
+def test_byte_quota_counts_tag_memo_and_author(memory):
+    stored(
+        memory,
+        [
+            ("work", "a" * 100, "2024-01-01_10:00:00", 0),
+            ("work", "b" * 100, "2024-02-01_10:00:00", 0),
+        ],
+    )
+
+    memory.enforce_quota(max_bytes=len("work") + 100 + len("user"), policy="lru")
+
+    assert hot(memory) == ["b" * 100]
+
+
+def test_within_quota_evicts_nothing(three):
+    assert three.enforce_quota(max_rows=3, batch_size=1) == (
+        "Archived 0 memories to stay within the memory quota."
+    )
+    assert len(hot(three)) == 3
+
+
+@pytest.mark.parametrize(
+    "kwargs, message",
+    [
+        ({}, "No memory quota set."),
+        (
+            {"max_rows": 1, "policy": "fifo"},
+            "Unknown eviction policy 'fifo', use lru, lfu or weighted.",
+        ),
+        (
+            {"max_rows": 1, "action": "drop"},
+            "Unknown eviction action 'drop', use archive or delete.",
+        ),
+    ],
+)
+def test_invalid_settings(three, kwargs, message):
+    assert three.enforce_quota(**kwargs) == message
+    assert len(hot(three)) == 3
+
+
+def test_locked_file_reports_an_error_and_evicts_nothing(three, memory_dir):
+    three.conn.execute("PRAGMA busy_timeout = 0")
+    other = sqlite3.connect(f"{memory_dir}/chat_memory.db", isolation_level=None)
+    other.execute("BEGIN EXCLUSIVE")
+    try:
+        message = three.enforce_quota(max_rows=1)
+    finally:
+        other.rollback()
+        other.close()
+
+    assert message.startswith("Database error enforcing memory quota:")
+    assert len(hot(three)) == 3
+
+
+def test_refresh_enforces_the_quota_valves(tools, three):
+    tools.memory = three
+    tools.valves.MAX_MEMORIES = 2
+    tools.valves.EVICTION_POLICY = "lru"
+
+    asyncio.run(tools.refresh_memory())
+
+    assert hot(three) == ["Middle, read thrice", "Recent, never read"]
@@ -0,0 +1,78 @@
+"""Trigger-fed change log and pull-based replication between two directories."""
+
+import pytest
+
+
+@pytest.fixture
+def leader(make_memory, memory_dir):
+    return make_memory(directory=memory_dir + "_leader")
+
+
+@pytest.fixture
+def follower(make_memory, memory_dir):
+    return make_memory(directory=memory_dir + "_follower")
+
+
+def contents(memory):
+    return {
+        index: (entry["tag"], entry["memo"], entry["by"])
+        for index, entry in memory.get_all_memories().items()
+    }
+
+
+def test_changes_are_logged_in_sequence(leader):
+    leader.add_to_memory("work", "First", "user")
+    leader.update_memory_by_index(1, "life", "First, edited", "LLM")
+    leader.delete_memory_by_index(1)
+
+    changes = [change for batch in leader.changes_since(0) for change in batch]
+
+    assert [change["op"] for change in changes] == ["insert", "update", "delete"]
+    assert [change["seq"] for change in changes] == sorted(
+        change["seq"] for change in changes
+    )
+    assert changes[1]["tag"] == "life" and changes[1]["by"] == "LLM"
+
+
+def test_follower_converges_and_reapplying_is_harmless(leader, follower):
+    for number in range(5):
+        leader.add_to_memory("work", f"Memo {number}", "user")
+    leader.update_memory_by_index(2, "personal", "Memo 1, edited", "LLM")
+    leader.delete_memory_by_index(4)
+
+    follower.sync_from(leader, source="leader", batch_size=2)
+    assert contents(follower) == contents(leader)
+
+    last = follower.last_applied_seq("leader")
+    batch = next(leader.changes_since(0))
+    assert "Applied 0 changes" in follower.apply_changes(batch, "leader")
+    assert follower.last_applied_seq("leader") == last
+    assert contents(follower) == contents(leader)
+    assert follower.sync_from(leader, source="leader") == (
+        "Already up to date with leader."
+    )
+
+
+def test_archive_and_clear_replicate(leader, follower):
+    leader.add_to_memory("work", "Old", "user")
+    leader.conn.execute("UPDATE memories SET last_modified = '2020-01-01_00:00:00'")
+    leader.conn.commit()
+    leader.add_to_memory("work", "New", "user")
+    leader.archive_memories(30)
+    follower.sync_from(leader, source="leader")
+    assert follower.retrieve_from_memory(1)["archived"]
+    assert contents(follower) == {2: ("work", "New", "user")}
+
+    leader.clear_memory()
+    leader.add_to_memory("life", "After the clear", "user")
+    follower.sync_from(leader, source="leader")
+    assert contents(follower) == {3: ("life", "After the clear", "user")}
+    assert follower.retrieve_from_memory(1) is None
+
+
+def test_truncate_change_log(leader):
+    for number in range(5):
+        leader.add_to_memory("work", f"Memo {number}", "user")
+
+    assert leader.truncate_change_log(3, batch_size=2).startswith("Removed 3 ")
+    assert [change["seq"] for change in next(leader.changes_since(0))] == [4, 5]
@@ -0,0 +1,96 @@
+"""In-memory session files and their exclusive hold on the file."""
+
+import sqlite3
+
+
+def rows_on_disk(memory_dir, name="scratch.db"):
+    with sqlite3.connect(f"{memory_dir}/{name}") as conn:
+        return sorted(row[0] for row in conn.execute("SELECT memo FROM memories"))
+
+
+def test_session_is_written_back_when_switching_away(make_memory, memory_dir):
+    memory = make_memory()
+    message = memory.switch_memory_file("scratch.db", in_memory=True)
+    assert message == "Switched to in-memory session for database file: scratch.db"
+
+    memory.add_to_memory("work", "Scratch note", "user")
+    assert memory.persist_session() == "Session scratch.db persisted to disk."
+    assert memory.persist_session() == "Session scratch.db is already persisted."
+    memory.add_to_memory("work", "Second note", "user")
+    memory.switch_memory_file("chat_memory.db")
+
+    assert rows_on_disk(memory_dir) == ["Scratch note", "Second note"]
+
+
+def test_session_loads_the_file_on_first_use(make_memory, memory_dir, monkeypatch):
+    memory = make_memory("scratch.db")
+    memory.add_to_memory("work", "On disk", "user")
+    memory.switch_memory_file("chat_memory.db")
+    loads = []
+    original = memory._load_session
+    monkeypatch.setattr(memory, "_load_session", lambda: loads.append(1) or original())
+
+    memory.switch_memory_file("scratch.db", in_memory=True)
+    assert loads == []
+
+    assert [entry["memo"] for entry in memory.get_all_memories().values()] == [
+        "On disk"
+    ]
+    assert loads == [1]
+
+
+def test_unused_session_leaves_the_file_alone(make_memory, memory_dir):
+    memory = make_memory("scratch.db")
+    memory.add_to_memory("work", "On disk", "user")
+    memory.switch_memory_file("chat_memory.db")
+
+    memory.switch_memory_file("scratch.db", in_memory=True)
+    memory.close_db_connection()
+
+    assert rows_on_disk(memory_dir) == ["On disk"]
+
+
+def test_file_open_elsewhere_is_not_taken_into_ram(make_memory, memory_dir):
+    other = make_memory("scratch.db")  # Another worker has the file open
+    memory = make_memory()
+
+    message = memory.switch_memory_file("scratch.db", in_memory=True)
+
+    assert "not as an in-memory session" in message
+    assert not memory.in_memory
+    memory.add_to_memory("work", "Mine", "user")
+    other.add_to_memory("work", "Theirs", "user")
+    assert rows_on_disk(memory_dir) == ["Mine", "Theirs"]
+
+
+def test_writes_from_other_workers_during_a_session_are_kept(make_memory, memory_dir):
+    memory = make_memory()
+    memory.switch_memory_file("scratch.db", in_memory=True)
+    memory.add_to_memory("work", "Session note", "user")
+
+    other = make_memory("scratch.db")  # Locked out while the session runs
+    assert other.conn is None
+    assert other.add_to_memory("work", "Other worker", "user").startswith(
+        "Memory add queued"
+    )
+    memory.add_to_memory("work", "Later session note", "user")  # Merges the spool
+    memory.switch_memory_file("chat_memory.db")
+
+    assert rows_on_disk(memory_dir) == [
+        "Later session note",
+        "Other worker",
+        "Session note",
+    ]
+    # The other worker reconnects once the session is over
+    assert other.add_to_memory("work", "After", "user") == "Memory added successfully."
+    assert len(other.get_all_memories()) == 4
+
+
+def test_session_file_cannot_be_deleted_elsewhere(make_memory):
+    memory = make_memory()
+    memory.switch_memory_file("scratch.db", in_memory=True)
+    memory.add_to_memory("work", "Session note", "user")
+    memory.persist_session()
+
+    other = make_memory("other.db")
+    assert "in use by another process" in other.delete_memory_file("scratch.db")
@@ -0,0 +1,110 @@
+"""Cold start: what loading a tool and building Tools costs before first use."""
+
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+
+from conftest import FLASH_PATH, ROOT
+
+# Imported where they are used; only worth checking if no dependency loads them
+LAZY_MODULES = (
+    "concurrent.futures",
+    "difflib",
+    "gzip",
+    "hashlib",
+    "mmap",
+    "shutil",
+    "tarfile",
+    "tempfile",
+    "tracemalloc",
+)
+
+LOAD_SCRIPT = """
+import json, sys
+import asyncio, sqlite3, zlib
+from pydantic import BaseModel, Field
+class Valves(BaseModel):  # Pydantic loads its plugins with the first model
+    probe: int = Field(default=0)
+dependencies = set(sys.modules)
+import importlib.machinery, importlib.util
+loader = importlib.machinery.SourceFileLoader("flash_ai", sys.argv[1])
+spec = importlib.util.spec_from_loader("flash_ai", loader)
+tool = importlib.util.module_from_spec(spec)
+loader.exec_module(tool)
+tool.Tools()
+print(json.dumps([sorted(dependencies), sorted(sys.modules)]))
+"""
+
+
+def test_loading_the_tool_skips_lazy_modules(tmp_path):
+    result = subprocess.run(
+        [sys.executable, "-c", LOAD_SCRIPT, FLASH_PATH],
+        cwd=tmp_path,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    dependencies, loaded = map(set, json.loads(result.stdout))
+
+    assert [
+        name for name in LAZY_MODULES if name in loaded and name not in dependencies
+    ] == []
+    assert not os.path.exists(tmp_path / "memory_dbs")  # Opened on first use
+
+
+FIRST_CALL_SCRIPT = """
+import asyncio, importlib.machinery, importlib.util, json, sys
+loader = importlib.machinery.SourceFileLoader("flash_ai", sys.argv[1])
+spec = importlib.util.spec_from_loader("flash_ai", loader)
+tool = importlib.util.module_from_spec(spec)
+loader.exec_module(tool)
+tools = tool.Tools()
+tools.valves.DEBUG = False
+asyncio.run(tools.recall_memories())
+print(json.dumps(sorted(name for name in tool._DEFERRED if name in vars(tool))))
+"""
+
+
+def test_rarely_used_classes_are_compiled_on_first_use(tmp_path):
+    result = subprocess.run(
+        [sys.executable, "-c", FIRST_CALL_SCRIPT, FLASH_PATH],
+        cwd=tmp_path,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    assert json.loads(result.stdout.strip().splitlines()[-1]) == []
+
+
+def test_deferred_classes_keep_their_line_numbers(flash):
+    with open(FLASH_PATH) as f:
+        lines = f.read().splitlines()
+
+    for name in flash._DEFERRED:
+        init = vars(getattr(flash, name)).get("__init__")
+        if init is None:  # Inherited
+            continue
+        line = init.__code__.co_firstlineno
+        assert lines[line - 1].strip().startswith("def __init__("), name
+
+
+def test_startup_benchmark_runs(tmp_path):
+    spec = importlib.util.spec_from_file_location(
+        "startup_benchmark", os.path.join(ROOT, "benchmarks", "startup.py")
+    )
+    benchmark = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(benchmark)
+
+    report = benchmark.run(["flash"], runs=1, directory=str(tmp_path), against="HEAD")
+
+    assert sorted(report) == ["flash", "flash@HEAD"]
+    assert sorted(report["flash"]) == ["existing", "fresh"]
+    assert all(
+        seconds > 0
+        for labels in report.values()
+        for steps in labels.values()
+        for seconds in steps.values()
+    )
@@ -0,0 +1,62 @@
+"""Per-file tag taxonomies and tag validation."""
+
+import asyncio
+import sqlite3
+
+import pytest
+
+
+@pytest.fixture
+def locked(memory_dir):
+    """Another connection holding an exclusive lock on chat_memory.db."""
+    other = sqlite3.connect(f"{memory_dir}/chat_memory.db", isolation_level=None)
+    other.execute("BEGIN EXCLUSIVE")
+    yield
+    other.rollback()
+    other.close()
+
+
+def no_wait(memory):
+    memory.conn.execute("PRAGMA busy_timeout = 0")
+
+
+def test_each_file_has_its_own_taxonomy(make_memory):
+    memory = make_memory()
+    assert memory.add_memory_tag("Recipes") == "Tag 'recipes' is available in chat_memory.db."
+    assert memory.valid_tag("recipes") == "recipes"
+
+    memory.switch_memory_file("other.db")
+    assert memory.valid_tag("recipes") == "others"
+    assert memory.valid_tag("work") == "work"
+
+
+def test_locked_file_validates_against_the_last_taxonomy(memory, request):
+    memory.add_memory_tag("recipes")
+    no_wait(memory)
+    request.getfixturevalue("locked")
+
+    assert memory.valid_tag("recipes") == "recipes"
+    assert memory.valid_tag("unknown") == "others"
+    assert "recipes" in memory.memory_tags()
+
+
+def test_locked_new_file_validates_against_the_default_tags(memory, request):
+    no_wait(memory)
+    request.getfixturevalue("locked")
+
+    assert memory.valid_tag("work") == "work"
+    assert memory.valid_tag("unknown") == "others"
+
+
+def test_adding_several_memories_to_a_locked_file_does_not_raise(tools, request):
+    no_wait(tools.memory)
+    request.getfixturevalue("locked")
+
+    result = asyncio.run(
+        tools.add_multiple_memories(
+            [{"tag": "work", "memo": "Report due Friday", "by": "user"}],
+            llm_wants_to_add=True,
+        )
+    )
+
+    assert result.startswith("Memory 1 added with tag work by user.")
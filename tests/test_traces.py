@@ -0,0 +1,214 @@
+"""Recording tool calls with anonymized parameters, and replaying them."""
+
+import asyncio
+import gzip
+import os
+
+import pytest
+
+
+@pytest.fixture
+def recording(flash, tools, tmp_path):
+    tools.valves.RECORD_TOOL_CALLS = True
+    tools.valves.TRACE_DIR = str(tmp_path / "traces")
+    return tools
+
+
+def recorded_calls(flash, trace_dir, memory_dir):
+    flash.ToolCallRecorder.flush_all()
+    return flash.ToolCallReplayer(trace_dir, memory_dir).load()
+
+
+def test_file_names_get_one_pseudonym_everywhere(flash, recording, memory_dir):
+    tools = recording
+
+    async def calls():
+        await tools.create_or_switch_memory_file("alice_notes")
+        await tools.create_or_switch_memory_file("chat_memory")
+        await tools.delete_memory_file("alice_notes.db", user_confirmation=False)
+        await tools.delete_memory_file("alice_notes.db", user_confirmation=True)
+
+    asyncio.run(calls())
+    calls = recorded_calls(flash, tools.valves.TRACE_DIR, memory_dir)
+
+    name = calls[0]["params"]["new_file_name"]
+    assert name.startswith("file_") and "." not in name
+    assert calls[1]["file"] == f"{name}.db"
+    assert [call["params"]["file_to_delete"] for call in calls[2:]] == [
+        f"{name}.db",
+        f"{name}.db",
+    ]
+    assert calls[0]["file"] != calls[1]["file"]  # chat_memory.db, then alice_notes.db
+    for trace in os.listdir(tools.valves.TRACE_DIR):
+        if trace.endswith(".trace.gz"):
+            with gzip.open(os.path.join(tools.valves.TRACE_DIR, trace), "rt") as f:
+                assert "alice" not in f.read()
+
+
+def test_workers_share_the_file_name_key(flash, tmp_path):
+    first = flash.ToolCallRecorder(str(tmp_path))
+    second = flash.ToolCallRecorder(str(tmp_path))
+
+    assert first._anonymize("notes.db", "file_to_delete") == second._anonymize(
+        "notes.db", "file_to_delete"
+    )
+    assert first._anonymize("notes.db", "file_to_delete") != (
+        flash.ToolCallRecorder(str(tmp_path / "other"))._anonymize(
+            "notes.db", "file_to_delete"
+        )
+    )
+
+
+def test_replay_finds_the_renamed_copies(flash, recording, memory_dir):
+    tools = recording
+    tools.memory.switch_memory_file("alice_notes.db")
+    tools.memory.add_to_memory("work", "Report due Friday", "user")
+    asyncio.run(tools.recall_memories())
+    calls = recorded_calls(flash, tools.valves.TRACE_DIR, memory_dir)
+    recalled = []
+
+    class Replayed(flash.Tools):
+        async def recall_memories(self, *args, **kwargs):
+            recalled.append(self.memory.get_all_memories())
+
+    replayer = flash.ToolCallReplayer(tools.valves.TRACE_DIR, memory_dir, speed=0)
+    report = asyncio.run(replayer.run(Replayed))
+
+    key = flash.ToolCallRecorder.file_key(tools.valves.TRACE_DIR, create=False)
+    words = flash.ToolCallRecorder.word_key(key)
+
+    assert calls[0]["file"].startswith("file_")
+    assert report["errors"] == 0
+    assert [
+        [entry["memo"] for entry in memories.values()] for memories in recalled
+    ] == [[flash.ToolCallRecorder.pseudonymize("Report due Friday", words)]]
+    assert sorted(os.listdir(memory_dir)) == [
+        ".locks",
+        "alice_notes.db",
+        "chat_memory.db",
+    ]
+
+
+def test_timestamps_keep_their_shape(flash, recording, memory_dir):
+    tools = recording
+
+    async def calls():
+        await tools.memories_as_of("2024-01-01 10:00:00")
+        await tools.memories_as_of("yesterday at noon")
+
+    asyncio.run(calls())
+    calls = recorded_calls(flash, tools.valves.TRACE_DIR, memory_dir)
+
+    assert calls[0]["params"]["timestamp"] == "2024-01-01 10:00:00"
+    assert "yesterday" not in calls[1]["params"]["timestamp"]
+
+
+def test_replayed_lookups_find_the_pseudonymized_memos(flash, recording, memory_dir):
+    tools = recording
+    tools.memory.add_to_memory("person", "Anna moved to Berlin", "user")
+    tools.memory.add_to_memory("work", "Quarterly report goes to Dana", "user")
+    tools.memory.conn.execute(
+        "UPDATE memories SET last_modified = '2020-01-01_10:00:00' WHERE id = 2"
+    )
+    tools.memory.conn.commit()
+    tools.memory.archive_memories(30)
+
+    async def calls():
+        await tools.memories_about("Anna")
+        await tools.recall_archived_memories(keyword="quarterly report")
+        await tools.memories_as_of("2999-01-01 00:00:00")
+
+    asyncio.run(calls())
+    flash.ToolCallRecorder.flush_all()
+    results = []
+
+    class Replayed(flash.Tools):
+        async def memories_about(self, *args, **kwargs):
+            results.append(await super().memories_about(*args, **kwargs))
+
+        async def recall_archived_memories(self, *args, **kwargs):
+            results.append(await super().recall_archived_memories(*args, **kwargs))
+
+        async def memories_as_of(self, *args, **kwargs):
+            results.append(await super().memories_as_of(*args, **kwargs))
+
+    replayer = flash.ToolCallReplayer(tools.valves.TRACE_DIR, memory_dir, speed=0)
+    report = asyncio.run(replayer.run(Replayed))
+
+    assert report["errors"] == 0
+    assert [result.split(" are : ")[0].split()[0] for result in results] == [
+        "Memories",
+        "Archived",
+        "Memories",
+    ]
+    assert "Anna" not in "".join(results) and "Dana" not in "".join(results)
+
+
+def test_error_results_count_as_errors(flash, recording, memory_dir):
+    tools = recording
+    asyncio.run(tools.memories_as_of("yesterday at noon"))
+    asyncio.run(tools.recall_memories())
+    flash.ToolCallRecorder.flush_all()
+
+    replayer = flash.ToolCallReplayer(tools.valves.TRACE_DIR, memory_dir, speed=0)
+    report = asyncio.run(replayer.run(flash.Tools))
+
+    assert report["errors"] == 1
+    assert report["by_tool"]["memories_as_of"]["errors"] == 1
+    assert report["by_tool"]["recall_memories"]["errors"] == 0
+
+
+def test_rewriting_memos_covers_history_archive_and_indexes(memory):
+    memo = "Anna booked the flight to Lisbon for the conference in spring"
+    memory.add_to_memory("person", memo, "user")
+    memory.update_memory_by_index(1, "person", memo.replace("flight", "train"), "user")
+    memory.compact_history(3650, delta_min_length=1)
+    memory.add_to_memory("work", "Quarterly report goes to Dana", "user")
+    memory.conn.execute(
+        "UPDATE memories SET last_modified = '2020-01-01_10:00:00' WHERE id = 2"
+    )
+    memory.conn.commit()
+    memory.archive_memories(30)
+    logged = memory.conn.execute("SELECT MAX(seq) FROM memory_changelog").fetchone()
+    assert memory.conn.execute(
+        "SELECT codec FROM memory_history WHERE memory_id = 1"
+    ).fetchall() == [("delta",)]
+
+    memory.rewrite_memos(
+        lambda text: text.replace("Anna", "Bea").replace("Dana", "Cleo")
+    )
+
+    assert [entry["memo"] for entry in memory.memory_history(1)] == [
+        "Bea booked the flight to Lisbon for the conference in spring",
+        "Bea booked the train to Lisbon for the conference in spring",
+    ]
+    assert list(memory.memories_about("Bea")) == [1]
+    assert memory.memories_about("Anna") == {}
+    assert list(memory.memories_about("Cleo")) == [2]
+    assert list(memory.search_archived_memories(keyword="goes to cleo")) == [2]
+    assert memory.search_archived_memories(keyword="dana") == {}
+    assert (
+        memory.conn.execute("SELECT MAX(seq) FROM memory_changelog").fetchone()
+        == logged
+    )
+    assert memory.conn.execute(
+        "SELECT COUNT(*) FROM memory_changelog WHERE memo LIKE '%Anna%'"
+    ).fetchone() == (0,)
+    memory.update_memory_by_index(1, "person", "Bea moved", "user")
+    assert len(memory.memory_history(1)) == 3  # The history trigger is back
+
+
+def test_rewriting_an_append_log_keeps_its_versions(make_memory):
+    memory = make_memory("notes.db", backend="appendlog")
+    memory.add_to_memory("person", "Anna moved", "user")
+    memory.update_memory_by_index(1, "person", "Anna moved to Berlin", "user")
+
+    memory.rewrite_memos(str.upper)
+
+    assert [entry["memo"] for entry in memory.memory_history(1)] == [
+        "ANNA MOVED",
+        "ANNA MOVED TO BERLIN",
+    ]
+    assert make_memory("notes.db", backend="appendlog").get_all_memories()[1][
+        "memo"
+    ] == ("ANNA MOVED TO BERLIN")
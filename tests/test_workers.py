@@ -0,0 +1,66 @@
+"""Several worker processes sharing one memory directory."""
+
+import importlib
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import FLASH_PATH, ROOT
+
+DELETE_SCRIPT = """
+import importlib.machinery, importlib.util, sys
+loader = importlib.machinery.SourceFileLoader("flash_ai", sys.argv[1])
+spec = importlib.util.spec_from_loader("flash_ai", loader)
+tool = importlib.util.module_from_spec(spec)
+loader.exec_module(tool)
+memory = tool.MemoryFunctions(debug=False, directory=sys.argv[2])
+print(memory.delete_memory_file(sys.argv[3]))
+memory.close_db_connection()
+tool.BackgroundReclaimer.shared().wait()
+"""
+
+
+@pytest.fixture(scope="module")
+def stress():
+    # Importable by name, so the spawned workers can find their entry point
+    sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+    try:
+        yield importlib.import_module("stress")
+    finally:
+        sys.path.remove(os.path.join(ROOT, "benchmarks"))
+
+
+def delete_in_other_process(directory, name):
+    return subprocess.run(
+        [sys.executable, "-c", DELETE_SCRIPT, FLASH_PATH, directory, name],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.strip()
+
+
+def test_stress_loses_no_updates(stress, tmp_path):
+    report = stress.run(processes=4, operations=60, directory=str(tmp_path))
+
+    assert report["errors"] == []
+    assert report["acknowledged"] > 0
+    assert report["lost"] == [] and report["duplicated"] == []
+
+
+def test_delete_in_another_process_invalidates_caches(make_memory, memory_dir):
+    memory = make_memory()
+    other = make_memory("other.db")
+    other.add_to_memory("work", "Memo", "user")
+    other.close_db_connection()
+    assert "other.db" in memory.list_memory_files()
+    memory._archive_dicts = {1: b"cached"}
+
+    assert delete_in_other_process(memory_dir, "other.db") == (
+        "File 'other.db' deleted successfully."
+    )
+
+    memory.get_all_memories()  # Any use of the connection checks the counter
+    assert memory._archive_dicts == {}
+    assert memory.list_memory_files() == ["chat_memory.db"]